@@ -0,0 +1,67 @@
+import time
+import json
+import hashlib
+from django.core.cache import cache
+
+VERSION_CACHE_KEY = 'serrano:version:{0}'
+
+# Version keys are kept for as long as the cache allows.
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def _initial_version():
+    # A version key may be evicted while entries stored under it are still
+    # cached. Starting from the current time rather than a constant prevents
+    # those entries from becoming valid again.
+    return int(time.time() * 1000)
+
+
+def get_version(name):
+    """Returns the current version for `name`.
+
+    Versions are used as part of cache keys so all entries for a name can
+    be invalidated at once by incrementing it with `incr_version`.
+    """
+    key = VERSION_CACHE_KEY.format(name)
+    version = cache.get(key)
+
+    if version is None:
+        version = _initial_version()
+        cache.add(key, version, VERSION_TIMEOUT)
+        version = cache.get(key, version)
+
+    return version
+
+
+def incr_version(name):
+    "Increments the version for `name` and returns the new version."
+    key = VERSION_CACHE_KEY.format(name)
+
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _initial_version()
+        cache.set(key, version, VERSION_TIMEOUT)
+        return version
+
+
+def make_key(prefix, *parts):
+    """Returns a cache key for `prefix` and a hash of `parts`.
+
+    The parts must be JSON serializable and are normalized by sorting the
+    keys of mappings so equivalent structures produce the same key.
+    """
+    data = json.dumps(parts, sort_keys=True)
+    return '{0}:{1}'.format(prefix, hashlib.md5(data).hexdigest())
+
+
+def get_preview_version(owner):
+    "Returns the version of the cached preview pages of `owner`."
+    return get_version('preview:{0}'.format(owner))
+
+
+def invalidate_preview_cache(owner):
+    """Invalidates the cached preview pages of `owner`, a user or session
+    identifier as returned by `serrano.utils.get_request_owner`.
+    """
+    return incr_version('preview:{0}'.format(owner))
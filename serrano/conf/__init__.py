@@ -65,6 +65,11 @@ def test_setting_changed_handler(**kwargs):
     elif kwargs['setting'].startswith(SETTING_PREFIX):
         key = kwargs['setting'][SETTING_PREFIX_LEN:]
         value = kwargs['value']
+
+        # Restore the default when an overridden setting is removed
+        if not hasattr(django_settings, kwargs['setting']):
+            value = getattr(global_settings, key, None)
+
         setattr(settings, key, value)
 
 
@@ -121,10 +126,28 @@ class Objectset(Dependency):
             return False
 
 
+class Numpy(Dependency):
+    """NumPy is used to cluster and detect outliers in the distributions of
+    continuous fields using arrays rather than Python lists, which supports
+    distributions with many more observations.
+
+    Install by doing `pip install numpy`.
+    """
+
+    name = 'numpy'
+
+    def test_install(self):
+        try:
+            import numpy  # noqa
+        except ImportError:
+            return False
+
+
 # Keep track of the officially supported apps and libraries used for various
 # features.
 OPTIONAL_DEPS = {
     'objectset': Objectset(),
+    'numpy': Numpy(),
 }
 
 
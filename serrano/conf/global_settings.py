@@ -67,3 +67,176 @@ CHECK_ORPHANED_FIELDS = True
 # the request has been complete.
 EXPORT_COOKIE_NAME_TEMPLATE = 'export-type-{0}'
 EXPORT_COOKIE_DATA = 'complete'
+
+# If true, exports are streamed to the client as they are written rather
+# than being buffered entirely in memory before the response is sent. This
+# can be toggled per request using the `stream` parameter. On PostgreSQL the
+# rows are read with a server-side cursor. The memory used stays constant as
+# the number of rows grows only if the rows are distinct, which is the case
+# when a context is applied and the view is not ordered by columns it does
+# not include. Otherwise the exporter keeps track of every row written to
+# remove duplicates, and other databases may buffer the result set.
+EXPORT_STREAMING = False
+
+# Integer of bytes a streaming export accumulates before sending a chunk
+# to the client.
+EXPORT_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Dotted path to the class used to run background jobs, such as
+# asynchronous exports. The default runs jobs in a pool of threads local to
+# each process. Use 'serrano.jobs.ImmediateQueue' to run jobs inline. A
+# custom class only needs to implement `enqueue(func, *args, **kwargs)`.
+JOB_QUEUE = 'serrano.jobs.ThreadQueue'
+
+# Integer of worker threads used by the default job queue per process.
+JOB_QUEUE_WORKERS = 4
+
+# Directory where the files of asynchronous export jobs are written. This
+# must be shared across processes if more than one is serving the API.
+# Defaults to a `serrano-exports` directory in the system's temp directory.
+EXPORT_JOB_ROOT = None
+
+# Integer of seconds the state of an asynchronous export job is kept. The
+# exported file can no longer be downloaded after the job has expired.
+EXPORT_JOB_TIMEOUT = 60 * 60 * 24
+
+# If true, POST requests to the exporter create a background export job
+# rather than writing the export in the response. The job can be polled
+# for progress and the file downloaded once it completes. This can be
+# toggled per request using the `async` parameter.
+EXPORT_ASYNC = False
+
+# If true, counts of queries are cached using a key derived from the
+# context, view and tree so repeated requests, such as paging through the
+# preview, do not recount the entire result set. Preview counts are cached
+# per user or session since the query processor may restrict the results
+# by request. The counts of saved contexts and queries are shared by all
+# users with the same filters. Cached counts are invalidated when the
+# context changes or the data version is incremented.
+COUNT_CACHE_ENABLED = True
+
+# Integer of seconds a cached count is kept.
+COUNT_CACHE_TIMEOUT = 60 * 60
+
+# If true, saving a context or query does not wait for counts that are not
+# cached. The count is stored as null and computed by a background job on
+# the JOB_QUEUE. Serialized contexts and queries have a `count_pending` flag
+# which clients can poll until the count is available.
+COUNT_DEFERRED = False
+
+# Integer of seconds a deferred count is reported as pending. This bounds
+# how long a job that failed or was lost is reported.
+COUNT_JOB_TIMEOUT = 60 * 60
+
+# If true, the preview returns the database planner's estimated count
+# rather than an exact count when it is not cached. This is currently only
+# supported on PostgreSQL. This can be toggled per request using the
+# `estimate` parameter.
+PREVIEW_COUNT_ESTIMATE = False
+
+# Integer of rows below which an estimated count is replaced by an exact
+# count since counting small result sets is cheap.
+COUNT_ESTIMATE_THRESHOLD = 10000
+
+# If true, the formatted rows of preview pages are cached per user or
+# session so moving back and forth between pages does not rerun the query.
+# Cached pages are invalidated when the user's context or view is saved.
+# Eviction is handled by the cache backend, e.g. memcached evicts the least
+# recently used entries once full.
+PREVIEW_CACHE_ENABLED = True
+
+# Integer of seconds a preview page is cached.
+PREVIEW_CACHE_TIMEOUT = 60 * 10
+
+# If true, the page following a requested preview page is read and cached
+# by a background job so paging forward is served from the cache. This
+# requires PREVIEW_CACHE_ENABLED and can be toggled per request using the
+# `prefetch` parameter.
+PREVIEW_PREFETCH = False
+
+# Integer of prefetch jobs that may be pending or running at once for a
+# single user or session. Further prefetches are skipped until one
+# completes which prevents prefetching from amplifying the load.
+PREVIEW_PREFETCH_LIMIT = 1
+
+# If true, the results of queries for fields, concepts and categories are
+# kept in memory by each process. The results are discarded in all processes
+# when any of these are saved or deleted, which requires a cache backend
+# shared by the processes. Changes made with `QuerySet.update`, such as by
+# the publish and archive actions of the admin, do not send signals and are
+# detected by a few aggregate queries run once per request.
+METADATA_CACHE_ENABLED = True
+
+# Integer of query results kept by the metadata cache of each process. The
+# oldest results are discarded once the limit is reached.
+METADATA_CACHE_MAX_SIZE = 1000
+
+# If true, the stats of fields are cached until the field's data version is
+# incremented. The cache can be populated ahead of time using the
+# `warm_stats` management command.
+FIELD_STATS_CACHE_ENABLED = True
+
+# Integer of seconds the stats of a field are cached.
+FIELD_STATS_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# If true, field distributions are cached by the field, dimensions,
+# parameters and, if context-aware, the context. Cached distributions are
+# invalidated when the data version of any field is incremented.
+DISTRIBUTION_CACHE_ENABLED = True
+
+# Integer of seconds a distribution is cached.
+DISTRIBUTION_CACHE_TIMEOUT = 60 * 60
+
+# Integer of the maximum number of points, including outliers, of a
+# distribution that is cached. Larger distributions are recomputed each time
+# to keep the cache from filling with a few large entries.
+DISTRIBUTION_CACHE_MAX_SIZE = 10000
+
+# Integer of distinct values counted when paginating the values of a field.
+# Counting stops at this limit so paging through high-cardinality fields
+# does not count every value. The response flags a capped count using the
+# `count_capped` key.
+VALUES_COUNT_LIMIT = 1000
+
+# If true, pages of field values and their counts are cached until the data
+# version of the field is incremented.
+VALUES_CACHE_ENABLED = True
+
+# Integer of seconds a page of field values is cached.
+VALUES_CACHE_TIMEOUT = 60 * 60
+
+# If true, searches of field values only match values starting with the
+# query rather than containing it. This allows the database to use an index
+# on the search field. This can be toggled per request using the `prefix`
+# parameter.
+VALUES_SEARCH_PREFIX = False
+
+# If true, the distinct values of searchable fields are kept in a sorted
+# index in memory by each process and field value searches are served from
+# the index rather than the database. An index is rebuilt once the data
+# version of its field is incremented.
+VALUE_INDEX_ENABLED = False
+
+# Integer of bytes the value indexes of a process may use in total. The
+# least recently used indexes are evicted to stay within the limit.
+VALUE_INDEX_MEMORY_LIMIT = 50 * 1024 * 1024
+
+# Integer of distinct values above which a field is not indexed.
+VALUE_INDEX_MAX_SIZE = 100000
+
+# If true, a random sample of the values of each field is cached and random
+# values are drawn from it until the data version of any field is
+# incremented.
+RANDOM_VALUES_CACHE_ENABLED = True
+
+# Integer of distinct values in the cached sample of a field. Requests for
+# more random values than this are sampled from the table each time.
+RANDOM_VALUES_SAMPLE_SIZE = 100
+
+# Integer of seconds the sample of a field is cached.
+RANDOM_VALUES_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Integer of values or labels looked up per query when validating the values
+# of a field. Large lists are split into chunks to stay within the parameter
+# limits of the database.
+VALUES_VALIDATE_CHUNK_SIZE = 500
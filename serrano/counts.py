@@ -0,0 +1,308 @@
+import re
+import logging
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Sum
+from avocado.models import DataField, DataContext, DataQuery
+from serrano.cache import make_key
+from serrano.conf import settings
+from serrano.jobs import enqueue_on_commit
+
+log = logging.getLogger(__name__)
+
+COUNT_CACHE_KEY = 'serrano:count'
+
+COUNT_JOB_KEY = 'serrano:count-job'
+
+# The kinds of counts that can be returned by `get_count`.
+COUNT_EXACT = 'exact'
+COUNT_CACHED = 'cached'
+COUNT_ESTIMATED = 'estimated'
+COUNT_STORED = 'stored'
+
+# Matches the estimated number of rows of the top-level node of a plan
+# output by PostgreSQL's EXPLAIN.
+PLAN_ROWS_RE = re.compile(r'rows=(\d+)')
+
+
+def get_data_version():
+    """Returns a version that changes whenever the data is refreshed.
+
+    Avocado increments the `data_version` of fields when the underlying data
+    changes, e.g. `./manage.py avocado data --incr-version`, so the sum
+    changes any time one of them is incremented.
+    """
+    version = DataField.objects.aggregate(version=Sum('data_version'))
+    return version['version'] or 0
+
+
+def get_field_data_version(instance):
+    """Returns the data version of the DataField `instance` read from the
+    database.
+
+    The version of the instance itself may be out of date since the data
+    version is incremented with an update.
+    """
+    versions = DataField.objects.filter(pk=instance.pk)\
+        .values_list('data_version', flat=True)
+
+    for version in versions:
+        return version
+
+    return instance.data_version
+
+
+def count_cache_key(*parts):
+    """Returns the cache key for the count of a query defined by `parts`,
+    typically the context JSON, view JSON and tree.
+
+    The data version is included so the count is invalidated when the data
+    is refreshed.
+    """
+    return make_key(COUNT_CACHE_KEY, get_data_version(), *parts)
+
+
+def estimate_count(queryset):
+    """Returns the number of rows the database planner estimates the
+    queryset will return, or None if the database does not support it.
+
+    Only PostgreSQL is currently supported.
+    """
+    connection = connections[queryset.db]
+
+    if connection.vendor != 'postgresql':
+        return None
+
+    try:
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN {0}'.format(sql), params)
+        plan = cursor.fetchone()[0]
+    except Exception:
+        log.exception('Error estimating count')
+        return None
+
+    match = PLAN_ROWS_RE.search(plan)
+
+    if match:
+        return int(match.group(1))
+
+
+def get_count(queryset, key=None, estimate=False):
+    """Returns a tuple of the count of `queryset` and the kind of count.
+
+    If `key` is supplied, the count is read from and stored in the cache
+    under the key. If `estimate` is true and no cached count exists, the
+    planner's estimate is returned if it is at least
+    `COUNT_ESTIMATE_THRESHOLD` rows. Smaller results are counted exactly
+    since doing so is cheap.
+    """
+    if key and settings.COUNT_CACHE_ENABLED:
+        count = cache.get(key)
+
+        if count is not None:
+            return count, COUNT_CACHED
+    else:
+        key = None
+
+    if estimate:
+        count = estimate_count(queryset)
+
+        if count is not None and count >= settings.COUNT_ESTIMATE_THRESHOLD:
+            return count, COUNT_ESTIMATED
+
+    count = queryset.count()
+
+    if key:
+        cache.set(key, count, settings.COUNT_CACHE_TIMEOUT)
+
+    return count, COUNT_EXACT
+
+
+def context_count_key(instance):
+    "Returns the cache key for the count of the DataContext `instance`."
+    return count_cache_key('context', instance.json)
+
+
+def query_count_key(instance, distinct=True):
+    """Returns the cache key for the distinct or record count of the
+    DataQuery `instance`.
+    """
+    return count_cache_key('query', 'distinct' if distinct else 'records',
+                           instance.context_json, instance.view_json)
+
+
+def get_cached_count(key):
+    "Returns the count cached under `key` or None if it is not cached."
+    if settings.COUNT_CACHE_ENABLED:
+        return cache.get(key)
+
+
+def get_context_count(instance):
+    """Returns the distinct count of the objects matching the DataContext
+    `instance`.
+
+    The count is cached by the context JSON so contexts with the same
+    filters share a count, regardless of who they belong to.
+    """
+    key = context_count_key(instance)
+    return get_count(instance.apply().distinct(), key=key)[0]
+
+
+def get_query_count(instance, distinct=True):
+    """Returns the count of the objects matching the DataQuery `instance`.
+
+    If `distinct` is true, this is the distinct count of the objects,
+    otherwise the count of the records. The count is cached by the context
+    and view JSON so queries with the same filters and columns share a
+    count, regardless of who they belong to.
+    """
+    key = query_count_key(instance, distinct=distinct)
+
+    if distinct:
+        queryset = instance.apply().distinct()
+    else:
+        queryset = instance.apply()
+
+    return get_count(queryset, key=key)[0]
+
+
+def get_stored_count(stored, key, queryset, refresh=False):
+    """Returns a tuple of the count of `queryset` and the kind of count.
+
+    `stored` is the count persisted on a context or query for its current
+    JSON, or None. Unless `refresh` is true, the count cached under `key` is
+    returned if any, otherwise the stored count. A stored count that is not
+    cached may predate a refresh of the data. If neither exists or
+    `refresh` is true, the count is computed and cached.
+    """
+    if not refresh:
+        count = get_cached_count(key)
+
+        if count is not None:
+            return count, COUNT_CACHED
+
+        if stored is not None:
+            return stored, COUNT_STORED
+
+    count = queryset.count()
+
+    if settings.COUNT_CACHE_ENABLED:
+        cache.set(key, count, settings.COUNT_CACHE_TIMEOUT)
+
+    return count, COUNT_EXACT
+
+
+def count_job_key(instance):
+    "Returns the cache key marking a pending count job for `instance`."
+    return make_key(COUNT_JOB_KEY, instance._meta.object_name, instance.pk)
+
+
+def _count_missing(instance):
+    if isinstance(instance, DataContext):
+        return instance.count is None
+    return instance.distinct_count is None or instance.record_count is None
+
+
+def get_pending_counts(instances):
+    """Returns the set of primary keys of the DataContext or DataQuery
+    `instances` with a count job that has been queued and has not
+    completed. `instances` may be a single instance.
+
+    The markers of all instances are read with one cache lookup.
+    """
+    if isinstance(instances, (DataContext, DataQuery)):
+        instances = [instances]
+
+    keys = {}
+
+    for instance in instances:
+        if _count_missing(instance):
+            keys[count_job_key(instance)] = instance.pk
+
+    if not keys:
+        return set()
+
+    return set(keys[key] for key in cache.get_many(keys.keys()))
+
+
+def _start_count_job(instance, *parts):
+    # The token identifies the job so an earlier job for the same instance
+    # does not clear the marker of a later one.
+    token = make_key(COUNT_JOB_KEY, *parts)
+    cache.set(count_job_key(instance), token,
+              settings.COUNT_JOB_TIMEOUT)
+    return token
+
+
+def _finish_count_job(instance, token):
+    key = count_job_key(instance)
+
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def update_context_count(pk, json):
+    """Computes and stores the count of the DataContext `pk` unless its JSON
+    has changed from `json`.
+    """
+    try:
+        instance = DataContext.objects.get(pk=pk)
+    except DataContext.DoesNotExist:
+        return
+
+    try:
+        if instance.json == json:
+            count = get_context_count(instance)
+
+            # An update is used so the modified time and the revision
+            # history of the context are not affected.
+            DataContext.objects.filter(pk=pk).update(count=count)
+    finally:
+        _finish_count_job(instance, make_key(COUNT_JOB_KEY, json))
+
+
+def update_query_counts(pk, context_json, view_json, distinct=True,
+                        records=True):
+    """Computes and stores the distinct and record counts of the DataQuery
+    `pk` unless its JSON has changed from `context_json` and `view_json`.
+    """
+    try:
+        instance = DataQuery.objects.get(pk=pk)
+    except DataQuery.DoesNotExist:
+        return
+
+    try:
+        if instance.context_json == context_json and \
+                instance.view_json == view_json:
+            counts = {}
+
+            if distinct:
+                counts['distinct_count'] = get_query_count(instance)
+
+            if records:
+                counts['record_count'] = get_query_count(instance,
+                                                         distinct=False)
+
+            DataQuery.objects.filter(pk=pk).update(**counts)
+    finally:
+        _finish_count_job(instance, make_key(COUNT_JOB_KEY, context_json,
+                                             view_json))
+
+
+def defer_context_count(instance):
+    """Queues a job computing the count of the saved DataContext `instance`
+    once the transaction it was saved in is committed.
+    """
+    _start_count_job(instance, instance.json)
+    enqueue_on_commit(update_context_count, instance.pk, instance.json)
+
+
+def defer_query_counts(instance, distinct=True, records=True):
+    """Queues a job computing the distinct and/or record counts of the saved
+    DataQuery `instance`.
+    """
+    _start_count_job(instance, instance.context_json, instance.view_json)
+    enqueue_on_commit(update_query_counts, instance.pk,
+                      instance.context_json, instance.view_json,
+                      distinct=distinct, records=records)
@@ -0,0 +1,347 @@
+import os
+import uuid
+import logging
+import tempfile
+import itertools
+from datetime import datetime
+from threading import Thread, Event
+from Queue import Queue, Full
+from django.core.cache import cache
+from django.db import connections
+from avocado.export import registry as exporters
+from avocado.models import DataContext, DataView
+from avocado.query import pipeline
+from serrano.conf import settings
+from serrano.jobs import get_queue
+
+log = logging.getLogger(__name__)
+
+# Maximum number of chunks that can be waiting to be sent to the client. Once
+# reached, the exporter blocks until the client catches up which keeps the
+# memory used by a streaming export constant.
+STREAM_QUEUE_SIZE = 8
+
+# Number of seconds the writer waits on a full queue before checking if the
+# consumer is still there.
+STREAM_PUT_TIMEOUT = 1
+
+# Number of rows fetched at a time from a server-side cursor.
+STREAM_CURSOR_ITER_SIZE = 2000
+
+# Marks the end of the stream.
+_DONE = object()
+
+EXPORT_JOB_CACHE_KEY = 'serrano:export_job:{0}'
+
+# Number of rows written between updates of the progress of an export job.
+EXPORT_JOB_PROGRESS_INTERVAL = 1000
+
+# States of an export job
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_COMPLETE = 'complete'
+JOB_FAILED = 'failed'
+
+
+class ExportAborted(Exception):
+    "Raised in the writer thread when the consumer of the stream is gone."
+
+
+class StreamBuffer(object):
+    """File-like object an exporter writes into when streaming.
+
+    Writes are accumulated into chunks of roughly `chunk_size` bytes which
+    are put on a bounded queue for the consumer. `tell` is supported since
+    the zip-based exporters rely on it for computing the file offsets.
+    """
+    def __init__(self, chunk_size=None, queue_size=STREAM_QUEUE_SIZE):
+        if chunk_size is None:
+            chunk_size = settings.EXPORT_STREAM_CHUNK_SIZE
+
+        self.chunk_size = chunk_size
+        self.queue = Queue(queue_size)
+        self.aborted = Event()
+
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+
+    def _put(self, item):
+        while True:
+            if self.aborted.is_set():
+                raise ExportAborted
+
+            try:
+                self.queue.put(item, timeout=STREAM_PUT_TIMEOUT)
+                return
+            except Full:
+                pass
+
+    def write(self, data):
+        if self.aborted.is_set():
+            raise ExportAborted
+
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        self._chunks.append(data)
+        self._size += len(data)
+        self._position += len(data)
+
+        if self._size >= self.chunk_size:
+            self.flush()
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        if self._chunks:
+            chunk = ''.join(self._chunks)
+            self._chunks = []
+            self._size = 0
+            self._put(chunk)
+
+    def finish(self, error=None):
+        "Flushes the remaining data and marks the end of the stream."
+        if error is None:
+            self.flush()
+            self._put(_DONE)
+        else:
+            self._put(error)
+
+
+def iter_rows(queryset, chunk_size=STREAM_CURSOR_ITER_SIZE):
+    """Returns an iterator of the rows of `queryset`.
+
+    On PostgreSQL the rows are read through a server-side cursor `chunk_size`
+    rows at a time, since the driver otherwise buffers the entire result set
+    when the query is executed. Other databases use the rows iterator of the
+    queryset, which may be buffered by the driver.
+    """
+    connection = connections[queryset.db]
+
+    if connection.vendor != 'postgresql':
+        # ModelTreeQuerySet has a raw method defined, but fallback
+        # to the creating a results iter if not present.
+        if hasattr(queryset, 'raw'):
+            return queryset.raw()
+        return queryset.query.get_compiler(queryset.db).results_iter()
+
+    return _iter_server_side(connection, queryset, chunk_size)
+
+
+def _iter_server_side(connection, queryset, chunk_size):
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+
+    # Ensures the connection is open
+    connection.cursor()
+
+    # A named cursor only exists within a transaction unless it is held,
+    # which is required when the connection is in autocommit mode.
+    cursor = connection.connection.cursor(
+        name='serrano_export_{0}'.format(uuid.uuid4().hex),
+        withhold=connection.features.uses_autocommit)
+    cursor.itersize = chunk_size
+
+    try:
+        cursor.execute(sql, params)
+
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def rows_are_distinct(queryset, exporter):
+    """Returns true if the rows of `queryset` are distinct relative to the
+    columns formatted by `exporter`.
+
+    Such rows can be written without the exporter keeping track of every row
+    it has written. The rows are not distinct if the query is not, or if
+    columns used for ordering are selected in addition to those formatted.
+    """
+    query = queryset.query
+
+    return bool(query.distinct and query.select and
+                not query.extra_select and not query.aggregate_select and
+                not query.related_select_cols and
+                len(query.select) == exporter.row_length)
+
+
+def stream_export(exporter, iterable, buff=None, *args, **kwargs):
+    """Returns a generator that yields the output of `exporter.write` in
+    chunks while the export is being written.
+
+    The exporter is run in a separate thread. The first row of `iterable` is
+    read in the calling thread so the query is executed on the database
+    connection of the caller rather than one opened by the writer thread.
+    """
+    if buff is None:
+        buff = StreamBuffer()
+
+    rows = iter(iterable)
+
+    try:
+        rows = itertools.chain([next(rows)], rows)
+    except StopIteration:
+        rows = iter(())
+
+    def write():
+        error = None
+
+        try:
+            exporter.write(rows, buff, *args, **kwargs)
+        except ExportAborted:
+            return
+        except Exception as e:
+            log.exception('Error writing streaming export')
+            error = e
+        finally:
+            # Release any connections opened by the exporter in this thread
+            for connection in connections.all():
+                connection.close()
+
+        try:
+            buff.finish(error)
+        except ExportAborted:
+            pass
+
+    thread = Thread(target=write)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            chunk = buff.queue.get()
+
+            if chunk is _DONE:
+                break
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            yield chunk
+    finally:
+        # Signals the writer to stop if the client went away before the
+        # export completed.
+        buff.aborted.set()
+
+
+def get_export_job_root():
+    root = settings.EXPORT_JOB_ROOT
+
+    if not root:
+        root = os.path.join(tempfile.gettempdir(), 'serrano-exports')
+
+    if not os.path.exists(root):
+        os.makedirs(root)
+
+    return root
+
+
+def get_export_job(job_id):
+    "Returns the state of an export job or None if it does not exist."
+    return cache.get(EXPORT_JOB_CACHE_KEY.format(job_id))
+
+
+def save_export_job(job):
+    cache.set(EXPORT_JOB_CACHE_KEY.format(job['id']), job,
+              settings.EXPORT_JOB_TIMEOUT)
+
+
+def delete_export_job(job):
+    cache.delete(EXPORT_JOB_CACHE_KEY.format(job['id']))
+
+    if job.get('path') and os.path.exists(job['path']):
+        os.remove(job['path'])
+
+
+def create_export_job(export_type, view, context, tree, filename,
+                      owner=None, offset=None, limit=None):
+    """Creates an export job and adds it to the job queue.
+
+    The view and context are passed by their JSON so the job does not depend
+    on the state of the objects when it runs. `owner` identifies the user or
+    session the job is accessible to.
+    """
+    exporter = exporters[export_type]
+    job_id = uuid.uuid4().hex
+
+    job = {
+        'id': job_id,
+        'type': export_type,
+        'owner': owner,
+        'status': JOB_PENDING,
+        'rows': 0,
+        'size': None,
+        'error': None,
+        'created': datetime.now(),
+        'finished': None,
+        'filename': filename,
+        'content_type': exporter.content_type,
+        'path': os.path.join(get_export_job_root(), '{0}.{1}'.format(
+            job_id, exporter.file_extension)),
+    }
+
+    save_export_job(job)
+
+    get_queue().enqueue(
+        run_export_job, job_id, view.json if view else None,
+        context.json if context else None, tree, offset=offset, limit=limit)
+
+    # The job may have already run depending on the queue
+    return get_export_job(job_id) or job
+
+
+def run_export_job(job_id, view_json, context_json, tree, offset=None,
+                   limit=None):
+    "Writes the export of a job to its file and records the progress."
+    job = get_export_job(job_id)
+
+    # Job expired or was deleted before it was run
+    if job is None:
+        return
+
+    job['status'] = JOB_RUNNING
+    save_export_job(job)
+
+    try:
+        QueryProcessor = pipeline.query_processors.default
+        context = DataContext(json=context_json) if context_json else None
+        view = DataView(json=view_json) if view_json else None
+        processor = QueryProcessor(context=context, view=view, tree=tree,
+                                   include_pk=False)
+
+        exporter = processor.get_exporter(exporters[job['type']])
+        iterable = processor.get_iterable()
+
+        # Rows are counted as they are emitted to the exporter's writer,
+        # after the offset and duplicate rows are skipped.
+        read = exporter.read
+
+        def track(*args, **kwargs):
+            for i, row in enumerate(read(*args, **kwargs), 1):
+                job['rows'] = i
+                if i % EXPORT_JOB_PROGRESS_INTERVAL == 0:
+                    save_export_job(job)
+                yield row
+
+        exporter.read = track
+
+        with open(job['path'], 'wb') as buff:
+            exporter.write(iterable, buff, offset=offset, limit=limit)
+    except Exception as e:
+        log.exception('Error running export job', extra={'job': job_id})
+        job['status'] = JOB_FAILED
+        job['error'] = unicode(e)
+    else:
+        job['status'] = JOB_COMPLETE
+        job['size'] = os.path.getsize(job['path'])
+
+    job['finished'] = datetime.now()
+
+    # Do not resurrect a job that was deleted while running
+    if get_export_job(job_id) is None:
+        delete_export_job(job)
+    else:
+        save_export_job(job)
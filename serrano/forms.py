@@ -8,7 +8,11 @@ from django.core.urlresolvers import reverse, NoReverseMatch
 from django.core.validators import validate_email
 from avocado.models import DataContext, DataView, DataQuery
 from serrano import utils
+from serrano.cache import invalidate_preview_cache
 from serrano.conf import settings
+from serrano.counts import get_context_count, get_query_count, \
+    get_cached_count, context_count_key, query_count_key, \
+    defer_context_count, defer_query_counts
 
 log = logging.getLogger(__name__)
 
@@ -46,12 +50,20 @@ class ContextForm(forms.ModelForm):
         else:
             instance.session_key = request.session.session_key
 
+        count_deferred = False
+
         # Only recalculated count if conditions exist. This is to
-        # prevent re-counting the entire dataset. An alternative
-        # solution may be desirable such as pre-computing and
-        # caching the count ahead of time.
+        # prevent re-counting the entire dataset. Counts are cached by
+        # the JSON so identical filters reuse a prior count. Counts that
+        # are not cached may be deferred to a background job.
         if self.count_needs_update:
-            instance.count = instance.apply().distinct().count()
+            if settings.COUNT_DEFERRED:
+                instance.count = get_cached_count(
+                    context_count_key(instance))
+                count_deferred = instance.count is None
+            else:
+                instance.count = get_context_count(instance)
+
             self.count_needs_update = False
         else:
             instance.count = None
@@ -59,6 +71,12 @@ class ContextForm(forms.ModelForm):
         if commit:
             instance.save()
 
+            if count_deferred:
+                defer_context_count(instance)
+
+            # Cached preview pages may be based on the previous state
+            invalidate_preview_cache(utils.get_request_owner(request))
+
         return instance
 
     class Meta(object):
@@ -83,6 +101,9 @@ class ViewForm(forms.ModelForm):
         if commit:
             instance.save()
 
+            # Cached preview pages may be based on the previous state
+            invalidate_preview_cache(utils.get_request_owner(request))
+
         return instance
 
     class Meta(object):
@@ -171,18 +192,35 @@ class QueryForm(forms.ModelForm):
         else:
             instance.session_key = request.session.session_key
 
+        deferred = settings.COUNT_DEFERRED
+        distinct_deferred = False
+        records_deferred = False
+
         # Only recalculated count if conditions exist. This is to
-        # prevent re-counting the entire dataset. An alternative
-        # solution may be desirable such as pre-computing and
-        # caching the count ahead of time.
+        # prevent re-counting the entire dataset. Counts are cached by
+        # the JSON so identical filters reuse a prior count. Counts that
+        # are not cached may be deferred to a background job.
         if self.count_needs_update_context:
-            instance.distinct_count = instance.apply().distinct().count()
+            if deferred:
+                instance.distinct_count = get_cached_count(
+                    query_count_key(instance))
+                distinct_deferred = instance.distinct_count is None
+            else:
+                instance.distinct_count = get_query_count(instance)
+
             self.count_needs_update_context = False
         else:
             instance.distinct_count = None
 
         if self.count_needs_update_view:
-            instance.record_count = instance.apply().count()
+            if deferred:
+                instance.record_count = get_cached_count(
+                    query_count_key(instance, distinct=False))
+                records_deferred = instance.record_count is None
+            else:
+                instance.record_count = get_query_count(instance,
+                                                        distinct=False)
+
             self.count_needs_update_view = False
         else:
             instance.record_count = None
@@ -190,6 +228,10 @@ class QueryForm(forms.ModelForm):
         if commit:
             instance.save()
 
+            if distinct_deferred or records_deferred:
+                defer_query_counts(instance, distinct=distinct_deferred,
+                                   records=records_deferred)
+
             script_name = getattr(django_settings, 'SCRIPT_NAME', '')
 
             # The code to update the shared_users field on the Query model
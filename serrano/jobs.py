@@ -0,0 +1,137 @@
+import logging
+from threading import Lock, local
+from multiprocessing.pool import ThreadPool
+from django.core.signals import request_started, request_finished
+from django.db import connections, transaction
+from django.utils.importlib import import_module
+from serrano.conf import settings
+
+log = logging.getLogger(__name__)
+
+
+def _run_job(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        log.exception('Error running job',
+                      extra={'job': getattr(func, '__name__', func)})
+    finally:
+        # Each worker thread has its own set of database connections which
+        # are not closed by the request/response cycle.
+        for connection in connections.all():
+            connection.close()
+
+
+class ImmediateQueue(object):
+    """Runs jobs immediately in the calling thread. This is primarily useful
+    for testing and debugging.
+    """
+    def enqueue(self, func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            log.exception('Error running job',
+                          extra={'job': getattr(func, '__name__', func)})
+
+
+class ThreadQueue(object):
+    """Runs jobs in a pool of worker threads local to the process.
+
+    The pool is created on first use with `JOB_QUEUE_WORKERS` threads.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers
+        self._pool = None
+        self._lock = Lock()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(
+                        self.workers or settings.JOB_QUEUE_WORKERS)
+        return self._pool
+
+    def enqueue(self, func, *args, **kwargs):
+        self.pool.apply_async(_run_job, (func, args, kwargs))
+
+
+_queues = {}
+_queues_lock = Lock()
+
+
+def get_queue(path=None):
+    """Returns the job queue instance for the dotted class `path`, defaulting
+    to the `JOB_QUEUE` setting.
+
+    A queue class must implement an `enqueue(func, *args, **kwargs)` method.
+    The arguments should be picklable to support queues that run jobs
+    outside of the current process.
+    """
+    if path is None:
+        path = settings.JOB_QUEUE
+
+    if path not in _queues:
+        with _queues_lock:
+            if path not in _queues:
+                module_name, class_name = path.rsplit('.', 1)
+                klass = getattr(import_module(module_name), class_name)
+                _queues[path] = klass()
+
+    return _queues[path]
+
+
+_pending = local()
+
+
+def enqueue_on_commit(func, *args, **kwargs):
+    """Adds a job to the queue once the current transaction is committed.
+
+    Within a request with a managed transaction, such as one started by the
+    TransactionMiddleware, the job is held until the request has finished
+    since the job may read rows written by the request. Otherwise, such as
+    in management commands or outside of a managed transaction, the job is
+    queued immediately.
+    """
+    if not getattr(_pending, 'active', False) or \
+            not transaction.is_managed():
+        get_queue().enqueue(func, *args, **kwargs)
+        return
+
+    if not hasattr(_pending, 'jobs'):
+        _pending.jobs = []
+
+    _pending.jobs.append((func, args, kwargs))
+
+
+def enqueue_pending(**kwargs):
+    "Adds the jobs held by `enqueue_on_commit` in this thread to the queue."
+    jobs = getattr(_pending, 'jobs', None)
+
+    if not jobs:
+        return
+
+    _pending.jobs = []
+    queue = get_queue()
+
+    for func, args, kwargs in jobs:
+        queue.enqueue(func, *args, **kwargs)
+
+
+def _start_request(**kwargs):
+    _pending.active = True
+
+
+def _finish_request(**kwargs):
+    _pending.active = False
+    enqueue_pending()
+
+
+request_started.connect(_start_request,
+                        dispatch_uid='serrano-jobs-request-started')
+
+# The response is complete, and the transaction of the request committed,
+# once the request has finished.
+request_finished.connect(_finish_request,
+                         dispatch_uid='serrano-jobs-enqueue-pending')
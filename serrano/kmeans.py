@@ -0,0 +1,144 @@
+"""Vectorized equivalents of `find_outliers` and `weighted_counts` in
+`avocado.stats.kmeans` using NumPy.
+
+Points are passed as an N x M array of N points with M dimensions. The
+results match the pure Python implementation, but the work is done on
+arrays rather than per point which supports far larger distributions.
+"""
+import numpy as np
+
+# Number of points whose distances to the centroids are computed at once.
+# This bounds the memory used by the N x K distance matrix.
+CHUNK_SIZE = 10000
+
+
+def normalize(points):
+    """Divides each dimension of `points` by its standard deviation. If all
+    points are equal along a dimension, the normalized values are zero.
+    """
+    std = points.std(axis=0)
+    scale = np.where(std == 0, 1, std)
+    return np.where(std == 0, 0.0, points / scale), std
+
+
+def compute_clusters(points, centroids):
+    """Returns the index of the nearest centroid of each point and the
+    Euclidean distance to it. Ties resolve to the first centroid.
+    """
+    n = len(points)
+    indexes = np.empty(n, dtype=np.intp)
+    distances = np.empty(n)
+
+    for start in range(0, n, CHUNK_SIZE):
+        chunk = points[start:start + CHUNK_SIZE]
+        sqr = ((chunk[:, np.newaxis, :] - centroids[np.newaxis, :, :]) ** 2)\
+            .sum(axis=2)
+
+        idx = sqr.argmin(axis=1)
+        indexes[start:start + CHUNK_SIZE] = idx
+        distances[start:start + CHUNK_SIZE] = sqr[np.arange(len(chunk)), idx]
+
+    return indexes, np.sqrt(distances)
+
+
+def kmeans(points, centroids, threshold=1e-5):
+    """Runs k-means on `points` from the initial `centroids` until the mean
+    distance of the points to their centroids stops improving by more than
+    `threshold`. Centroids of empty clusters are removed.
+    """
+    centroids = np.array(centroids, dtype=float)
+    mean_difference = float('Inf')
+    previous_mean_distance = None
+
+    while mean_difference > threshold:
+        indexes, distances = compute_clusters(points, centroids)
+        mean_distance = distances.mean()
+
+        if previous_mean_distance is not None:
+            mean_difference = previous_mean_distance - mean_distance
+
+        if mean_difference > threshold:
+            k = len(centroids)
+            sizes = np.bincount(indexes, minlength=k)
+
+            sums = np.empty_like(centroids)
+            for d in range(points.shape[1]):
+                sums[:, d] = np.bincount(indexes, weights=points[:, d],
+                                         minlength=k)
+
+            members = sizes > 0
+            centroids = sums[members] / sizes[members][:, np.newaxis]
+
+        previous_mean_distance = mean_distance
+
+    return centroids
+
+
+def find_outliers(points, outlier_threshold=3, normalized=True):
+    """Returns the indexes of the points whose distance to the center of
+    `points` is at least `outlier_threshold` times the mean distance.
+    """
+    if not normalized:
+        points = normalize(points)[0]
+
+    # A single centroid converges to the mean of the points
+    distances = np.sqrt(((points - points.mean(axis=0)) ** 2).sum(axis=1))
+    mean_distance = distances.mean()
+
+    if mean_distance <= 0:
+        return np.array([], dtype=np.intp)
+
+    return np.flatnonzero(distances / mean_distance >= outlier_threshold)
+
+
+def weighted_counts(points, counts, k):
+    """Clusters `points` into `k` clusters after removing outliers and
+    returns a list of the centroids with the count of each weighted by the
+    distance of its points, and a list of the outlier points.
+
+    See `avocado.stats.kmeans.weighted_counts`.
+    """
+    outliers = find_outliers(points, 3, False)
+
+    if len(outliers):
+        mask = np.ones(len(points), dtype=bool)
+        mask[outliers] = False
+        members = points[mask]
+    else:
+        members = points
+
+    n = len(members)
+    k = k or int(np.sqrt(n // 2))
+
+    norm_points, std = normalize(members)
+
+    # Initial centroids are evenly spaced in the sorted dimensions
+    step = n // k
+    initial = np.sort(norm_points, axis=0)[step // 2::step]
+
+    centroids = kmeans(norm_points, initial)
+    indexes, distances = compute_clusters(norm_points, centroids)
+
+    # Matches the pure Python implementation which indexes the counts of
+    # all points by the index of the remaining points.
+    counts = counts[:n]
+
+    size = len(centroids)
+    dist_sums = np.bincount(indexes, weights=distances, minlength=size)
+    point_sums = dist_sums[indexes]
+
+    weighted = np.where(
+        point_sums > 0,
+        (1 - distances / np.where(point_sums > 0, point_sums, 1)) * counts,
+        counts)
+
+    totals = np.bincount(indexes, weights=weighted, minlength=size)
+
+    data = []
+    for centroid, total in zip(centroids * std, totals):
+        data.append({
+            'values': centroid.tolist(),
+            'count': int(total),
+        })
+
+    return data, [points[i].tolist() for i in outliers]
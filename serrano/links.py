@@ -0,0 +1,42 @@
+from django.core.urlresolvers import reverse
+
+# Placeholder arguments used to reverse a route once. These must match the
+# patterns of the route arguments, e.g. `\d+`, and be unlikely to occur
+# anywhere else in the URL.
+LINK_PLACEHOLDER = 7253948160
+
+
+def get_link_template(request, name, nargs=1):
+    """Returns a format string of the absolute URI for the route `name`
+    with `nargs` positional arguments.
+
+    The route is reversed once per request with placeholder arguments which
+    are then replaced by format fields. This prevents reversing the same
+    route for every object when serializing large collections.
+    """
+    templates = getattr(request, '_link_templates', None)
+
+    if templates is None:
+        templates = request._link_templates = {}
+
+    key = (name, nargs)
+
+    if key not in templates:
+        placeholders = [str(LINK_PLACEHOLDER + i) for i in range(nargs)]
+
+        uri = request.build_absolute_uri(reverse(name, args=placeholders))
+
+        # Escape any literal braces prior to inserting the format fields
+        uri = uri.replace('{', '{{').replace('}', '}}')
+
+        for i, placeholder in enumerate(placeholders):
+            uri = uri.replace(placeholder, '{' + str(i) + '}')
+
+        templates[key] = uri
+
+    return templates[key]
+
+
+def link(request, name, *args):
+    "Returns the absolute URI for the route `name` with `args`."
+    return get_link_template(request, name, len(args)).format(*args)
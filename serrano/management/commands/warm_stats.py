@@ -0,0 +1,84 @@
+import logging
+from optparse import make_option
+from multiprocessing.pool import ThreadPool
+from django.core.management.base import BaseCommand
+from django.db import connections
+from avocado.models import DataField
+from serrano.stats import stats_capable, get_stats
+
+log = logging.getLogger(__name__)
+
+
+def _warm_stats(pk):
+    try:
+        get_stats(DataField.objects.get(pk=pk), refresh=True)
+        return True
+    except Exception:
+        log.exception('Error computing stats', extra={'field': pk})
+        return False
+
+
+def _warm_stats_thread(pk):
+    try:
+        return _warm_stats(pk)
+    finally:
+        # Worker threads have their own database connections
+        for connection in connections.all():
+            connection.close()
+
+
+class Command(BaseCommand):
+    """Computes and caches the stats of all fields that support them so
+    stats requests are served from the cache.
+    """
+    args = '[field_label ...]'
+
+    help = ('Computes and caches the stats of fields, optionally limited '
+            'to the specified fields, e.g. tests.title.salary')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=4,
+                    help='Number of fields to compute stats for in '
+                         'parallel'),
+        make_option('--published', action='store_true', dest='published',
+                    default=False,
+                    help='Only compute stats for published fields'),
+    )
+
+    def get_fields(self, labels, published):
+        queryset = DataField.objects.all()
+
+        if published:
+            queryset = queryset.published()
+
+        if labels:
+            pks = []
+
+            for label in labels:
+                pks.append(DataField.objects.get_by_natural_key(
+                    *label.split('.')).pk)
+
+            queryset = queryset.filter(pk__in=pks)
+
+        return [x.pk for x in queryset.iterator() if stats_capable(x)]
+
+    def handle(self, *labels, **options):
+        verbosity = int(options.get('verbosity', 1))
+        workers = options.get('workers') or 1
+
+        pks = self.get_fields(labels, options.get('published'))
+
+        if workers > 1 and len(pks) > 1:
+            pool = ThreadPool(min(workers, len(pks)))
+
+            try:
+                results = pool.map(_warm_stats_thread, pks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_warm_stats(pk) for pk in pks]
+
+        if verbosity:
+            self.stdout.write('Computed stats for {0} of {1} fields'.format(
+                sum(results), len(pks)))
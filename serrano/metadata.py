@@ -0,0 +1,212 @@
+from collections import OrderedDict
+from threading import Lock, local
+from django.core.signals import request_started, request_finished
+from django.db.models import Count, Max, Sum
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from avocado.models import DataField, DataConcept, DataConceptField, \
+    DataCategory
+from serrano.conf import settings
+from serrano.cache import get_version, incr_version
+
+METADATA_CACHE_VERSION = 'metadata'
+
+METADATA_MODELS = (DataField, DataConcept, DataConceptField, DataCategory)
+
+# Flags that are commonly changed with `QuerySet.update`, such as by the
+# publish and archive actions of the admin.
+METADATA_FLAGS = ('published', 'archived')
+
+_state = local()
+
+
+def get_queryset_state(queryset):
+    """Returns the number of objects in `queryset`, the sum of their ids and
+    the time the most recent one was modified, computed by the database.
+
+    The sum of ids changes when objects enter or leave the queryset even if
+    the number of objects and the modified times do not, as with an update.
+    """
+    state = queryset.order_by().aggregate(count=Count('pk'), ids=Sum('pk'),
+                                          modified=Max('modified'))
+    modified = state['modified']
+
+    return [state['count'], state['ids'],
+            modified.isoformat() if modified else None]
+
+
+def _get_model_state(model):
+    queryset = model.objects.order_by()
+    flags = [f for f in METADATA_FLAGS
+             if f in model._meta.get_all_field_names()]
+
+    if not flags:
+        return get_queryset_state(queryset)
+
+    # The objects are grouped by their flags so a change to a flag which
+    # does not send signals changes the state.
+    rows = queryset.values(*flags).annotate(
+        count=Count('pk'), ids=Sum('pk'), modified=Max('modified'))\
+        .order_by(*flags)
+
+    return [[[row[f] for f in flags], row['count'], row['ids'],
+             row['modified'].isoformat() if row['modified'] else None]
+            for row in rows]
+
+
+def get_metadata_state():
+    """Returns the state of the fields, concepts, concept fields and
+    categories in the database.
+
+    Changes made with `QuerySet.update` do not send signals, but change the
+    state. The state is computed once per request and every time it is
+    requested outside of a request.
+    """
+    state = getattr(_state, 'state', None)
+
+    if state is None:
+        state = [_get_model_state(model) for model in METADATA_MODELS]
+
+        if getattr(_state, 'active', False):
+            _state.state = state
+
+    return state
+
+
+class MetadataCache(object):
+    """In-process cache of the results of queries on fields, concepts and
+    categories.
+
+    Results are keyed by the SQL of the queryset so any filtering, ordering
+    or annotation applied by a resource is respected. All results are
+    discarded when the version stored in the cache is incremented, which
+    occurs when a field, concept, concept field or category changes in any
+    process, or when the state of the metadata in the database changes, which
+    is checked once per request.
+
+    The number of cached results is bounded by the METADATA_CACHE_MAX_SIZE
+    setting. The oldest results are discarded first.
+
+    The cached instances are shared across requests and must not be
+    modified. Since the data version of fields is incremented with an
+    update which does not send signals, the cached fields must not be
+    relied on for their `data_version`.
+    """
+    def __init__(self):
+        self._results = OrderedDict()
+        self._version = None
+        self._lock = Lock()
+
+    def _key(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        return (queryset.model, queryset.db, sql, params)
+
+    def _ensure(self):
+        version = (get_version(METADATA_CACHE_VERSION), get_metadata_state())
+
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._results = OrderedDict()
+                    self._version = version
+
+    def evaluate(self, queryset):
+        "Returns a list of the objects in `queryset`."
+        if not settings.METADATA_CACHE_ENABLED:
+            return list(queryset)
+
+        # The query of an empty queryset is that of the queryset it was
+        # derived from.
+        if isinstance(queryset, EmptyQuerySet):
+            return []
+
+        try:
+            key = self._key(queryset)
+        except EmptyResultSet:
+            return []
+
+        self._ensure()
+
+        results = self._results
+        objects = results.get(key)
+
+        # The query may be run more than once by concurrent requests, but
+        # the results are the same.
+        if objects is None:
+            objects = list(queryset)
+
+            with self._lock:
+                results[key] = objects
+
+                while len(results) > settings.METADATA_CACHE_MAX_SIZE:
+                    results.popitem(last=False)
+
+        return objects
+
+    def get(self, queryset, **kwargs):
+        """Returns the object in `queryset` matching the lookup parameters
+        equivalent to `QuerySet.get`.
+        """
+        objects = self.evaluate(queryset.filter(**kwargs))
+
+        if not objects:
+            raise queryset.model.DoesNotExist(
+                '{0} matching query does not exist.'
+                .format(queryset.model._meta.object_name))
+
+        if len(objects) > 1:
+            raise queryset.model.MultipleObjectsReturned(
+                'get() returned more than one {0}'
+                .format(queryset.model._meta.object_name))
+
+        return objects[0]
+
+    def reset(self):
+        "Clears the cache in this process."
+        self._version = None
+        self._results = OrderedDict()
+
+    def invalidate(self):
+        "Clears the cache in all processes."
+        self.reset()
+        incr_version(METADATA_CACHE_VERSION)
+
+
+metadata_cache = MetadataCache()
+
+
+def _invalidate_metadata_cache(sender, **kwargs):
+    _state.state = None
+    metadata_cache.invalidate()
+
+
+def _start_request(sender, **kwargs):
+    _state.active = True
+    _state.state = None
+
+
+def _finish_request(sender, **kwargs):
+    _state.active = False
+    _state.state = None
+
+
+for model in (DataField, DataConcept, DataConceptField, DataCategory):
+    post_save.connect(_invalidate_metadata_cache, sender=model,
+                      dispatch_uid='serrano-metadata-save-{0}'.format(
+                          model.__name__))
+    post_delete.connect(_invalidate_metadata_cache, sender=model,
+                        dispatch_uid='serrano-metadata-delete-{0}'.format(
+                            model.__name__))
+
+# Fields and concepts are published per site
+for model in (DataField, DataConcept):
+    m2m_changed.connect(_invalidate_metadata_cache,
+                        sender=model.sites.through,
+                        dispatch_uid='serrano-metadata-sites-{0}'.format(
+                            model.__name__))
+
+request_started.connect(_start_request,
+                        dispatch_uid='serrano-metadata-request-started')
+request_finished.connect(_finish_request,
+                         dispatch_uid='serrano-metadata-request-finished')
@@ -0,0 +1,107 @@
+import logging
+from threading import Lock
+from django.db.models.signals import post_save, post_delete, class_prepared
+from avocado.models import DataField, DataConceptField
+from serrano.cache import get_version, incr_version
+
+log = logging.getLogger(__name__)
+
+ORPHAN_INDEX_VERSION = 'orphan_index'
+
+
+def is_orphaned(app_name, model_name, field_name):
+    """Returns true if the model or field a DataField with the given natural
+    key represents does not exist.
+    """
+    # The model and field are resolved by the DataField itself which does
+    # not require a saved instance.
+    instance = DataField(app_name=app_name, model_name=model_name,
+                         field_name=field_name)
+    return instance.model is None or instance.field is None
+
+
+class OrphanIndex(object):
+    """Index of the ids of orphaned fields and the concepts containing them.
+
+    The index is built with two queries on first use and kept for the life
+    of the process. It is rebuilt when the version stored in the cache is
+    incremented, which occurs when fields or the fields of concepts change
+    in any process, or when a model class is prepared locally.
+    """
+    def __init__(self):
+        self._fields = None
+        self._concepts = None
+        self._version = None
+        self._lock = Lock()
+
+    def _build(self):
+        fields = set()
+
+        for pk, app_name, model_name, field_name in \
+                DataField.objects.values_list('pk', 'app_name', 'model_name',
+                                              'field_name').iterator():
+            if is_orphaned(app_name, model_name, field_name):
+                log.error('Field is an orphan.', extra={'field': pk})
+                fields.add(pk)
+
+        concepts = set()
+
+        if fields:
+            concepts.update(DataConceptField.objects.filter(
+                field__pk__in=fields).values_list('concept__pk', flat=True))
+
+        return fields, concepts
+
+    def _ensure(self):
+        version = get_version(ORPHAN_INDEX_VERSION)
+
+        if self._version != version or self._fields is None:
+            with self._lock:
+                if self._version != version or self._fields is None:
+                    self._fields, self._concepts = self._build()
+                    self._version = version
+
+    @property
+    def fields(self):
+        "Returns the set of ids of orphaned fields."
+        self._ensure()
+        return self._fields
+
+    @property
+    def concepts(self):
+        "Returns the set of ids of concepts with one or more orphaned fields."
+        self._ensure()
+        return self._concepts
+
+    def reset(self):
+        "Clears the index in this process."
+        self._version = None
+
+    def invalidate(self):
+        "Clears the index in all processes."
+        self.reset()
+        incr_version(ORPHAN_INDEX_VERSION)
+
+
+orphan_index = OrphanIndex()
+
+
+def _invalidate_orphan_index(sender, **kwargs):
+    orphan_index.invalidate()
+
+
+def _reset_orphan_index(sender, **kwargs):
+    # The app registry is local to each process
+    orphan_index.reset()
+
+
+for model in (DataField, DataConceptField):
+    post_save.connect(_invalidate_orphan_index, sender=model,
+                      dispatch_uid='serrano-orphans-save-{0}'.format(
+                          model.__name__))
+    post_delete.connect(_invalidate_orphan_index, sender=model,
+                        dispatch_uid='serrano-orphans-delete-{0}'.format(
+                            model.__name__))
+
+class_prepared.connect(_reset_orphan_index,
+                       dispatch_uid='serrano-orphans-prepared')
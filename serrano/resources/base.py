@@ -1,15 +1,23 @@
+import json
+import hashlib
 import functools
 from datetime import datetime
 from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.utils.http import quote_etag
+from restlib2.http import codes
 from restlib2.params import Parametizer
 from restlib2.resources import Resource
 from avocado.models import DataContext, DataView, DataQuery
 from serrano.conf import settings
+from serrano.cache import get_version
+from serrano.metadata import get_queryset_state, METADATA_CACHE_VERSION
+from serrano.orphans import ORPHAN_INDEX_VERSION
 from django.contrib.auth import authenticate, login
 from ..tokens import get_request_token
 from .. import cors
 
-__all__ = ('BaseResource', 'ThrottledResource')
+__all__ = ('BaseResource', 'ThrottledResource', 'CatalogResourceMixin')
 
 SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
 
@@ -202,9 +210,22 @@ class BaseResource(Resource):
             elif settings.AUTH_REQUIRED:
                 return True
 
+    def render(self, request, content=None, *args, **kwargs):
+        # Streaming responses do not subclass HttpResponse and would
+        # otherwise be treated as content to be encoded.
+        if isinstance(content, StreamingHttpResponse):
+            return content
+        return super(BaseResource, self).render(request, content, *args,
+                                                **kwargs)
+
     def process_response(self, request, response):
-        response = super(BaseResource, self).process_response(
-            request, response)
+        # The default processing reads the response content which would
+        # consume a streaming response, so only the cache headers are set.
+        if getattr(response, 'streaming', False):
+            self.response_cache_control(request, response)
+        else:
+            response = super(BaseResource, self).process_response(
+                request, response)
         response = cors.patch_response(request, response, self.allowed_methods)
         return response
 
@@ -300,3 +321,53 @@ class ThrottledResource(BaseResource):
             # exceeded the request limit or not and return the result of the
             # comparison.
             return new_count > limit_count
+
+
+class CatalogResourceMixin(object):
+    """Mixin for collection resources of fields, concepts and categories
+    which supports conditional GET requests.
+
+    The ETag is derived from the state of the metadata in the database
+    rather than the response content, so a request with a matching
+    `If-None-Match` header is answered with 304 Not Modified before anything
+    is serialized. Subclasses define `get_etag_data` returning the parts
+    that determine the representation or None to not use an ETag.
+    """
+    use_etags = True
+
+    def get_etag_data(self, request):
+        return None
+
+    def get_queryset_state(self, queryset):
+        """Returns the number of objects in `queryset`, the sum of their ids
+        and the time the most recent one was modified.
+        """
+        return get_queryset_state(queryset)
+
+    def get_etag(self, request, response, etag=None, *args, **kwargs):
+        if not hasattr(request, '_catalog_etag'):
+            data = self.get_etag_data(request)
+
+            if data is not None:
+                # Orphaned fields and the concepts containing them are
+                # removed from the representation.
+                orphans = self.checks_for_orphans and \
+                    get_version(ORPHAN_INDEX_VERSION)
+
+                data = [get_version(METADATA_CACHE_VERSION), orphans] + \
+                    list(data)
+                data = hashlib.md5(json.dumps(data, sort_keys=True))\
+                    .hexdigest()
+
+            request._catalog_etag = data
+
+        return request._catalog_etag
+
+    def set_etag(self, request, response):
+        if response.status_code not in (codes.ok, codes.not_modified):
+            return
+
+        etag = self.get_etag(request, response)
+
+        if etag is not None:
+            response['ETag'] = quote_etag(etag)
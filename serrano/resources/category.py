@@ -1,12 +1,13 @@
 import logging
 import functools
 from django.conf.urls import patterns, url
-from django.core.urlresolvers import reverse
-from preserialize.serialize import serialize
 from restlib2.params import Parametizer, BoolParam
 from avocado.events import usage
 from avocado.models import DataCategory
-from .base import ThrottledResource, SAFE_METHODS
+from serrano.links import link
+from serrano.metadata import metadata_cache
+from .serializers import serialize
+from .base import ThrottledResource, CatalogResourceMixin, SAFE_METHODS
 from . import templates
 
 can_change_category = lambda u: u.has_perm('avocado.change_datacategory')
@@ -20,17 +21,15 @@ def category_posthook(instance, data, request):
     remaining arguments must be partially applied using `functools.partial`
     during the request/response cycle.
     """
-    uri = request.build_absolute_uri
-
     data['_links'] = {
         'self': {
-            'href': uri(reverse('serrano:category', args=[instance.pk])),
+            'href': link(request, 'serrano:category', instance.pk),
         },
     }
 
     if data['parent_id']:
         data['_links']['parent'] = {
-            'href': uri(reverse('serrano:category', args=[data['parent_id']])),
+            'href': link(request, 'serrano:category', data['parent_id']),
         }
 
     return data
@@ -62,7 +61,7 @@ class CategoryBase(ThrottledResource):
             queryset = self.get_queryset(request)
 
             try:
-                instance = queryset.get(**kwargs)
+                instance = metadata_cache.get(queryset, **kwargs)
             except self.model.DoesNotExist:
                 instance = None
 
@@ -93,10 +92,20 @@ class CategoryResource(CategoryBase):
         return self.prepare(request, instance)
 
 
-class CategoriesResource(CategoryBase):
+class CategoriesResource(CatalogResourceMixin, CategoryBase):
     def is_not_found(self, request, response, *args, **kwargs):
         return False
 
+    def get_etag_data(self, request):
+        params = self.get_params(request)
+        privileged = can_change_category(request.user)
+        queryset = self.get_queryset(request)
+
+        if not privileged or not params['unpublished']:
+            queryset = queryset.published()
+
+        return [params, privileged, self.get_queryset_state(queryset)]
+
     def get(self, request, pk=None):
         params = self.get_params(request)
 
@@ -107,7 +116,8 @@ class CategoriesResource(CategoryBase):
         if not can_change_category(request.user) or not params['unpublished']:
             queryset = queryset.published()
 
-        return self.prepare(request, queryset, **params)
+        return self.prepare(request, metadata_cache.evaluate(queryset),
+                            **params)
 
 
 category_resource = CategoryResource()
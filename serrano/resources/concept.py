@@ -1,44 +1,74 @@
 import logging
 import functools
 from django.conf.urls import patterns, url
-from django.core.urlresolvers import reverse
-from preserialize.serialize import serialize
 from restlib2.http import codes
 from restlib2.params import Parametizer, BoolParam, StrParam, IntParam
 from avocado.events import usage
-from avocado.models import DataConcept, DataCategory
+from avocado.models import DataConcept, DataConceptField, DataCategory
 from avocado.conf import OPTIONAL_DEPS
 from serrano.resources.field import FieldResource
-from .base import ThrottledResource, SAFE_METHODS
+from serrano.links import link
+from serrano.metadata import metadata_cache, get_metadata_state
+from serrano.orphans import orphan_index
+from .serializers import serialize
+from .base import ThrottledResource, CatalogResourceMixin, SAFE_METHODS
 from . import templates
-from .field import base as FieldResources
 
 can_change_concept = lambda u: u.has_perm('avocado.change_dataconcept')
 log = logging.getLogger(__name__)
 
 
 def has_orphaned_field(instance):
-    has_orphan = False
-    for field in instance.fields.iterator():
-        if FieldResources.is_field_orphaned(field):
-            log.error('Concept has orphaned field.',
-                      extra={
-                          'concept': instance.pk,
-                          'field': field.pk
-                      })
-            has_orphan = True
-    return has_orphan
-
-
-def concept_posthook(instance, data, request, embed, brief, categories=None):
+    if instance.pk in orphan_index.concepts:
+        log.error('Concept has orphaned field.',
+                  extra={'concept': instance.pk})
+        return True
+    return False
+
+
+def get_concept_fields(request, concepts, template=None):
+    """Returns a dict of the serialized fields of each concept keyed by the
+    concept id.
+
+    The fields of all the concepts are read in a single query and each field
+    is serialized once even if it is shared by multiple concepts.
+    """
+    if template is None:
+        template = templates.ConceptField
+
+    resource = FieldResource()
+
+    data = dict((concept.pk, []) for concept in concepts)
+    fields = {}
+
+    queryset = DataConceptField.objects.filter(concept__pk__in=data.keys())\
+        .select_related('field')
+
+    for cf in metadata_cache.evaluate(queryset):
+        if cf.field_id not in fields:
+            fields[cf.field_id] = resource.prepare(request, cf.field)
+
+        field = dict(fields[cf.field_id])
+
+        # Add the alternate name specific to the relationship between the
+        # concept and the field.
+        field.update(serialize(cf, **template))
+        data[cf.concept_id].append(field)
+
+    return data
+
+
+def concept_posthook(instance, data, request, embed, brief, categories=None,
+                     fields=None):
     """Concept serialization post-hook for augmenting per-instance data.
 
     The only two arguments the post-hook takes is instance and data. The
     remaining arguments must be partially applied using `functools.partial`
     during the request/response cycle.
-    """
-    uri = request.build_absolute_uri
 
+    `fields` is a dict of the embedded fields keyed by concept id as
+    returned by `get_concept_fields`.
+    """
     if categories is None:
         categories = {}
 
@@ -62,18 +92,19 @@ def concept_posthook(instance, data, request, embed, brief, categories=None):
     if not brief:
         data['_links'] = {
             'self': {
-                'href': uri(reverse('serrano:concept', args=[instance.pk])),
+                'href': link(request, 'serrano:concept', instance.pk),
             },
             'fields': {
-                'href': uri(
-                    reverse('serrano:concept-fields', args=[instance.pk])),
+                'href': link(request, 'serrano:concept-fields', instance.pk),
             }
         }
 
     # Embeds the related fields directly in the concept output
     if not brief and embed:
-        resource = ConceptFieldsResource()
-        data['fields'] = resource.prepare(request, instance)
+        if fields is None:
+            fields = get_concept_fields(request, [instance])
+
+        data['fields'] = fields.get(instance.pk, [])
 
     return data
 
@@ -110,7 +141,7 @@ class ConceptBase(ThrottledResource):
             queryset = self.get_queryset(request)
 
             try:
-                instance = queryset.get(**kwargs)
+                instance = metadata_cache.get(queryset, **kwargs)
             except self.model.DoesNotExist:
                 instance = None
 
@@ -119,14 +150,14 @@ class ConceptBase(ThrottledResource):
         return request.instance
 
     def _get_categories(self, request, objects):
-        """Returns a QuerySet of categories for use during serialization.
+        """Returns a dict of categories by id for use during serialization.
 
         Since `category` is a nullable relationship to `concept`, a lookup
-        would have to occur for every concept being serialized. This returns
-        a QuerySet applicable to the resource using it and is cached for the
-        remainder of the request/response cycle.
+        would have to occur for every concept being serialized. The
+        categories are read from the metadata cache.
         """
-        return dict((x.pk, x) for x in list(DataCategory.objects.all()))
+        return dict((x.pk, x) for x in
+                    metadata_cache.evaluate(DataCategory.objects.all()))
 
     def prepare(self, request, objects, template=None, embed=False,
                 brief=False, **params):
@@ -139,9 +170,20 @@ class ConceptBase(ThrottledResource):
         else:
             categories = self._get_categories(request, objects)
 
+        fields = None
+
+        # Load the fields of all concepts up front rather than per concept
+        if embed and not brief:
+            if isinstance(objects, DataConcept):
+                concepts = [objects]
+            else:
+                objects = concepts = list(objects)
+
+            fields = get_concept_fields(request, concepts)
+
         posthook = functools.partial(
             concept_posthook, request=request, embed=embed, brief=brief,
-            categories=categories)
+            categories=categories, fields=fields)
 
         return serialize(objects, posthook=posthook, **template)
 
@@ -176,12 +218,6 @@ class ConceptResource(ConceptBase):
 class ConceptFieldsResource(ConceptBase):
     "Resource for interacting with fields specific to a Concept instance."
     def prepare(self, request, instance, template=None, **params):
-        if template is None:
-            template = templates.ConceptField
-
-        fields = []
-        resource = FieldResource()
-
         if self.checks_for_orphans and has_orphaned_field(instance):
             data = {
                 'message': 'One or more orphaned fields exist'
@@ -189,14 +225,7 @@ class ConceptFieldsResource(ConceptBase):
             return self.render(request, data,
                                status=codes.internal_server_error)
 
-        for cf in instance.concept_fields.select_related('field').iterator():
-            field = resource.prepare(request, cf.field)
-            # Add the alternate name specific to the relationship between the
-            # concept and the field.
-            field.update(serialize(cf, **template))
-            fields.append(field)
-
-        return fields
+        return get_concept_fields(request, [instance], template)[instance.pk]
 
     def get(self, request, pk):
         instance = self.get_object(request, pk=pk)
@@ -204,10 +233,27 @@ class ConceptFieldsResource(ConceptBase):
         return self.prepare(request, instance)
 
 
-class ConceptsResource(ConceptBase):
+class ConceptsResource(CatalogResourceMixin, ConceptBase):
     def is_not_found(self, request, response, *args, **kwargs):
         return False
 
+    def get_etag_data(self, request):
+        params = self.get_params(request)
+
+        # Search results depend on the search index
+        if params['query']:
+            return
+
+        privileged = can_change_concept(request.user)
+        queryset = self.get_queryset(request)
+
+        if not privileged or not params['unpublished']:
+            queryset = queryset.published()
+
+        # Categories and embedded fields are part of the representation
+        return [params, privileged, self.get_queryset_state(queryset),
+                get_metadata_state()]
+
     def get(self, request, pk=None):
         params = self.get_params(request)
 
@@ -221,6 +267,13 @@ class ConceptsResource(ConceptBase):
         if not can_change_concept(request.user) or not params['unpublished']:
             queryset = queryset.published()
 
+        # Concepts with orphaned fields are looked up in the orphan index
+        # rather than checking the fields of each concept.
+        if self.checks_for_orphans and params['embed']:
+            orphans = orphan_index.concepts
+        else:
+            orphans = ()
+
         # If Haystack is installed, perform the search
         if params['query'] and OPTIONAL_DEPS['haystack']:
             usage.log('search', model=self.model, request=request, data={
@@ -229,27 +282,20 @@ class ConceptsResource(ConceptBase):
             results = self.model.objects.search(
                 params['query'], queryset=queryset,
                 max_results=params['limit'], partial=True)
-            objects = (x.object for x in results)
+            objects = (x.object for x in results
+                       if x.object.pk not in orphans)
         else:
+            if orphans:
+                queryset = queryset.exclude(pk__in=orphans)
+
             if params['sort'] == 'name':
                 order.append('-name' if params['order'] == 'desc'
                              else 'name')
 
-            # We need to order before a possible slice is taken because
-            # querysets cannot be ordered post-slice.
-            queryset = queryset.order_by(*order)
+            objects = metadata_cache.evaluate(queryset.order_by(*order))
 
             if params['limit']:
-                queryset = queryset[:params['limit']]
-
-            objects = queryset
-
-        if self.checks_for_orphans and params['embed']:
-            pks = []
-            for obj in objects:
-                if not has_orphaned_field(obj):
-                    pks.append(obj.pk)
-            objects = self.model.objects.filter(pk__in=pks)
+                objects = objects[:params['limit']]
 
         return self.prepare(request, objects, **params)
 
@@ -2,13 +2,16 @@ import functools
 import logging
 from datetime import datetime
 from django.conf.urls import patterns, url
-from django.core.urlresolvers import reverse
 from django.views.decorators.cache import never_cache
 from restlib2.http import codes
-from preserialize.serialize import serialize
+from restlib2.params import Parametizer, BoolParam
 from avocado.events import usage
 from avocado.models import DataContext
+from serrano.counts import get_pending_counts, get_stored_count, \
+    context_count_key, COUNT_STORED
 from serrano.forms import ContextForm
+from serrano.links import link
+from .serializers import serialize
 from .base import ThrottledResource
 from .history import RevisionsResource, ObjectRevisionsResource, \
     ObjectRevisionResource
@@ -17,9 +20,7 @@ from . import templates
 log = logging.getLogger(__name__)
 
 
-def context_posthook(instance, data, request):
-    uri = request.build_absolute_uri
-
+def context_posthook(instance, data, request, pending=None):
     # If this context is explicitly tied to a model (via the `count`)
     # specify the object names.
     if instance.model:
@@ -29,13 +30,20 @@ def context_posthook(instance, data, request):
 
     data['_links'] = {
         'self': {
-            'href': uri(
-                reverse('serrano:contexts:single', args=[instance.pk])),
+            'href': link(request, 'serrano:contexts:single', instance.pk),
         },
         'stats': {
-            'href': uri(reverse('serrano:contexts:stats', args=[instance.pk])),
+            'href': link(request, 'serrano:contexts:stats', instance.pk),
         }
     }
+
+    # Deferred counts are computed by a background job. The pending counts
+    # of a list of contexts are read up front.
+    if pending is None:
+        pending = get_pending_counts(instance)
+
+    data['count_pending'] = instance.pk in pending
+
     return data
 
 
@@ -49,7 +57,8 @@ class ContextBase(ThrottledResource):
     def prepare(self, request, instance, template=None):
         if template is None:
             template = self.template
-        posthook = functools.partial(context_posthook, request=request)
+        posthook = functools.partial(context_posthook, request=request,
+                                     pending=get_pending_counts(instance))
         return serialize(instance, posthook=posthook, **template)
 
     def get_queryset(self, request, **kwargs):
@@ -184,15 +193,39 @@ class ContextResource(ContextBase):
         usage.log('delete', instance=instance, request=request)
 
 
+class ContextStatsParametizer(Parametizer):
+    refresh = BoolParam(False)
+
+
 class ContextStatsResource(ContextBase):
+    """Resource for the count of a context.
+
+    The count stored on the context is served unless the shared count cache
+    has a count for the current data. `stale` in the response denotes the
+    count may predate a refresh of the data. The `refresh` parameter forces
+    the count to be recomputed and stored.
+    """
+    parametizer = ContextStatsParametizer
+
     def is_not_found(self, request, response, **kwargs):
         return self.get_object(request, **kwargs) is None
 
     def get(self, request, **kwargs):
         instance = self.get_object(request, **kwargs)
+        params = self.get_params(request)
+
+        count, count_type = get_stored_count(
+            instance.count, context_count_key(instance),
+            instance.apply().distinct(), refresh=params['refresh'])
+
+        # Store the recomputed count on the context
+        if params['refresh'] and count != instance.count:
+            self.model.objects.filter(pk=instance.pk).update(count=count)
 
         return {
-            'count': instance.apply().distinct().count()
+            'count': count,
+            'count_type': count_type,
+            'stale': count_type == COUNT_STORED,
         }
 
 
@@ -1,13 +1,18 @@
 from datetime import datetime
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, StreamingHttpResponse, Http404
 from django.conf.urls import patterns, url
+from django.core.servers.basehttp import FileWrapper
 from django.core.urlresolvers import reverse
-from restlib2.params import Parametizer, IntParam, StrParam
+from restlib2.http import codes
+from restlib2.params import Parametizer, IntParam, StrParam, BoolParam
 from modeltree.tree import MODELTREE_DEFAULT_ALIAS, trees
 from avocado.export import registry as exporters
 from avocado.query import pipeline
 from avocado.events import usage
 from ..conf import settings
+from ..export import stream_export, iter_rows, rows_are_distinct, \
+    create_export_job, get_export_job, delete_export_job, JOB_COMPLETE
+from ..utils import get_request_owner
 from . import API_VERSION
 from .base import BaseResource
 
@@ -42,6 +47,52 @@ class ExporterRootResource(BaseResource):
 class ExporterParametizer(Parametizer):
     limit = IntParam(50)
     tree = StrParam(MODELTREE_DEFAULT_ALIAS, choices=trees)
+    stream = BoolParam()
+    async = BoolParam()
+
+
+def get_export_filename(file_tag, file_extension):
+    return '{0}-{1}-data.{2}'.format(file_tag, datetime.now(),
+                                     file_extension)
+
+
+def set_export_headers(response, export_type, filename, content_type):
+    cookie_name = settings.EXPORT_COOKIE_NAME_TEMPLATE.format(export_type)
+    response.set_cookie(cookie_name, settings.EXPORT_COOKIE_DATA)
+
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+        filename)
+    response['Content-Type'] = content_type
+
+
+def serialize_export_job(job, request):
+    "Returns the representation of an export job for the response."
+    uri = request.build_absolute_uri
+
+    data = {
+        'id': job['id'],
+        'type': job['type'],
+        'status': job['status'],
+        'rows': job['rows'],
+        'size': job['size'],
+        'error': job['error'],
+        'created': job['created'],
+        'finished': job['finished'],
+        '_links': {
+            'self': {
+                'href': uri(reverse('serrano:data:export-job',
+                                    kwargs={'job_id': job['id']})),
+            },
+        }
+    }
+
+    if job['status'] == JOB_COMPLETE:
+        data['_links']['download'] = {
+            'href': uri(reverse('serrano:data:export-job-download',
+                                kwargs={'job_id': job['id']})),
+        }
+
+    return data
 
 
 class ExporterResource(BaseResource):
@@ -51,18 +102,10 @@ class ExporterResource(BaseResource):
 
     parametizer = ExporterParametizer
 
-    def _export(self, request, export_type, view, context, **kwargs):
-        # Handle an explicit export type to a file
-        resp = HttpResponse()
-
-        params = self.get_params(request)
-
-        limit = params.get('limit')
-        tree = params.get('tree')
-
-        page = kwargs.get('page')
-        stop_page = kwargs.get('stop_page')
-
+    def _get_range(self, limit, page=None, stop_page=None):
+        """Returns the file tag, offset and limit of the export for the
+        requested page or page range.
+        """
         offset = None
 
         # Restrict export to a particular page or page range
@@ -96,33 +139,81 @@ class ExporterResource(BaseResource):
             limit = None
             file_tag = 'all'
 
+        return file_tag, offset, limit
+
+    def _export(self, request, export_type, view, context, **kwargs):
+        params = self.get_params(request)
+
+        tree = params.get('tree')
+        stream = params.get('stream')
+
+        if stream is None:
+            stream = settings.EXPORT_STREAMING
+
+        page = kwargs.get('page')
+
+        file_tag, offset, limit = self._get_range(
+            params.get('limit'), page, kwargs.get('stop_page'))
+
         QueryProcessor = pipeline.query_processors.default
         processor = QueryProcessor(context=context, view=view, tree=tree,
                                    include_pk=False)
 
         exporter = processor.get_exporter(exporters[export_type])
-        iterable = processor.get_iterable()
 
-        # Write the data to the response
-        exporter.write(iterable, resp, request=request, offset=offset,
-                       limit=limit)
+        # Stream the data to the client as it is written or write it to the
+        # response in full.
+        if stream:
+            queryset = processor.get_queryset()
+
+            # Rows that are known to be distinct are not tracked by the
+            # exporter, which otherwise holds every row written.
+            resp = StreamingHttpResponse(stream_export(
+                exporter, iter_rows(queryset), request=request,
+                offset=offset, limit=limit,
+                force_distinct=not rows_are_distinct(queryset, exporter)))
+        else:
+            resp = HttpResponse()
+            exporter.write(processor.get_iterable(), resp, request=request,
+                           offset=offset, limit=limit)
+
+        filename = get_export_filename(file_tag, exporter.file_extension)
+        set_export_headers(resp, export_type, filename, exporter.content_type)
 
-        filename = '{0}-{1}-data.{2}'.format(
-            file_tag, datetime.now(), exporter.file_extension)
+        usage.log('export', request=request, data={
+            'type': export_type,
+            'partial': page is not None,
+            'streamed': stream,
+        })
+
+        return resp
+
+    def _enqueue(self, request, export_type, view, context, **kwargs):
+        "Creates a background job for the export."
+        params = self.get_params(request)
+
+        page = kwargs.get('page')
 
-        cookie_name = settings.EXPORT_COOKIE_NAME_TEMPLATE.format(export_type)
-        resp.set_cookie(cookie_name, settings.EXPORT_COOKIE_DATA)
+        file_tag, offset, limit = self._get_range(
+            params.get('limit'), page, kwargs.get('stop_page'))
 
-        resp['Content-Disposition'] = 'attachment; filename="{0}"'.format(
-            filename)
-        resp['Content-Type'] = exporter.content_type
+        filename = get_export_filename(
+            file_tag, exporters[export_type].file_extension)
+
+        job = create_export_job(
+            export_type, view, context, params.get('tree'), filename,
+            owner=get_request_owner(request), offset=offset, limit=limit)
 
         usage.log('export', request=request, data={
             'type': export_type,
             'partial': page is not None,
+            'job': job['id'],
         })
 
-        return resp
+        data = serialize_export_job(job, request)
+        response = self.render(request, data, status=codes.accepted)
+        response['Location'] = data['_links']['self']['href']
+        return response
 
     # Resource is dependent on the available export types
     def is_not_found(self, request, response, export_type, **kwargs):
@@ -133,16 +224,90 @@ class ExporterResource(BaseResource):
         context = self.get_context(request)
         return self._export(request, export_type, view, context, **kwargs)
 
-    post = get
+    def post(self, request, export_type, **kwargs):
+        view = self.get_view(request)
+        context = self.get_context(request)
+
+        params = self.get_params(request)
+        run_async = params.get('async')
+
+        if run_async is None:
+            run_async = settings.EXPORT_ASYNC
+
+        if run_async:
+            return self._enqueue(request, export_type, view, context,
+                                 **kwargs)
+
+        return self._export(request, export_type, view, context, **kwargs)
+
+
+class ExportJobResource(BaseResource):
+    "Resource for checking the progress of an asynchronous export."
+
+    cache_max_age = 0
+
+    private_cache = True
+
+    def get_object(self, request, job_id):
+        if not hasattr(request, 'instance'):
+            job = get_export_job(job_id)
+
+            # Jobs are only accessible to the user or session that created
+            # them.
+            if job and job['owner'] and \
+                    job['owner'] != get_request_owner(request):
+                job = None
+
+            request.instance = job
+
+        return request.instance
+
+    def is_not_found(self, request, response, job_id):
+        return self.get_object(request, job_id) is None
+
+    def get(self, request, job_id):
+        return serialize_export_job(self.get_object(request, job_id), request)
+
+    def delete(self, request, job_id):
+        delete_export_job(self.get_object(request, job_id))
+
+
+class ExportJobDownloadResource(ExportJobResource):
+    "Resource for downloading the file of a completed export job."
+
+    allowed_methods = ('GET', 'HEAD')
+
+    def get(self, request, job_id):
+        job = self.get_object(request, job_id)
+
+        if job['status'] != JOB_COMPLETE:
+            data = {
+                'message': 'Export is not complete',
+            }
+            return self.render(request, data, status=codes.conflict)
+
+        resp = StreamingHttpResponse(FileWrapper(open(job['path'], 'rb')))
+        resp['Content-Length'] = job['size']
+
+        set_export_headers(resp, job['type'], job['filename'],
+                           job['content_type'])
+
+        return resp
 
 
 exporter_resource = ExporterResource()
 exporter_root_resource = ExporterRootResource()
+export_job_resource = ExportJobResource()
+export_job_download_resource = ExportJobDownloadResource()
 
 # Resource endpoints
 urlpatterns = patterns(
     '',
     url(r'^$', exporter_root_resource, name='exporter'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]{32})/$', export_job_resource,
+        name='export-job'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]{32})/download/$',
+        export_job_download_resource, name='export-job-download'),
     url(r'^(?P<export_type>\w+)/$', exporter_resource, name='exporter'),
     url(r'^(?P<export_type>\w+)/(?P<page>\d+)/$', exporter_resource,
         name='exporter'),
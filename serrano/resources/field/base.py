@@ -1,17 +1,19 @@
 import functools
 import logging
-from django.core.urlresolvers import reverse
-from preserialize.serialize import serialize
 from restlib2.http import codes
 from restlib2.params import Parametizer, StrParam, BoolParam, IntParam
 from avocado.conf import OPTIONAL_DEPS
 from avocado.models import DataField
 from avocado.events import usage
-from ..base import ThrottledResource
+from serrano.links import link
+from serrano.metadata import metadata_cache
+from serrano.orphans import orphan_index
+from serrano.stats import stats_capable
+from ..serializers import serialize
+from ..base import ThrottledResource, CatalogResourceMixin
 from .. import templates
 
 can_change_field = lambda u: u.has_perm('avocado.change_datafield')
-stats_capable = lambda x: not x.searchable
 log = logging.getLogger(__name__)
 
 
@@ -30,13 +32,10 @@ def field_posthook(instance, data, request):
     during the request/response cycle.
     """
 
-    uri = request.build_absolute_uri
-
     # Augment the links
     data['_links'] = {
         'self': {
-            'href': uri(reverse('serrano:field',
-                        args=[instance.pk])),
+            'href': link(request, 'serrano:field', instance.pk),
         }
     }
 
@@ -46,18 +45,16 @@ def field_posthook(instance, data, request):
         data['orphaned'] = True
     else:
         data['_links']['values'] = {
-            'href': uri(reverse('serrano:field-values',
-                        args=[instance.pk])),
+            'href': link(request, 'serrano:field-values', instance.pk),
         }
         data['_links']['distribution'] = {
-            'href': uri(reverse('serrano:field-distribution',
-                        args=[instance.pk])),
+            'href': link(request, 'serrano:field-distribution',
+                         instance.pk),
         }
 
         if stats_capable(instance):
             data['_links']['stats'] = {
-                'href': uri(reverse('serrano:field-stats',
-                            args=[instance.pk])),
+                'href': link(request, 'serrano:field-stats', instance.pk),
             }
 
     return data
@@ -85,6 +82,12 @@ class FieldBase(ThrottledResource):
 
     template = templates.Field
 
+    # If false, the field is always read from the database. Resources that
+    # read the field's data require the current `data_version` which is
+    # incremented with an update that does not invalidate the metadata
+    # cache.
+    use_metadata_cache = True
+
     def get_queryset(self, request):
         queryset = self.model.objects.all()
         if not can_change_field(request.user):
@@ -96,7 +99,10 @@ class FieldBase(ThrottledResource):
             queryset = self.get_queryset(request)
 
             try:
-                instance = queryset.get(**kwargs)
+                if self.use_metadata_cache:
+                    instance = metadata_cache.get(queryset, **kwargs)
+                else:
+                    instance = queryset.get(**kwargs)
             except self.model.DoesNotExist:
                 instance = None
 
@@ -134,12 +140,27 @@ class FieldResource(FieldBase):
         return self.prepare(request, instance)
 
 
-class FieldsResource(FieldResource):
+class FieldsResource(CatalogResourceMixin, FieldResource):
     "Field Collection Resource"
 
     def is_not_found(self, request, response, *args, **kwargs):
         return False
 
+    def get_etag_data(self, request):
+        params = self.get_params(request)
+
+        # Search results depend on the search index
+        if params['query']:
+            return
+
+        privileged = can_change_field(request.user)
+        queryset = self.get_queryset(request)
+
+        if not privileged or not params['unpublished']:
+            queryset = queryset.published()
+
+        return [params, privileged, self.get_queryset_state(queryset)]
+
     def get(self, request):
         params = self.get_params(request)
         queryset = self.get_queryset(request)
@@ -149,6 +170,13 @@ class FieldsResource(FieldResource):
         if not can_change_field(request.user) or not params['unpublished']:
             queryset = queryset.published()
 
+        # Orphaned fields are looked up in the orphan index rather than
+        # checking each field.
+        if self.checks_for_orphans:
+            orphans = orphan_index.fields
+        else:
+            orphans = ()
+
         # If Haystack is installed, perform the search
         if params['query'] and OPTIONAL_DEPS['haystack']:
             usage.log('search', model=self.model, request=request, data={
@@ -157,22 +185,19 @@ class FieldsResource(FieldResource):
             results = self.model.objects.search(
                 params['query'], queryset=queryset,
                 max_results=params['limit'], partial=True)
-            objects = (x.object for x in results)
+            objects = (x.object for x in results
+                       if x.object.pk not in orphans)
         else:
+            if orphans:
+                queryset = queryset.exclude(pk__in=orphans)
+
             if params['sort'] == 'name':
                 order = '-name' if params['order'] == 'desc' else 'name'
                 queryset = queryset.order_by(order)
 
-            if params['limit']:
-                queryset = queryset[:params['limit']]
-
-            objects = queryset
+            objects = metadata_cache.evaluate(queryset)
 
-        if self.checks_for_orphans:
-            pks = []
-            for obj in objects:
-                if not is_field_orphaned(obj):
-                    pks.append(obj.pk)
-            objects = self.model.objects.filter(pk__in=pks)
+            if params['limit']:
+                objects = objects[:params['limit']]
 
         return self.prepare(request, objects, **params)
@@ -1,17 +1,123 @@
 from decimal import Decimal
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q, Min, Max
 from restlib2.http import codes
 from restlib2.params import Parametizer, StrParam, BoolParam, IntParam
 from modeltree.tree import MODELTREE_DEFAULT_ALIAS, trees
 from avocado.models import DataField
 from avocado.stats import kmeans
 from avocado.events import usage
+from serrano.cache import make_key
+from serrano.conf import settings, dep_supported
+from serrano.counts import get_data_version
 from .base import FieldBase
 
 
 MINIMUM_OBSERVATIONS = 500
 MAXIMUM_OBSERVATIONS = 50000
 
+# Clustering with NumPy supports many more observations
+NUMPY_MAXIMUM_OBSERVATIONS = 500000
+
+# Upper bound on the number of bins of a histogram
+MAXIMUM_BINS = 1000
+
+DIST_CACHE_KEY = 'serrano:dist'
+
+
+def _bin_expression(vendor, value, low, high, bins):
+    """Returns the SQL and params of an expression for the zero-based bin
+    of `value` for `bins` bins of equal width between `low` and `high`.
+    Values equal to `high` fall in the last bin.
+    """
+    expr = 'CASE WHEN {0} >= %s THEN %s ELSE '
+
+    if vendor == 'postgresql':
+        expr += 'width_bucket(CAST({0} AS double precision), %s, %s, %s) - 1'
+        params = [low, high, bins]
+    else:
+        # SQLite has no FLOOR function, but truncation is equivalent since
+        # values are never less than `low`.
+        if vendor == 'sqlite':
+            expr += 'CAST(({0} - %s) / %s AS INTEGER)'
+        else:
+            expr += 'FLOOR(({0} - %s) / %s)'
+        params = [low, (high - low) / float(bins)]
+
+    expr += ' END'
+
+    return expr.format(value), [high, bins - 1] + params
+
+
+def get_histogram(queryset, path, column, bins):
+    """Returns a list of the counts of the values of the field `column`
+    at the lookup `path` relative to `queryset` in `bins` bins of equal
+    width, and the number of null values.
+
+    The range of values is determined by one aggregate query and the
+    values are binned and counted by another, so the size of the data
+    does not affect the size of the result.
+    """
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+
+    bounds = queryset.aggregate(low=Min(path), high=Max(path))
+    low, high = bounds['low'], bounds['high']
+
+    # The primary key is selected along with the value so a distinct
+    # queryset, e.g. one with a context applied, counts each object rather
+    # than each distinct value. It is aliased since the column of the field
+    # may have the same name.
+    opts = queryset.model._meta
+    values = queryset.extra(select={
+        'serrano_pk': '{0}.{1}'.format(qn(opts.db_table), qn(opts.pk.column)),
+    }).values_list('serrano_pk', path)
+
+    sql, params = values.query.sql_with_params()
+
+    value = 't.{0}'.format(qn(column))
+
+    if low is None:
+        expr, expr_params = 'NULL', []
+    elif low == high:
+        expr, expr_params = 'CASE WHEN {0} IS NULL THEN NULL ELSE 0 END'\
+            .format(value), []
+    else:
+        low, high = float(low), float(high)
+        expr, expr_params = _bin_expression(connection.vendor, value, low,
+                                            high, bins)
+
+    cursor = connection.cursor()
+    cursor.execute('SELECT {0} AS bin, COUNT(*) FROM ({1}) t GROUP BY bin'
+                   .format(expr, sql), expr_params + list(params))
+
+    counts = dict((b if b is None else int(b), c)
+                  for b, c in cursor.fetchall())
+    nulls = counts.pop(None, 0)
+
+    if low is None:
+        return [], nulls
+
+    if low == high:
+        return [{
+            'count': counts.get(0, 0),
+            'min': low,
+            'max': high,
+        }], nulls
+
+    width = (high - low) / bins
+    data = []
+
+    for i in range(bins):
+        data.append({
+            'count': counts.get(i, 0),
+            'min': low + i * width,
+            'max': high if i == bins - 1 else low + (i + 1) * width,
+        })
+
+    return data, nulls
+
 
 class FieldDistParametizer(Parametizer):
     tree = StrParam(MODELTREE_DEFAULT_ALIAS, choices=trees)
@@ -20,6 +126,7 @@ class FieldDistParametizer(Parametizer):
     sort = StrParam()
     cluster = BoolParam(True)
     n = IntParam()
+    bins = IntParam()
 
 
 class FieldDistribution(FieldBase):
@@ -27,6 +134,8 @@ class FieldDistribution(FieldBase):
 
     parametizer = FieldDistParametizer
 
+    use_metadata_cache = False
+
     def get(self, request, pk):
         instance = self.get_object(request, pk=pk)
         params = self.get_params(request)
@@ -68,6 +177,53 @@ class FieldDistribution(FieldBase):
             fields = [instance]
             groupby = [tree.query_string_for_field(instance.field)]
 
+        # Identical requests are served from the cache until the data is
+        # refreshed or the context changes
+        key = self.get_cache_key(instance, params, fields, context)
+
+        if key:
+            data = cache.get(key)
+
+            if data is not None:
+                usage.log('dist', instance=instance, request=request, data={
+                    'size': data['size'],
+                    'clustered': data['clustered'],
+                    'aware': params['aware'],
+                })
+                return data
+
+        data = self.get_distribution(request, instance, params, tree_field,
+                                     queryset, fields, groupby)
+
+        if (key and isinstance(data, dict) and
+                len(data['data']) + len(data['outliers']) <=
+                settings.DISTRIBUTION_CACHE_MAX_SIZE):
+            cache.set(key, data, settings.DISTRIBUTION_CACHE_TIMEOUT)
+
+        return data
+
+    def get_cache_key(self, instance, params, fields, context):
+        """Returns the cache key of the distribution of `instance` for the
+        request or None if caching is disabled.
+
+        The data version of all fields is included since the tree and the
+        context may span any of them. The context only applies if the
+        distribution is context-aware.
+        """
+        if not settings.DISTRIBUTION_CACHE_ENABLED:
+            return
+
+        return make_key(DIST_CACHE_KEY, get_data_version(), instance.pk,
+                        [f.pk for f in fields], params,
+                        context.json if params['aware'] else None)
+
+    def get_distribution(self, request, instance, params, tree_field,
+                         queryset, fields, groupby):
+        # Binning of a single continuous dimension is done by the database
+        if params['bins']:
+            return self.get_histogram(request, instance, params, queryset,
+                                      fields, groupby)
+
         # Perform a count aggregation of the tree model grouped by the
         # specified dimensions
         stats = tree_field.count(*groupby)
@@ -103,7 +259,14 @@ class FieldDistribution(FieldBase):
             })
             return resp
 
-        if length > MAXIMUM_OBSERVATIONS:
+        use_numpy = dep_supported('numpy')
+
+        if use_numpy:
+            maximum = NUMPY_MAXIMUM_OBSERVATIONS
+        else:
+            maximum = MAXIMUM_OBSERVATIONS
+
+        if length > maximum:
             data = {
                 'message': 'Data too large',
             }
@@ -125,7 +288,12 @@ class FieldDistribution(FieldBase):
 
         # For N-dimensional continuous data, check if clustering should occur
         # to down-sample the data.
-        if all([d.simple_type == 'number' for d in fields]):
+        continuous = all([d.simple_type == 'number' for d in fields])
+
+        if continuous and use_numpy:
+            points, outliers, clustered = self.cluster_numpy(
+                points, params, length)
+        elif continuous:
             # Extract observations for clustering
             obs = []
             for point in points:
@@ -164,3 +332,71 @@ class FieldDistribution(FieldBase):
             'outliers': outliers,
             'size': length,
         }
+
+    def cluster_numpy(self, points, params, length):
+        """Equivalent to the clustering and outlier detection of points
+        using Python lists, but on NumPy arrays.
+        """
+        import numpy as np
+        from serrano import kmeans as np_kmeans
+
+        # Decimals are converted by the array rather than per value
+        obs = np.array([p['values'] for p in points], dtype=float)
+
+        if params['cluster'] and length >= MINIMUM_OBSERVATIONS:
+            counts = np.fromiter((p['count'] for p in points), dtype=float,
+                                 count=length)
+            points, outliers = np_kmeans.weighted_counts(
+                obs, counts, params['n'])
+            return points, outliers, True
+
+        # The values of the points are returned as is, as by the pure
+        # Python path, other than Decimals which are not serializable.
+        for point in points:
+            values = point['values']
+
+            for i, dim in enumerate(values):
+                if isinstance(dim, Decimal):
+                    values[i] = float(str(dim))
+
+        indexes = set(np_kmeans.find_outliers(obs, normalized=False).tolist())
+
+        outliers = [p for i, p in enumerate(points) if i in indexes]
+        points = [p for i, p in enumerate(points) if i not in indexes]
+
+        return points, outliers, False
+
+    def get_histogram(self, request, instance, params, queryset, fields,
+                      groupby):
+        if len(fields) != 1 or fields[0].simple_type != 'number':
+            data = {
+                'message': 'Histograms require a single numeric dimension',
+            }
+            return self.render(request, data,
+                               status=codes.unprocessable_entity)
+
+        bins = max(1, min(params['bins'], MAXIMUM_BINS))
+
+        points, nulls = get_histogram(queryset, groupby[0],
+                                      fields[0].field.column, bins)
+
+        size = sum(p['count'] for p in points)
+
+        if params['nulls'] and nulls:
+            points.append({'count': nulls, 'min': None, 'max': None})
+            size += nulls
+
+        usage.log('dist', instance=instance, request=request, data={
+            'size': size,
+            'clustered': False,
+            'aware': params['aware'],
+            'bins': bins,
+        })
+
+        return {
+            'data': points,
+            'clustered': False,
+            'outliers': [],
+            'size': size,
+            'bins': bins,
+        }
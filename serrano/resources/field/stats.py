@@ -1,31 +1,34 @@
 from django.core.urlresolvers import reverse
+from restlib2.params import Parametizer, BoolParam
 from avocado.events import usage
+from serrano.stats import get_stats
 from .base import FieldBase
 
 
+class FieldStatsParametizer(Parametizer):
+    aware = BoolParam(False)
+
+
 class FieldStats(FieldBase):
     "Field Stats Resource"
 
+    parametizer = FieldStatsParametizer
+
+    use_metadata_cache = False
+
     def get(self, request, pk):
         uri = request.build_absolute_uri
         instance = self.get_object(request, pk=pk)
+        params = self.get_params(request)
 
-        if instance.simple_type == 'number':
-            stats = instance.max().min().avg()
-        elif (instance.simple_type == 'date' or
-              instance.simple_type == 'time' or
-              instance.simple_type == 'datetime'):
-            stats = instance.max().min()
+        # The `aware` flag makes the stats relative to the applied context.
+        # Stats are cached per data version of the field and context.
+        if params['aware']:
+            context = self.get_context(request)
         else:
-            stats = instance.count(distinct=True)
+            context = None
 
-        if stats is None:
-            resp = {}
-        else:
-            try:
-                resp = next(iter(stats))
-            except StopIteration:
-                resp = {}
+        resp = dict(get_stats(instance, context=context))
 
         resp['_links'] = {
             'self': {
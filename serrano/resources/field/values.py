@@ -1,18 +1,57 @@
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page
+from django.db import connections
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.core.urlresolvers import reverse
 from django.utils.encoding import smart_unicode
 from restlib2.http import codes
 from restlib2.params import StrParam, IntParam, BoolParam
+from avocado.core import utils
 from avocado.events import usage
+from serrano.cache import make_key
+from serrano.conf import settings
+from serrano.counts import get_field_data_version
+from serrano.sampling import get_random_values
+from serrano.value_index import value_indexes
 from ..pagination import PaginatorResource, PaginatorParametizer
 from .base import FieldBase
 
+VALUES_CACHE_KEY = 'serrano:values'
+
+
+def get_capped_count(queryset, limit):
+    """Returns the number of rows in `queryset` up to `limit`.
+
+    Only the first `limit` rows are read by the database rather than
+    counting all of them.
+    """
+    try:
+        sql, params = queryset.order_by()[:limit].query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+
+    cursor = connections[queryset.db].cursor()
+    cursor.execute('SELECT COUNT(*) FROM ({0}) t'.format(sql), params)
+
+    return cursor.fetchone()[0]
+
+
+def is_hashable(value):
+    "Returns true if `value` can be a member of a set or key of a dict."
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
 
 class FieldValuesParametizer(PaginatorParametizer):
     limit = IntParam(10)
     aware = BoolParam(False)
     query = StrParam()
     random = IntParam()
+    prefix = BoolParam()
 
 
 class FieldValues(FieldBase, PaginatorResource):
@@ -24,6 +63,11 @@ class FieldValues(FieldBase, PaginatorResource):
 
     parametizer = FieldValuesParametizer
 
+    use_metadata_cache = False
+
+    # Identifiers may be uploaded as a file for validation
+    supported_content_types = ('application/json', 'multipart/form-data')
+
     def get_base_values(self, request, instance, params):
         "Returns the base queryset for this field."
         # The `aware` flag toggles the behavior of the distribution by making
@@ -34,46 +78,73 @@ class FieldValues(FieldBase, PaginatorResource):
             context = self.get_context(request, attrs={})
         return context.apply(queryset=instance.model.objects.all())
 
+    def get_value_labels(self, request, instance, queryset):
+        """Returns a queryset of the distinct, ordered value/label pairs of
+        this field in `queryset`.
+        """
+        return queryset.values_list(instance.field_name,
+                                    instance.label_field.name)\
+            .order_by(instance.order_field.name).distinct()
+
     def get_all_values(self, request, instance):
-        "Returns all distinct values for this field."
-        results = []
-        for value, label in instance.choices():
-            results.append({
-                'label': label,
-                'value': value,
-            })
-        return results
+        """Returns the distinct value/label pairs of this field.
+
+        The pairs are returned as a queryset so only the requested page is
+        read from the database, unless the field's values are indexed in
+        memory.
+        """
+        if instance._has_predefined_choices():
+            return [(value, label) for value, label in instance.field.choices]
+
+        index = value_indexes.get(instance)
+
+        if index is not None:
+            return index.entries
+
+        return self.get_value_labels(request, instance,
+                                     instance.model.objects.all())
 
-    def get_search_values(self, request, instance, query):
+    def get_search_values(self, request, instance, query, prefix=False):
         """
-        Performs a search on the underlying data for a field.
+        Performs a search on the underlying data for a field and returns the
+        matching value/label pairs.
+
+        If `prefix` is true, only values starting with `query` match which
+        allows the database to use an index on the search field.
 
         This method can be overridden to use an alternate search
         implementation.
         """
-        results = []
-        for value in instance.search(query):
-            results.append({
-                'label': instance.get_label(value),
-                'value': value,
-            })
-        return results
+        search_field = instance.search_field
+
+        if utils.get_simple_type(search_field) != 'string':
+            return []
+
+        index = value_indexes.get(instance)
+
+        if index is not None:
+            return index.search(query, prefix=prefix)
+
+        if prefix:
+            lookup = '{0}__istartswith'.format(search_field.name)
+        else:
+            lookup = '{0}__icontains'.format(search_field.name)
+
+        queryset = instance.model.objects.filter(**{lookup: query})
+
+        return self.get_value_labels(request, instance, queryset)
+
+    def format_values(self, values):
+        return [{
+            'label': smart_unicode(label),
+            'value': value,
+        } for value, label in values]
 
     def get_random_values(self, request, instance, random):
         """Returns a random set of values. This is useful for pre-populating
         documents or form fields with example data.
         """
-        queryset = instance.model.objects.only(instance.field_name)\
-            .order_by('?')[:random]
-
-        results = []
-        for obj in queryset:
-            value = getattr(obj, instance.field_name)
-            results.append({
-                'label': instance.get_label(value),
-                'value': value,
-            })
-        return results
+        return self.format_values(get_random_values(instance, random))
 
     def get(self, request, pk):
         instance = self.get_object(request, pk=pk)
@@ -82,27 +153,38 @@ class FieldValues(FieldBase, PaginatorResource):
         if params['random']:
             return self.get_random_values(request, instance, params['random'])
 
-        page = params['page']
+        page = max(params['page'], 1)
         limit = params['limit']
+        query = params['query']
+        prefix = params['prefix']
+
+        if prefix is None:
+            prefix = settings.VALUES_SEARCH_PREFIX
 
-        # If a query term is supplied, perform the icontains search
-        if params['query']:
+        # If a query term is supplied, perform the search
+        if query:
             usage.log('values', instance=instance, request=request, data={
-                'query': params['query'],
+                'query': query,
             })
-            values = self.get_search_values(request, instance, params['query'])
+
+            values = self.get_search_values(request, instance, query,
+                                            prefix=prefix)
         else:
             values = self.get_all_values(request, instance)
 
-        # No page specified, return everything
-        if page is None:
-            return values
+        key = None
 
-        paginator = self.get_paginator(values, limit=limit)
-        page = paginator.page(page)
+        if settings.VALUES_CACHE_ENABLED:
+            key = make_key(VALUES_CACHE_KEY, instance.pk,
+                           get_field_data_version(instance), query,
+                           bool(query and prefix), page, limit,
+                           settings.VALUES_COUNT_LIMIT)
+
+        paginator, page = self.get_values_page(values, page, limit, key=key)
 
         # Get paginator-based response
         resp = self.get_page_response(request, paginator, page)
+        resp['count_capped'] = paginator.capped
 
         # Add links
         path = reverse('serrano:field-values', kwargs={'pk': pk})
@@ -114,29 +196,129 @@ class FieldValues(FieldBase, PaginatorResource):
         }
         resp.update({
             '_links': links,
-            'values': page.object_list,
+            'values': self.format_values(page.object_list),
         })
 
         return resp
 
+    def get_values_page(self, values, page, limit, key=None):
+        """Returns the paginator and page `page` of `values`.
+
+        Only the values of the page, and one more to determine if there is a
+        next page, are read. The values are counted up to the
+        VALUES_COUNT_LIMIT setting. Beyond that the count is a lower bound
+        which includes the values read for the page.
+
+        If `key` is supplied, the values of the page and the count are read
+        from and stored in the cache under the key.
+        """
+        if not limit or not hasattr(values, 'query'):
+            values = list(values)
+            paginator = self.get_paginator(values, limit=limit)
+            paginator.capped = False
+            return paginator, paginator.page(min(page, paginator.num_pages))
+
+        offset = (page - 1) * limit
+        count_limit = settings.VALUES_COUNT_LIMIT
+
+        cached = cache.get(key) if key else None
+
+        if cached is None:
+            # Read one more than the limit to determine if there is a next
+            # page
+            objects = list(values[offset:offset + limit + 1])
+            count = get_capped_count(values, count_limit)
+
+            if key:
+                cache.set(key, (objects, count),
+                          settings.VALUES_CACHE_TIMEOUT)
+        else:
+            objects, count = cached
+
+        capped = count >= count_limit
+
+        if capped:
+            count = max(count, offset + len(objects))
+
+        paginator = self.get_paginator(values, limit=limit, count=count)
+        paginator.capped = capped
+
+        return paginator, Page(objects[:limit], page, paginator)
+
+    def get_uploaded_values(self, request, instance):
+        """Returns a list of value dicts for the identifiers in the uploaded
+        file, one per line. Blank lines are skipped.
+        """
+        array = []
+
+        for line in request.FILES['file']:
+            line = smart_unicode(line).strip()
+
+            if line:
+                array.append({'value': line})
+
+        return array
+
+    def to_python(self, instance, value):
+        "Converts an uploaded identifier into a value of the field."
+        try:
+            return instance.field.to_python(value)
+        except ValidationError:
+            return None
+
+    def get_value_label_maps(self, queryset, instance, values, labels):
+        """Returns a dict of the valid `values` to their labels and a dict
+        of the valid `labels` to their values.
+
+        The values and labels are looked up in chunks of the
+        VALUES_VALIDATE_CHUNK_SIZE setting so large lists do not exceed the
+        parameter limits of the database. Only matching values and labels
+        are kept.
+        """
+        value_field_name = instance.field_name
+        label_field_name = instance.label_field.name
+        chunk_size = settings.VALUES_VALIDATE_CHUNK_SIZE
+
+        queryset = queryset.values_list(value_field_name, label_field_name)
+
+        value_labels = {}
+        label_values = {}
+
+        for lookup, items in (('{0}__in'.format(value_field_name), values),
+                              ('{0}__in'.format(label_field_name), labels)):
+            items = list(items)
+
+            for i in xrange(0, len(items), chunk_size):
+                chunk = items[i:i + chunk_size]
+
+                for value, label in queryset.filter(**{lookup: chunk})\
+                        .iterator():
+                    value_labels[value] = label
+                    label_values[label] = value
+
+        return value_labels, label_values
+
     def post(self, request, pk):
         instance = self.get_object(request, pk=pk)
         params = self.get_params(request)
 
-        if not request.data:
+        uploaded = 'file' in request.FILES
+
+        if uploaded:
+            array = self.get_uploaded_values(request, instance)
+        elif not getattr(request, 'data', None):
             data = {
                 'message': 'Error parsing data',
             }
             return self.render(request, data,
                                status=codes.unprocessable_entity)
-
-        if isinstance(request.data, dict):
+        elif isinstance(request.data, dict):
             array = [request.data]
         else:
             array = request.data
 
-        values = []
-        labels = []
+        values = set()
+        labels = set()
         array_map = {}
 
         # Separate out the values and labels for the lookup. Track indexes
@@ -145,10 +327,30 @@ class FieldValues(FieldBase, PaginatorResource):
             # Value takes precedence over label if supplied
             if 'value' in datum:
                 array_map[i] = 'value'
-                values.append(datum['value'])
+
+                # Uploaded identifiers are strings which are converted to
+                # the type of the field. Identifiers that cannot be
+                # converted are invalid.
+                if uploaded:
+                    value = self.to_python(instance, datum['value'])
+
+                    if value is None:
+                        continue
+
+                    datum['value'] = value
+
+                # Values that cannot be looked up, e.g. lists, are invalid
+                if is_hashable(datum['value']):
+                    values.add(datum['value'])
+                else:
+                    array_map[i] = 'invalid value'
             elif 'label' in datum:
                 array_map[i] = 'label'
-                labels.append(datum['label'])
+
+                if is_hashable(datum['label']):
+                    labels.add(datum['label'])
+                else:
+                    array_map[i] = 'invalid label'
             else:
                 data = {
                     'message': 'Error parsing value or lable'
@@ -156,31 +358,21 @@ class FieldValues(FieldBase, PaginatorResource):
                 return self.render(request, data,
                                    status=codes.unprocessable_entity)
 
-        value_field_name = instance.field_name
-        label_field_name = instance.label_field.name
-
         # Note, this return a context-aware or naive queryset depending
-        # on params. Get the value and label fields so they can be filled
-        # in below.
-        queryset = self.get_base_values(request, instance, params)\
-            .values_list(value_field_name, label_field_name)
-
-        lookup = Q()
+        # on params.
+        queryset = self.get_base_values(request, instance, params)
 
-        # Validate based on the label
-        if labels:
-            lookup |= Q(**{'{0}__in'.format(label_field_name): labels})
-
-        if values:
-            lookup |= Q(**{'{0}__in'.format(value_field_name): values})
-
-        results = queryset.filter(lookup)
-
-        value_labels = dict(results)
-        label_values = dict([(v, k) for k, v in value_labels.items()])
+        value_labels, label_values = self.get_value_label_maps(
+            queryset, instance, values, labels)
 
         for i, datum in enumerate(array):
-            if array_map[i] == 'label':
+            if array_map[i] == 'invalid value':
+                datum['valid'] = False
+                datum['label'] = smart_unicode(datum['value'])
+            elif array_map[i] == 'invalid label':
+                datum['valid'] = False
+                datum['value'] = datum['label']
+            elif array_map[i] == 'label':
                 valid = datum['label'] in label_values
                 if valid:
                     value = label_values[datum['label']]
@@ -203,5 +395,8 @@ class FieldValues(FieldBase, PaginatorResource):
             'count': len(array),
         })
 
+        if uploaded:
+            return array
+
         # Return the augmented data
         return request.data
@@ -1,8 +1,71 @@
+import json
+from django.core import signing
 from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
 from restlib2.params import Parametizer, IntParam
 from restlib2.resources import Resource
 
-__all__ = ('PaginatorResource', 'PaginatorParametizer')
+__all__ = ('PaginatorResource', 'PaginatorParametizer', 'CursorPage',
+           'InvalidCursor', 'encode_cursor', 'decode_cursor', 'seek_filter')
+
+CURSOR_SALT = 'serrano.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorSerializer(object):
+    "Cursor values may be dates or decimals so the Django encoder is used."
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'),
+                          cls=DjangoJSONEncoder).encode('latin-1')
+
+    def loads(self, data):
+        return json.loads(data.decode('latin-1'))
+
+
+def encode_cursor(data):
+    "Returns an opaque, signed token for the cursor `data`."
+    return signing.dumps(data, salt=CURSOR_SALT, serializer=CursorSerializer)
+
+
+def decode_cursor(token):
+    try:
+        return signing.loads(token, salt=CURSOR_SALT,
+                             serializer=CursorSerializer)
+    except (signing.BadSignature, ValueError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def seek_filter(keys, values):
+    """Returns a `Q` object matching the rows that come after `values` for
+    the ordering `keys`.
+
+    `keys` is a list of lookups as passed to `QuerySet.order_by` and
+    `values` are the values of the last seen row for those lookups. For
+    keys (a, b) this is equivalent to `a > x OR (a = x AND b > y)` with the
+    comparisons flipped for descending keys.
+    """
+    q = Q()
+    equal = {}
+
+    for key, value in zip(keys, values):
+        if key.startswith('-'):
+            lookup = key[1:]
+            operator = 'lt'
+        else:
+            lookup = key
+            operator = 'gt'
+
+        condition = {'{0}__{1}'.format(lookup, operator): value}
+        condition.update(equal)
+        q |= Q(**condition)
+
+        equal[lookup] = value
+
+    return q
 
 
 class PaginatorParametizer(Parametizer):
@@ -10,19 +73,43 @@ class PaginatorParametizer(Parametizer):
     limit = IntParam(20)
 
 
+class CursorPage(object):
+    """Page of results addressed by a cursor rather than a page number.
+
+    Cursor pages only support moving forward. `cursor` is the token of the
+    page itself which is empty for the first page.
+    """
+    def __init__(self, object_list, limit, cursor='', next_cursor=None):
+        self.object_list = object_list
+        self.limit = limit
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return False
+
+
 class PaginatorResource(Resource):
     parametizer = PaginatorParametizer
 
-    def get_paginator(self, queryset, limit):
+    def get_paginator(self, queryset, limit, count=None):
         paginator = Paginator(queryset, per_page=limit)
         paginator.has_limit = bool(limit)
 
-        # Perform count an update paginator to prevent redundant call
-        if not limit:
-            count = len(queryset)
-            paginator.per_page = count
+        # Use a count that is already known, e.g. cached
+        if count is not None:
             paginator._count = count
 
+        # All objects fit on a single page. The count is performed by the
+        # paginator which uses an aggregate query for querysets rather than
+        # loading every object. The page size must be at least one since it
+        # is used as a divisor.
+        if not limit:
+            paginator.per_page = max(paginator.count, 1)
+
         return paginator
 
     def get_page_links(self, request, path, page, extra=None):
@@ -30,7 +117,13 @@ class PaginatorResource(Resource):
         uri = request.build_absolute_uri
 
         # format string will be expanded below
-        if page.paginator.has_limit:
+        if isinstance(page, CursorPage):
+            limit = page.limit
+            params = {
+                'limit': '{limit}',
+                'cursor': '{cursor}',
+            }
+        elif page.paginator.has_limit:
             limit = page.paginator.per_page
             params = {
                 'limit': '{limit}',
@@ -56,6 +149,25 @@ class PaginatorResource(Resource):
         # Create path string
         path_format = '{0}?{1}'.format(path, '&'.join(pairs))
 
+        if isinstance(page, CursorPage):
+            links = {
+                'self': {
+                    'href': uri(path_format.format(cursor=page.cursor,
+                                                   limit=limit)),
+                },
+                'base': {
+                    'href': uri(path),
+                }
+            }
+
+            if page.has_next():
+                links['next'] = {
+                    'href': uri(path_format.format(cursor=page.next_cursor,
+                                                   limit=limit)),
+                }
+
+            return links
+
         links = {
             'self': {
                 'href': uri(path_format.format(page=page.number,
@@ -82,6 +194,12 @@ class PaginatorResource(Resource):
 
         return links
 
+    def get_cursor_response(self, request, page):
+        return {
+            'limit': page.limit,
+            'cursor': page.cursor,
+        }
+
     def get_page_response(self, request, paginator, page):
         return {
             'count': paginator.count,
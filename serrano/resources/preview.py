@@ -3,55 +3,126 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 from django.conf.urls import patterns, url
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from modeltree.tree import MODELTREE_DEFAULT_ALIAS, trees
+from avocado.models import DataContext, DataView
 from avocado.query import pipeline
 from avocado.export import HTMLExporter
-from restlib2.params import StrParam
+from restlib2.http import codes
+from restlib2.params import StrParam, BoolParam
+from serrano.cache import get_preview_version, make_key
+from serrano.conf import settings
+from serrano.counts import count_cache_key, get_count, get_data_version
+from serrano.jobs import get_queue
+from serrano.utils import get_request_owner
 from .base import BaseResource
-from .pagination import PaginatorResource, PaginatorParametizer
+from .pagination import PaginatorResource, PaginatorParametizer, \
+    CursorPage, InvalidCursor, encode_cursor, decode_cursor, seek_filter
 
+PREVIEW_CACHE_KEY = 'serrano:preview'
 
-class PreviewParametizer(PaginatorParametizer):
-    tree = StrParam(MODELTREE_DEFAULT_ALIAS, choices=trees)
+# Response header denoting whether the page was read from the cache.
+PREVIEW_CACHE_HEADER = 'X-Serrano-Cache'
+PREVIEW_CACHE_HIT = 'HIT'
+PREVIEW_CACHE_MISS = 'MISS'
 
+PREFETCH_CACHE_KEY = 'serrano:preview_prefetch:{0}'
 
-class PreviewResource(BaseResource, PaginatorResource):
-    """Resource for *previewing* data prior to exporting.
+# Number of seconds a prefetch slot is held if the job never releases it,
+# e.g. the process died while the job was running.
+PREFETCH_SLOT_TIMEOUT = 60 * 5
 
-    Data is formatted using a JSON+HTML exporter which prefers HTML formatted
-    or plain strings. Browser-based clients can consume the JSON and render
-    the HTML for previewing.
+
+def acquire_prefetch_slot(owner):
+    """Reserves one of the `PREVIEW_PREFETCH_LIMIT` concurrent prefetches
+    allowed per owner. Returns true if a slot was reserved.
     """
+    key = PREFETCH_CACHE_KEY.format(owner)
+    cache.add(key, 0, PREFETCH_SLOT_TIMEOUT)
 
-    parametizer = PreviewParametizer
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        return False
 
-    def get(self, request):
-        params = self.get_params(request)
+    if count > settings.PREVIEW_PREFETCH_LIMIT:
+        release_prefetch_slot(owner)
+        return False
 
-        page = params.get('page')
-        limit = params.get('limit')
-        tree = params.get('tree')
+    return True
 
-        # Get the request's view and context
-        view = self.get_view(request)
-        context = self.get_context(request)
 
-        # Initialize a query processor
+def release_prefetch_slot(owner):
+    try:
+        cache.decr(PREFETCH_CACHE_KEY.format(owner))
+    except ValueError:
+        pass
+
+
+def prefetch_preview_page(cache_key, owner, context_json, view_json, tree,
+                          offset, limit):
+    "Reads a preview page and stores it in the cache under `cache_key`."
+    try:
+        if cache.get(cache_key) is not None:
+            return
+
         QueryProcessor = pipeline.query_processors.default
+        context = DataContext(json=context_json)
+        view = DataView(json=view_json)
         processor = QueryProcessor(context=context, view=view, tree=tree)
 
-        # Build a queryset for pagination and other downstream use
-        queryset = processor.get_queryset(request=request)
+        data = preview_resource.get_page_data(None, processor, view, offset,
+                                              limit)
 
-        # Get paginator and page
-        paginator = self.get_paginator(queryset, limit=limit)
-        page = paginator.page(page)
-        offset = max(0, page.start_index() - 1)
+        cache.set(cache_key, data, settings.PREVIEW_CACHE_TIMEOUT)
+    finally:
+        release_prefetch_slot(owner)
 
-        # Prepare the exporter and iterable
-        iterable = processor.get_iterable()
 
+class PreviewParametizer(PaginatorParametizer):
+    tree = StrParam(MODELTREE_DEFAULT_ALIAS, choices=trees)
+    cursor = StrParam()
+    estimate = BoolParam()
+    prefetch = BoolParam()
+
+
+class RowTracker(object):
+    "Wraps an iterable and keeps a reference to the last row read."
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.row = None
+
+    def __iter__(self):
+        for row in self.iterable:
+            self.row = row
+            yield row
+
+
+class PreviewResource(BaseResource, PaginatorResource):
+    """Resource for *previewing* data prior to exporting.
+
+    Data is formatted using a JSON+HTML exporter which prefers HTML formatted
+    or plain strings. Browser-based clients can consume the JSON and render
+    the HTML for previewing.
+
+    Pages can be requested by number or by cursor. Cursor-based pagination
+    is enabled by supplying the `cursor` parameter (empty for the first
+    page). Each page is then fetched by seeking past the ordering key of the
+    last row of the previous page rather than using an offset, and the
+    total count is not computed.
+
+    Otherwise the total count is cached per context, view and tree or,
+    if `estimate` is true, may be estimated by the database. The
+    `count_type` in the response denotes whether the count is exact, cached
+    or estimated. The rows of numbered pages are cached as well and, if
+    `prefetch` is true, the following page is read and cached in the
+    background so paging forward is served from the cache.
+    """
+
+    parametizer = PreviewParametizer
+
+    def get_header(self, view):
         # Build up the header keys.
         # TODO: This is flawed since it assumes the output columns
         # of exporter will be one-to-one with the concepts. This should
@@ -67,18 +138,136 @@ class PreviewResource(BaseResource, PaginatorResource):
                 obj['direction'] = ordering[concept.id]
             header.append(obj)
 
-        # Prepare an HTMLExporter
-        exporter = processor.get_exporter(HTMLExporter)
+        return header
+
+    def get_seek_keys(self, queryset, view, tree):
+        """Adds the columns the queryset is ordered by to the end of the
+        select and returns the queryset and the ordering keys.
+
+        The primary key is always added as the last key so the ordering is
+        unique. Since the exporter only reads the columns it formats, the
+        extra columns are ignored in the output.
+        """
+        tree = trees[tree]
+        view_node = view.parse()
         pk_name = queryset.model._meta.pk.name
 
-        objects = []
+        keys = []
+        columns = []
+
+        if view_node.ordering:
+            groups = view_node.get_fields_for_order_by()
+
+            for pk, direction in view_node.ordering:
+                for f in groups[pk]:
+                    lookup = tree.query_string_for_field(f.order_field,
+                                                         model=f.model)
+
+                    if direction.lower() == 'desc':
+                        lookup = '-' + lookup
+
+                    queryset, alias = tree.add_joins(f.model, queryset)
+                    keys.append(lookup)
+                    columns.append((alias, f.order_field.column))
+
+        queryset, alias = tree.add_joins(tree.root_model, queryset)
+        keys.append(pk_name)
+        columns.append((alias, queryset.model._meta.pk.column))
+
+        queryset.query.select = list(queryset.query.select) + columns
+        queryset = queryset.order_by(*keys)
+
+        return queryset, keys
+
+    def get_count(self, request, queryset, view, context, tree, estimate):
+        """Returns the count of the queryset and the kind of count.
+
+        The queryset of the query processor may depend on the request, so
+        the count is cached per user or session and not cached for requests
+        with neither.
+        """
+        owner = get_request_owner(request)
+        key = None
+
+        if owner is not None:
+            key = count_cache_key(owner, context.json, view.json, tree)
+
+        return get_count(queryset, key=key, estimate=estimate)
+
+    def get_page_cache_key(self, request, view, context, tree, page, limit):
+        """Returns the key the page is cached under or None if the page
+        should not be cached.
+
+        Unlimited pages are not cached since they may be arbitrarily large,
+        nor are pages of requests without a user or session. The key
+        includes the requesting user or session and the version of their
+        cached pages which is incremented when their context or view is
+        saved.
+        """
+        if not settings.PREVIEW_CACHE_ENABLED or not limit:
+            return
+
+        owner = get_request_owner(request)
+
+        if owner is None:
+            return
+
+        return make_key(PREVIEW_CACHE_KEY, owner, get_preview_version(owner),
+                        get_data_version(), context.json, view.json, tree,
+                        page, limit)
+
+    def get_page_data(self, request, processor, view, offset, limit):
+        "Returns the keys and formatted rows of a page."
+        exporter = processor.get_exporter(HTMLExporter)
+        iterable = processor.get_iterable()
+        pk_name = trees[processor.tree].root_model._meta.pk.name
+
+        # 0 limit means all for pagination, however the read method
+        # requires an explicit limit or None
+        objects, rows = self.read_objects(exporter, iterable, pk_name,
+                                          request, offset=offset,
+                                          limit=limit or None)
+
+        return {
+            'keys': self.get_header(view),
+            'objects': objects,
+        }
+
+    def prefetch_page(self, request, view, context, tree, page, limit):
+        """Adds a job to the queue that reads and caches the page following
+        `page` unless it is cached or the requesting user or session has
+        reached the limit of concurrent prefetches.
+        """
+        owner = get_request_owner(request)
+
+        # Prefetches are bounded per user or session
+        if owner is None:
+            return
+
+        number = page.next_page_number()
+        cache_key = self.get_page_cache_key(request, view, context, tree,
+                                            number, limit)
+
+        if not cache_key or cache.get(cache_key) is not None:
+            return
+
+        if not acquire_prefetch_slot(owner):
+            return
 
-        # 0 limit means all for pagination, however the read method requires
-        # an explicit limit or None
-        read_limit = limit or None
+        offset = (number - 1) * limit
 
-        for row in exporter.read(iterable, request=request, offset=offset,
-                                 limit=read_limit):
+        get_queue().enqueue(prefetch_preview_page, cache_key, owner,
+                            context.json, view.json, tree, offset, limit)
+
+    def read_objects(self, exporter, iterable, pk_name, request, offset=None,
+                     limit=None):
+        "Returns the formatted rows and the raw rows they were read from."
+        objects = []
+        rows = []
+        tracker = RowTracker(iterable)
+
+        for row in exporter.read(tracker, request=request, offset=offset,
+                                 limit=limit):
             pk = None
             values = []
 
@@ -89,27 +278,165 @@ class PreviewResource(BaseResource, PaginatorResource):
                     values.extend(output.values())
 
             objects.append({'pk': pk, 'values': values})
+            rows.append(tracker.row)
+
+        return objects, rows
+
+    def get_cursor_page(self, request, queryset, exporter, view, tree,
+                        cursor, limit):
+        "Returns a `CursorPage` for the page following `cursor`."
+        queryset, keys = self.get_seek_keys(queryset, view, tree)
+        pk_name = queryset.model._meta.pk.name
+
+        # Absolute position of the page in the results
+        offset = 0
+
+        if cursor:
+            data = decode_cursor(cursor)
+            offset = data['offset']
+
+            # The key values are not available if any of them were null
+            # since their ordering depends on the database. Fallback to
+            # using the offset.
+            if data['values'] is None:
+                queryset = queryset[offset:]
+            else:
+                queryset = queryset._clone()
+                queryset.query.add_q(seek_filter(keys, data['values']))
+
+        # Read one more than the limit to determine if there is a next page
+        read_limit = limit + 1 if limit else None
+
+        objects, rows = self.read_objects(
+            exporter, queryset.query.get_compiler(queryset.db).results_iter(),
+            pk_name, request, limit=read_limit)
+
+        next_cursor = None
+
+        if limit and len(objects) > limit:
+            objects = objects[:limit]
+            values = list(rows[limit - 1][-len(keys):])
+
+            if any([v is None for v in values]):
+                values = None
+
+            next_cursor = encode_cursor({
+                'values': values,
+                'offset': offset + limit,
+            })
+
+        return CursorPage(objects, limit, cursor=cursor,
+                          next_cursor=next_cursor)
+
+    def get(self, request):
+        params = self.get_params(request)
+
+        page = params.get('page')
+        limit = params.get('limit')
+        tree = params.get('tree')
+        cursor = params.get('cursor')
+
+        # Get the request's view and context
+        view = self.get_view(request)
+        context = self.get_context(request)
+
+        # Initialize a query processor
+        QueryProcessor = pipeline.query_processors.default
+        processor = QueryProcessor(context=context, view=view, tree=tree)
+
+        # Build a queryset for pagination and other downstream use
+        queryset = processor.get_queryset(request=request)
 
         # Various model options
         opts = queryset.model._meta
         model_name = opts.verbose_name.format()
         model_name_plural = opts.verbose_name_plural.format()
 
+        path = reverse('serrano:data:preview')
+
+        if cursor is not None:
+            # Prepare an HTMLExporter
+            exporter = processor.get_exporter(HTMLExporter)
+
+            try:
+                page = self.get_cursor_page(request, queryset, exporter, view,
+                                            tree, cursor, limit)
+            except InvalidCursor:
+                data = {
+                    'message': 'Invalid cursor',
+                }
+                return self.render(request, data, status=codes.bad_request)
+
+            resp = self.get_cursor_response(request, page)
+
+            resp.update({
+                'keys': self.get_header(view),
+                'objects': page.object_list,
+                'object_name': model_name,
+                'object_name_plural': model_name_plural,
+                '_links': self.get_page_links(request, path, page,
+                                              extra=params),
+            })
+
+            return resp
+
+        estimate = params.get('estimate')
+
+        if estimate is None:
+            estimate = settings.PREVIEW_COUNT_ESTIMATE
+
+        count, count_type = self.get_count(request, queryset, view, context,
+                                           tree, estimate)
+
+        # Get paginator and page
+        paginator = self.get_paginator(queryset, limit=limit, count=count)
+        page = paginator.page(page)
+        offset = max(0, page.start_index() - 1)
+
+        cache_key = self.get_page_cache_key(request, view, context, tree,
+                                            page.number, limit)
+
+        data = cache.get(cache_key) if cache_key else None
+
+        if data is None:
+            data = self.get_page_data(request, processor, view, offset,
+                                      limit)
+
+            if cache_key:
+                cache.set(cache_key, data, settings.PREVIEW_CACHE_TIMEOUT)
+
+            cache_status = PREVIEW_CACHE_MISS
+        else:
+            cache_status = PREVIEW_CACHE_HIT
+
+        prefetch = params.get('prefetch')
+
+        if prefetch is None:
+            prefetch = settings.PREVIEW_PREFETCH
+
+        if prefetch and page.has_next():
+            self.prefetch_page(request, view, context, tree, page, limit)
+
         resp = self.get_page_response(request, paginator, page)
 
-        path = reverse('serrano:data:preview')
         links = self.get_page_links(request, path, page, extra=params)
 
         resp.update({
-            'keys': header,
-            'objects': objects,
+            'keys': data['keys'],
+            'objects': data['objects'],
             'object_name': model_name,
             'object_name_plural': model_name_plural,
             'object_count': paginator.count,
+            'count_type': count_type,
             '_links': links,
         })
 
-        return resp
+        response = self.render(request, resp)
+
+        if cache_key:
+            response[PREVIEW_CACHE_HEADER] = cache_status
+
+        return response
 
     # POST mimics GET to support sending large request bodies for on-the-fly
     # context and view data.
@@ -2,15 +2,18 @@ import functools
 import logging
 from datetime import datetime
 from django.conf.urls import patterns, url
-from django.core.urlresolvers import reverse
 from django.db.models import Q
 from django.views.decorators.cache import never_cache
 from restlib2.http import codes
-from preserialize.serialize import serialize
+from restlib2.params import Parametizer, BoolParam
 from avocado.models import DataQuery
 from avocado.events import usage
 from serrano import utils
+from serrano.counts import get_pending_counts, get_stored_count, \
+    context_count_key, query_count_key, COUNT_STORED
 from serrano.forms import QueryForm
+from serrano.links import link
+from .serializers import serialize
 from .base import ThrottledResource
 from .history import RevisionsResource, ObjectRevisionsResource, \
     ObjectRevisionResource
@@ -24,17 +27,16 @@ DELETE_QUERY_EMAIL_BODY = """The query named '{0}' has been deleted. You are
  longer available."""
 
 
-def query_posthook(instance, data, request):
-    uri = request.build_absolute_uri
+def query_posthook(instance, data, request, pending=None):
     data['_links'] = {
         'self': {
-            'href': uri(reverse('serrano:queries:single', args=[instance.pk])),
+            'href': link(request, 'serrano:queries:single', instance.pk),
         },
         'forks': {
-            'href': uri(reverse('serrano:queries:forks', args=[instance.pk])),
+            'href': link(request, 'serrano:queries:forks', instance.pk),
         },
         'stats': {
-            'href': uri(reverse('serrano:queries:stats', args=[instance.pk])),
+            'href': link(request, 'serrano:queries:stats', instance.pk),
         }
     }
 
@@ -46,18 +48,24 @@ def query_posthook(instance, data, request):
     if not data['is_owner']:
         del data['shared_users']
 
+    # Deferred counts are computed by a background job. The pending counts
+    # of a list of queries are read up front.
+    if pending is None:
+        pending = get_pending_counts(instance)
+
+    data['count_pending'] = instance.pk in pending
+
     return data
 
 
 def forked_query_posthook(instance, data, request):
-    uri = request.build_absolute_uri
     data['_links'] = {
         'self': {
-            'href': uri(reverse('serrano:queries:single', args=[instance.pk])),
+            'href': link(request, 'serrano:queries:single', instance.pk),
         },
         'parent': {
-            'href': uri(reverse('serrano:queries:single',
-                        args=[instance.parent.pk])),
+            'href': link(request, 'serrano:queries:single',
+                         instance.parent.pk),
         }
     }
 
@@ -74,7 +82,8 @@ class QueryBase(ThrottledResource):
     def prepare(self, request, instance, template=None):
         if template is None:
             template = self.template
-        posthook = functools.partial(query_posthook, request=request)
+        posthook = functools.partial(query_posthook, request=request,
+                                     pending=get_pending_counts(instance))
         return serialize(instance, posthook=posthook, **template)
 
     def get_queryset(self, request, **kwargs):
@@ -119,7 +128,8 @@ class QueriesResource(QueryBase):
     def prepare(self, request, instance, template=None):
         if template is None:
             template = self.template
-        posthook = functools.partial(query_posthook, request=request)
+        posthook = functools.partial(query_posthook, request=request,
+                                     pending=get_pending_counts(instance))
         return serialize(instance, posthook=posthook, **template)
 
     def get_queryset(self, request, **kwargs):
@@ -261,7 +271,8 @@ class PublicQueriesResource(QueryBase):
         if template is None:
             template = self.template
 
-        posthook = functools.partial(query_posthook, request=request)
+        posthook = functools.partial(query_posthook, request=request,
+                                     pending=get_pending_counts(instance))
         return serialize(instance, posthook=posthook, **template)
 
     def get_queryset(self, request, **kwargs):
@@ -324,16 +335,52 @@ class QueryResource(QueryBase):
         usage.log('delete', instance=instance, request=request)
 
 
+class QueryStatsParametizer(Parametizer):
+    refresh = BoolParam(False)
+
+
 class QueryStatsResource(QueryBase):
+    """Resource for the distinct and record counts of a query.
+
+    The distinct count is the count of the objects matching the query's
+    context alone. The record count stored on the query is served unless
+    the shared count cache has a count for the current data. `stale` in the
+    response denotes the record count may predate a refresh of the data.
+    The `refresh` parameter forces the counts to be recomputed and stored.
+    """
+    parametizer = QueryStatsParametizer
+
     def is_not_found(self, request, response, **kwargs):
         return self.get_object(request, **kwargs) is None
 
     def get(self, request, **kwargs):
         instance = self.get_object(request, **kwargs)
+        params = self.get_params(request)
+        refresh = params['refresh']
+
+        # The stored distinct count is relative to the view as well, so it
+        # is not used.
+        context = instance.context
+
+        distinct_count, distinct_count_type = get_stored_count(
+            None, context_count_key(context), context.apply().distinct(),
+            refresh=refresh)
+
+        record_count, record_count_type = get_stored_count(
+            instance.record_count, query_count_key(instance, distinct=False),
+            instance.apply(), refresh=refresh)
+
+        # Store the recomputed record count on the query
+        if refresh and record_count != instance.record_count:
+            self.model.objects.filter(pk=instance.pk).update(
+                record_count=record_count)
 
         return {
-            'distinct_count': instance.context.apply().distinct().count(),
-            'record_count': instance.apply().count()
+            'distinct_count': distinct_count,
+            'distinct_count_type': distinct_count_type,
+            'record_count': record_count,
+            'record_count_type': record_count_type,
+            'stale': record_count_type == COUNT_STORED,
         }
 
 
@@ -0,0 +1,190 @@
+"""Compiled serializers for the templates in `serrano.resources.templates`.
+
+`preserialize.serialize` interprets the template for every instance it
+serializes, i.e. merging the default options, resolving aliases and
+checking each value. The `serialize` function below is a drop-in
+replacement that compiles a template once per model into a list of
+accessors and reuses it for every instance of that model.
+"""
+import collections
+from operator import attrgetter
+from threading import Lock
+from django.db import models
+from django.db.models.query import QuerySet
+from preserialize.serialize import serialize as _serialize, _defaults
+from preserialize.utils import get_field_value, parse_selectors, \
+    convert_to_camel
+
+__all__ = ('serialize', 'compile_template')
+
+# Options that are only supported by preserialize itself. Templates that use
+# them are not compiled.
+UNSUPPORTED_OPTIONS = ('prehook', 'values_list', 'select_related')
+
+_compiled = {}
+_compiled_lock = Lock()
+
+
+def _freeze(value):
+    "Returns a hashable representation of a template option."
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+
+    return value
+
+
+def _is_concrete_field(model, name):
+    """Returns true if `name` is a local, non-relational field on `model` or
+    the raw id of a foreign key, e.g. `category_id`.
+    """
+    for field in model._meta.fields:
+        if name == field.attname:
+            return True
+        if name == field.name:
+            return field.rel is None
+    return False
+
+
+def _get_field_value(obj, name, allow_missing=False):
+    """Equivalent to `preserialize.utils.get_field_value` except the
+    attribute is only read once. This matters for computed properties since
+    `hasattr` evaluates them as well.
+    """
+    try:
+        value = getattr(obj, name)
+    except Exception:
+        # `hasattr` hides any exception raised by the attribute
+        return get_field_value(obj, name, allow_missing=allow_missing)
+
+    if isinstance(value, collections.Callable):
+        value = value()
+    elif value.__class__.__name__ in ('RelatedManager', 'ManyRelatedManager',
+                                      'GenericRelatedObjectManager'):
+        value = value.all()
+
+    return value
+
+
+class CompiledTemplate(object):
+    """Serializes instances of `model` equivalent to `preserialize.serialize`
+    with the template `options`.
+    """
+    def __init__(self, model, fields=None, exclude=None, **options):
+        self.model = model
+        self.options = _defaults(options)
+
+        names = parse_selectors(model, fields, exclude, **options)
+
+        aliases = self.options['aliases']
+        allow_missing = self.options['allow_missing']
+
+        self.accessors = []
+
+        for alias in names:
+            accessor = aliases.get(alias, alias)
+
+            key = self.options['prefix'] + alias
+
+            if self.options['camelcase']:
+                key = convert_to_camel(key)
+
+            # Values of concrete fields are read directly since they are
+            # neither callable nor related objects.
+            if _is_concrete_field(model, accessor):
+                self.accessors.append((key, attrgetter(accessor), None))
+            else:
+                self.accessors.append((key, None, (alias, accessor,
+                                                   allow_missing)))
+
+    def _get_value(self, instance, attrs, key, alias, accessor,
+                   allow_missing):
+        # Mirrors `preserialize.serialize.model_to_dict`
+        value = _get_field_value(instance, accessor,
+                                 allow_missing=allow_missing)
+
+        if isinstance(value, (models.Model, QuerySet)):
+            _options = _defaults(self.options['related'].get(accessor, {}))
+
+            if '%(accessor)s' in _options['prefix']:
+                _options['prefix'] = _options['prefix'] % {'accessor': alias}
+
+            if isinstance(value, models.Model):
+                if len(_options['fields']) == 1 and _options['flat'] \
+                        and not _options['merge']:
+                    value = list(serialize(value, **_options).values())[0]
+                else:
+                    _attrs = serialize(value, **_options)
+
+                    if _options['merge']:
+                        attrs.update(_attrs)
+                        return
+
+                    value = _attrs
+            else:
+                value = serialize(value, **_options)
+
+        attrs[key] = value
+
+    def __call__(self, instance, posthook=None):
+        posthook = posthook or self.options['posthook']
+        attrs = {}
+
+        for key, getter, args in self.accessors:
+            if getter is not None:
+                attrs[key] = getter(instance)
+            else:
+                self._get_value(instance, attrs, key, *args)
+
+        if posthook:
+            attrs = posthook(instance, attrs)
+
+        return attrs
+
+
+def compile_template(model, **template):
+    "Returns the compiled serializer of `template` for `model`."
+    key = (model, _freeze(template))
+
+    if key not in _compiled:
+        with _compiled_lock:
+            if key not in _compiled:
+                _compiled[key] = CompiledTemplate(model, **template)
+
+    return _compiled[key]
+
+
+def serialize(obj, posthook=None, **template):
+    """Serializes model instances and querysets using the compiled form of
+    `template`. Any other object is serialized by `preserialize.serialize`.
+    """
+    for option in UNSUPPORTED_OPTIONS:
+        if template.get(option):
+            return _serialize(obj, posthook=posthook, **template)
+
+    if isinstance(obj, models.Model):
+        return compile_template(obj.__class__, **template)(obj, posthook)
+
+    if isinstance(obj, QuerySet):
+        serializer = compile_template(obj.model, **template)
+        return [serializer(x, posthook) for x in obj]
+
+    if isinstance(obj, (list, tuple)):
+        serializers = {}
+        data = []
+
+        # Compile once per model rather than per item
+        for x in obj:
+            if isinstance(x, models.Model):
+                if x.__class__ not in serializers:
+                    serializers[x.__class__] = compile_template(x.__class__,
+                                                                **template)
+                data.append(serializers[x.__class__](x, posthook))
+            else:
+                data.append(serialize(x, posthook=posthook, **template))
+
+        return data
+
+    return _serialize(obj, posthook=posthook, **template)
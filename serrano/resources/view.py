@@ -2,13 +2,13 @@ import functools
 import logging
 from datetime import datetime
 from django.conf.urls import patterns, url
-from django.core.urlresolvers import reverse
 from django.views.decorators.cache import never_cache
 from restlib2.http import codes
-from preserialize.serialize import serialize
 from avocado.models import DataView
 from avocado.events import usage
 from serrano.forms import ViewForm
+from serrano.links import link
+from .serializers import serialize
 from .base import ThrottledResource
 from .history import RevisionsResource, ObjectRevisionsResource, \
     ObjectRevisionResource
@@ -18,10 +18,9 @@ log = logging.getLogger(__name__)
 
 
 def view_posthook(instance, data, request):
-    uri = request.build_absolute_uri
     data['_links'] = {
         'self': {
-            'href': uri(reverse('serrano:views:single', args=[instance.pk])),
+            'href': link(request, 'serrano:views:single', instance.pk),
         }
     }
     return data
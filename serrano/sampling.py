@@ -0,0 +1,134 @@
+import random
+from django.core.cache import cache
+from django.db.models import Min, Max
+from serrano.cache import make_key
+from serrano.conf import settings
+from serrano.counts import get_data_version
+
+SAMPLE_CACHE_KEY = 'serrano:sample'
+
+# Number of rounds of random primary keys that are looked up before
+# falling back to reading a contiguous range of rows.
+SAMPLE_ROUNDS = 3
+
+# Maximum number of primary keys looked up in one query. This stays below
+# the parameter limits of the databases.
+SAMPLE_BATCH_SIZE = 500
+
+INTEGER_TYPES = ('AutoField', 'BigIntegerField', 'IntegerField',
+                 'PositiveIntegerField', 'PositiveSmallIntegerField',
+                 'SmallIntegerField')
+
+
+def sample_values(instance, size):
+    """Returns a list of up to `size` distinct, random value/label pairs of
+    the field `instance`. Null values are excluded.
+
+    Rows are sampled by looking up random primary keys within the range of
+    primary keys which only reads the sampled rows, unlike ordering the
+    table randomly. Primary keys that do not exist are skipped. If not
+    enough values are found, rows are read in order of the primary key from
+    a random position. Models with non-integer primary keys are ordered
+    randomly by the database.
+    """
+    model = instance.model
+    pk = model._meta.pk
+
+    queryset = model.objects.filter(**{
+        '{0}__isnull'.format(instance.field_name): False,
+    }).values_list('pk', instance.field_name, instance.label_field.name)
+
+    if pk.get_internal_type() not in INTEGER_TYPES:
+        pairs = queryset.order_by('?')[:size]
+        return _distinct([(v, l) for _, v, l in pairs], size)
+
+    bounds = model.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    low, high = bounds['low'], bounds['high']
+
+    if low is None:
+        return []
+
+    pairs = []
+    seen = set()
+    span = high - low + 1
+
+    for i in range(SAMPLE_ROUNDS):
+        need = size - len(_distinct(pairs, size))
+
+        if need <= 0:
+            break
+
+        # Sparse primary keys and duplicate values are compensated for by
+        # looking up more keys than needed.
+        candidates = set()
+        batch = min(need * 4, SAMPLE_BATCH_SIZE, span)
+
+        while len(candidates) < batch and len(seen) < span:
+            pk_value = random.randint(low, high)
+
+            if pk_value not in seen:
+                seen.add(pk_value)
+                candidates.add(pk_value)
+
+        if not candidates:
+            break
+
+        rows = list(queryset.filter(pk__in=candidates))
+        random.shuffle(rows)
+        pairs.extend((v, l) for _, v, l in rows)
+
+    values = _distinct(pairs, size)
+
+    if len(values) < size:
+        start = random.randint(low, high)
+        limit = (size - len(values)) * 4
+
+        rows = list(queryset.filter(pk__gte=start).order_by('pk')[:limit])
+
+        if len(rows) < limit:
+            rows.extend(queryset.filter(pk__lt=start)
+                        .order_by('pk')[:limit - len(rows)])
+
+        random.shuffle(rows)
+        values = _distinct(pairs + [(v, l) for _, v, l in rows], size)
+
+    return values
+
+
+def _distinct(pairs, size):
+    values = []
+    seen = set()
+
+    for pair in pairs:
+        if pair[0] not in seen:
+            seen.add(pair[0])
+            values.append(pair)
+
+            if len(values) == size:
+                break
+
+    return values
+
+
+def get_random_values(instance, size):
+    """Returns a list of up to `size` distinct, random value/label pairs of
+    the field `instance`.
+
+    Values are drawn from a sample of the field's values that is cached
+    until the data version is incremented, so repeated requests do not
+    read the table. Sizes larger than the RANDOM_VALUES_SAMPLE_SIZE setting
+    are sampled from the table each time.
+    """
+    sample_size = settings.RANDOM_VALUES_SAMPLE_SIZE
+
+    if not settings.RANDOM_VALUES_CACHE_ENABLED or size > sample_size:
+        return sample_values(instance, size)
+
+    key = make_key(SAMPLE_CACHE_KEY, instance.pk, get_data_version())
+    sample = cache.get(key)
+
+    if sample is None:
+        sample = sample_values(instance, sample_size)
+        cache.set(key, sample, settings.RANDOM_VALUES_CACHE_TIMEOUT)
+
+    return random.sample(sample, min(size, len(sample)))
@@ -0,0 +1,89 @@
+from datetime import datetime
+from django.core.cache import cache
+from avocado.stats.agg import Aggregator
+from serrano.cache import make_key
+from serrano.counts import get_data_version, get_field_data_version
+from serrano.conf import settings
+
+STATS_CACHE_KEY = 'serrano:stats'
+
+
+def stats_capable(instance):
+    "Returns true if stats are supported for the field `instance`."
+    return not instance.searchable
+
+
+def compute_stats(instance, queryset=None):
+    """Returns a dict of the aggregate stats of the field `instance`,
+    optionally relative to `queryset` of the field's model.
+
+    All types have the count of non-null values. Numbers also have the min,
+    max and average, dates and times the min and max and all other types
+    the distinct count. The aggregates are computed in a single query.
+    """
+    stats = Aggregator(instance.field, queryset=queryset).count()
+
+    if instance.simple_type == 'number':
+        stats = stats.max().min().avg()
+    elif instance.simple_type in ('date', 'time', 'datetime'):
+        stats = stats.max().min()
+    else:
+        stats = stats.count(distinct=True)
+
+    try:
+        return dict(next(iter(stats)))
+    except StopIteration:
+        return {}
+
+
+def stats_cache_key(instance, context=None):
+    """Returns the cache key for the stats of the field `instance` relative
+    to the `context` JSON.
+
+    The field's data version is included so the stats are recomputed once
+    the data is refreshed. Since a context may filter on any field, the
+    data version of all fields is included for context-relative stats.
+    """
+    data_version = get_field_data_version(instance)
+
+    if context:
+        return make_key(STATS_CACHE_KEY, instance.pk, data_version,
+                        context, get_data_version())
+
+    return make_key(STATS_CACHE_KEY, instance.pk, data_version)
+
+
+def get_stats(instance, context=None, refresh=False):
+    """Returns a dict of the stats of the field `instance` and the time they
+    were computed under the `computed` key.
+
+    If `context` is a DataContext with filters, the stats are relative to
+    the data matching the context. The stats are read from the cache unless
+    `refresh` is true. Computed stats are stored in the cache.
+    """
+    if context is not None and not context.json:
+        context = None
+
+    key = None
+
+    if settings.FIELD_STATS_CACHE_ENABLED:
+        key = stats_cache_key(instance, context and context.json)
+
+        if not refresh:
+            data = cache.get(key)
+
+            if data is not None:
+                return data
+
+    if context is None:
+        queryset = None
+    else:
+        queryset = context.apply(queryset=instance.model.objects.all())
+
+    data = compute_stats(instance, queryset)
+    data['computed'] = datetime.now()
+
+    if key:
+        cache.set(key, data, settings.FIELD_STATS_CACHE_TIMEOUT)
+
+    return data
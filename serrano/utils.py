@@ -7,6 +7,16 @@ def _send_mail(subject, message, sender, recipient_list, fail_silently):
     mail.send_mail(subject, message, sender, recipient_list, fail_silently)
 
 
+def get_request_owner(request):
+    """Returns an identifier for the user or session making the request or
+    None if the request has neither.
+    """
+    if getattr(request, 'user', None) and request.user.is_authenticated():
+        return 'user:{0}'.format(request.user.pk)
+    if request.session.session_key:
+        return 'session:{0}'.format(request.session.session_key)
+
+
 def send_mail(emails, subject, message, async=True, fail_silently=True):
     """Send email built from 'email_title' and 'email_body' to all 'emails'
 
@@ -0,0 +1,212 @@
+import sys
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import smart_unicode
+from avocado.core import utils
+from avocado.models import DataField
+from serrano.conf import settings
+
+
+def _sizeof(obj):
+    if isinstance(obj, tuple):
+        return sys.getsizeof(obj) + sum(_sizeof(o) for o in obj)
+    return sys.getsizeof(obj)
+
+
+class ValueIndex(object):
+    """Sorted index of the distinct value/label pairs of a field.
+
+    `entries` is the list of value/label pairs in the order of the field.
+    The search terms of the entries are lowercased and sorted so values
+    starting with a query are found by binary search. Values containing a
+    query are found by scanning the terms in memory.
+    """
+    def __init__(self, rows):
+        entries = []
+        positions = {}
+        terms = []
+
+        for value, label, term in rows:
+            key = (value, label)
+
+            if key not in positions:
+                positions[key] = len(entries)
+                entries.append(key)
+
+            if term is not None:
+                terms.append((smart_unicode(term).lower(), positions[key]))
+
+        terms.sort()
+
+        self.entries = entries
+        self.terms = terms
+        self.keys = [t for t, i in terms]
+        self.size = _sizeof(entries) + sum(_sizeof(t) for t in terms) + \
+            sys.getsizeof(self.keys)
+
+    def _matches(self, positions):
+        # Entries matched by several terms are returned once in the order
+        # of the field.
+        return [self.entries[i] for i in sorted(set(positions))]
+
+    def prefix(self, query):
+        "Returns the entries with a search term starting with `query`."
+        query = smart_unicode(query).lower()
+        terms = self.terms
+        positions = []
+
+        for i in xrange(bisect_left(self.keys, query), len(terms)):
+            term, position = terms[i]
+
+            if not term.startswith(query):
+                break
+
+            positions.append(position)
+
+        return self._matches(positions)
+
+    def contains(self, query):
+        "Returns the entries with a search term containing `query`."
+        query = smart_unicode(query).lower()
+        return self._matches([i for t, i in self.terms if query in t])
+
+    def search(self, query, prefix=False):
+        if prefix:
+            return self.prefix(query)
+        return self.contains(query)
+
+
+class ValueIndexCache(object):
+    """In-process cache of the value indexes of fields.
+
+    An index is built on first use with a single query and kept until the
+    data version of the field is incremented or the field is changed. The
+    least recently used indexes are evicted once the estimated memory used
+    by all indexes exceeds the VALUE_INDEX_MEMORY_LIMIT setting. Fields with
+    more than VALUE_INDEX_MAX_SIZE distinct values are not indexed.
+    """
+    def __init__(self):
+        self._indexes = OrderedDict()
+        self._skipped = {}
+        self._size = 0
+        self._lock = Lock()
+
+    def indexable(self, instance):
+        "Returns true if the values of the field `instance` can be indexed."
+        return utils.get_simple_type(instance.search_field) == 'string' \
+            and not instance._has_predefined_choices()
+
+    def _signature(self, instance):
+        data_version = DataField.objects.filter(pk=instance.pk)\
+            .values_list('data_version', flat=True)
+
+        # The data version is read from the database since it is commonly
+        # incremented with an update which does not send signals.
+        return (tuple(data_version), instance.model_name, instance.app_name,
+                instance.field_name, instance.label_field.name,
+                instance.search_field.name, instance.order_field.name)
+
+    def _build(self, instance):
+        limit = settings.VALUE_INDEX_MAX_SIZE
+
+        rows = instance.model.objects.values_list(
+            instance.field_name, instance.label_field.name,
+            instance.search_field.name,
+        ).order_by(instance.order_field.name).distinct()
+
+        # One more than the limit is read to determine if the field is
+        # too large to index.
+        rows = list(rows[:limit + 1])
+
+        if len(rows) > limit:
+            return None
+
+        return ValueIndex(rows)
+
+    def _evict(self):
+        limit = settings.VALUE_INDEX_MEMORY_LIMIT
+
+        while self._size > limit and self._indexes:
+            _, (_, index) = self._indexes.popitem(last=False)
+            self._size -= index.size
+
+    def _remove(self, pk):
+        item = self._indexes.pop(pk, None)
+
+        if item is not None:
+            self._size -= item[1].size
+
+    def get(self, instance):
+        """Returns the value index of the field `instance` or None if the
+        field cannot be indexed.
+        """
+        if not settings.VALUE_INDEX_ENABLED or not self.indexable(instance):
+            return None
+
+        pk = instance.pk
+        signature = self._signature(instance)
+
+        with self._lock:
+            if self._skipped.get(pk) == signature:
+                return None
+
+            item = self._indexes.pop(pk, None)
+
+            if item is not None:
+                if item[0] == signature:
+                    # Reinserted as the most recently used
+                    self._indexes[pk] = item
+                    return item[1]
+
+                self._size -= item[1].size
+
+        # The index may be built more than once by concurrent requests, but
+        # the results are the same.
+        index = self._build(instance)
+
+        with self._lock:
+            self._remove(pk)
+
+            if index is None or \
+                    index.size > settings.VALUE_INDEX_MEMORY_LIMIT:
+                self._skipped[pk] = signature
+            else:
+                self._skipped.pop(pk, None)
+                self._indexes[pk] = (signature, index)
+                self._size += index.size
+                self._evict()
+
+        return index
+
+    @property
+    def size(self):
+        "Returns the estimated number of bytes used by the indexes."
+        return self._size
+
+    def discard(self, pk):
+        "Removes the index of the field with `pk` in this process."
+        with self._lock:
+            self._remove(pk)
+            self._skipped.pop(pk, None)
+
+    def reset(self):
+        "Clears all indexes in this process."
+        with self._lock:
+            self._indexes.clear()
+            self._skipped.clear()
+            self._size = 0
+
+
+value_indexes = ValueIndexCache()
+
+
+def _discard_value_index(sender, instance, **kwargs):
+    value_indexes.discard(instance.pk)
+
+
+post_save.connect(_discard_value_index, sender=DataField,
+                  dispatch_uid='serrano-value-index-save')
+post_delete.connect(_discard_value_index, sender=DataField,
+                    dispatch_uid='serrano-value-index-delete')
@@ -31,7 +31,9 @@ kwargs = {
     'test_suite': 'test_suite',
 
     # Optional dependencies
-    'extras_require': {},
+    'extras_require': {
+        'numpy': ['numpy'],
+    },
 
     # Metadata
     'name': 'serrano',
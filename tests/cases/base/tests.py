@@ -1,9 +1,13 @@
+import os
 import time
 from django.test import TestCase
+from django.test.client import RequestFactory
 from django.test.utils import override_settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.utils.unittest import skipUnless
+from serrano.links import link, get_link_template
 from serrano.tokens import token_generator, generate_random_token
 
 
@@ -110,3 +114,53 @@ class TokenBackendTestCase(TestCase):
         resp = self.client.get(reverse('serrano:root'),
                                HTTP_ACCEPT='application/json')
         self.assertEqual(resp.status_code, 401)
+
+
+class LinkTestCase(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+
+    def test_link(self):
+        uri = self.request.build_absolute_uri
+
+        self.assertEqual(link(self.request, 'serrano:field', 10),
+                         uri(reverse('serrano:field', args=[10])))
+        self.assertEqual(link(self.request, 'serrano:field-values', 3),
+                         uri(reverse('serrano:field-values', args=[3])))
+        self.assertEqual(
+            link(self.request, 'serrano:views:revision_for_object', 1, 2),
+            uri(reverse('serrano:views:revision_for_object', args=[1, 2])))
+
+    def test_template(self):
+        self.assertEqual(get_link_template(self.request, 'serrano:field'),
+                         'http://testserver/api/fields/{0}/')
+
+        # Templates are cached on the request
+        self.assertTrue(get_link_template(self.request, 'serrano:field') is
+                        self.request._link_templates[('serrano:field', 1)])
+
+    @skipUnless(os.environ.get('SERRANO_BENCHMARK'),
+                'Set SERRANO_BENCHMARK to run benchmarks')
+    def test_benchmark(self):
+        uri = self.request.build_absolute_uri
+        names = ('serrano:field', 'serrano:field-values',
+                 'serrano:field-distribution', 'serrano:field-stats')
+        n = 3000
+
+        start = time.time()
+        for pk in range(n):
+            for name in names:
+                uri(reverse(name, args=[pk]))
+        reversed_time = time.time() - start
+
+        start = time.time()
+        for pk in range(n):
+            for name in names:
+                link(self.request, name, pk)
+        template_time = time.time() - start
+
+        print('\n{0} objects: reverse {1:.3f}s, link templates {2:.3f}s '
+              '({3:.1f}x)'.format(n, reversed_time, template_time,
+                                  reversed_time / template_time))
+
+        self.assertLess(template_time, reversed_time)
@@ -4,11 +4,14 @@ from django.conf.urls import url
 from django.contrib.sessions.backends.file import SessionStore
 from django.contrib.auth.models import User
 from django.core import mail, management
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.db import connection, reset_queries
 from django.http import HttpRequest
 from django.test import TestCase
 from django.test.utils import override_settings
 from avocado.models import DataConcept, DataConceptField, DataContext, \
-    DataField, DataView
+    DataField, DataQuery, DataView
 from serrano.forms import ContextForm, QueryForm, ViewForm
 from ...models import Employee, MockHandler
 
@@ -72,6 +75,35 @@ class ContextFormTestCase(BaseTestCase):
         instance = form.save()
         self.assertEqual(instance.count, expected_count)
 
+    def test_count_cache(self):
+        cache.clear()
+        json = {'field': 'tests.title.salary', 'operator': 'gt',
+                'value': '1000'}
+
+        form = ContextForm(self.request, {'json': json})
+        self.assertTrue(form.is_valid())
+        count = form.save().count
+
+        # Another user's context with the same filters reuses the count
+        other = HttpRequest()
+        other.session = SessionStore()
+        other.session.save()
+
+        form = ContextForm(other, {'json': json})
+        self.assertTrue(form.is_valid())
+
+        connection.use_debug_cursor = True
+        reset_queries()
+
+        try:
+            instance = form.save()
+        finally:
+            connection.use_debug_cursor = None
+
+        self.assertEqual(instance.count, count)
+        self.assertFalse([q for q in connection.queries
+                          if 'COUNT' in q['sql'] and 'tests_' in q['sql']])
+
     def test_no_commit(self):
         previous_context_count = DataContext.objects.count()
 
@@ -324,6 +356,57 @@ class QueryFormTestCase(BaseTestCase):
         self.assertEqual(instance.distinct_count, expected_count)
         self.assertEqual(instance.record_count, expected_count)
 
+    @override_settings(SERRANO_COUNT_DEFERRED=True,
+                       SERRANO_JOB_QUEUE='serrano.jobs.ImmediateQueue')
+    def test_deferred_count(self):
+        cache.clear()
+
+        request_started.send(sender=None)
+
+        form = QueryForm(self.request, {
+            'context_json': {'field': 'tests.title.salary',
+                             'operator': 'gt', 'value': '1000'},
+            'view_json': [{'concept': 1}],
+        })
+        self.assertTrue(form.is_valid())
+        instance = form.save()
+
+        # The counts are computed by the job after the query is saved
+        self.assertIsNone(instance.distinct_count)
+        self.assertIsNone(instance.record_count)
+
+        # The job is held until the transaction of the request is
+        # committed which is after the request has finished.
+        instance = DataQuery.objects.get(pk=instance.pk)
+        self.assertIsNone(instance.distinct_count)
+
+        request_finished.send(sender=None)
+
+        instance = DataQuery.objects.get(pk=instance.pk)
+        self.assertEqual(instance.distinct_count, Employee.objects.filter(
+            title__salary__gt=1000).count())
+        self.assertEqual(instance.record_count, Employee.objects.filter(
+            title__salary__gt=1000).count())
+
+    @override_settings(SERRANO_COUNT_DEFERRED=True,
+                       SERRANO_JOB_QUEUE='serrano.jobs.ImmediateQueue')
+    def test_deferred_count_no_request(self):
+        cache.clear()
+
+        form = QueryForm(self.request, {
+            'context_json': {'field': 'tests.title.salary',
+                             'operator': 'gt', 'value': '1000'},
+            'view_json': [{'concept': 1}],
+        })
+        self.assertTrue(form.is_valid())
+        instance = form.save()
+
+        # Outside of a request, such as in a management command, the job is
+        # queued immediately.
+        instance = DataQuery.objects.get(pk=instance.pk)
+        self.assertEqual(instance.distinct_count, Employee.objects.filter(
+            title__salary__gt=1000).count())
+
     def test_no_commit(self):
         previous_user_count = User.objects.count()
 
@@ -7,3 +7,6 @@ from .preview import *
 from .query import *
 from .view import *
 from .category import *
+from .serializers import *
+from .metadata import *
+from .value_index import *
@@ -20,6 +20,39 @@ class CategoryResourceTestCase(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(json.loads(response.content)), 1)
 
+    def test_get_all_etag(self):
+        response = self.client.get('/api/categories/',
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/api/categories/',
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+        self.assertEqual(response['ETag'], etag)
+
+        # Privileged users have a different representation
+        self.client.login(username='root', password='password')
+
+        response = self.client.get('/api/categories/',
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.client.logout()
+
+        category = DataCategory.objects.get(name='Title')
+        category.name = 'Titles'
+        category.save()
+
+        response = self.client.get('/api/categories/',
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_get_one(self):
         response = self.client.get('/api/categories/999/',
                                    HTTP_ACCEPT='application/json')
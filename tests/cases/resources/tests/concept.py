@@ -1,8 +1,11 @@
 import json
+from django.db import connection, reset_queries
 from django.test.utils import override_settings
 from avocado.models import DataConcept, DataConceptField, DataField, \
     DataCategory
 from avocado.events.models import Log
+from serrano.orphans import orphan_index
+from serrano.resources.concept import has_orphaned_field
 from .base import BaseTestCase
 
 
@@ -152,6 +155,25 @@ class ConceptResourceTestCase(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(json.loads(response.content)), 2)
 
+    def test_get_all_etag(self):
+        response = self.client.get('/api/concepts/', {'embed': True},
+                                   HTTP_ACCEPT='application/json')
+        etag = response['ETag']
+
+        response = self.client.get('/api/concepts/', {'embed': True},
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Embedded fields are part of the representation
+        self.name_field.description = 'The title'
+        self.name_field.save()
+
+        response = self.client.get('/api/concepts/', {'embed': True},
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
     @override_settings(SERRANO_CHECK_ORPHANED_FIELDS=False)
     def test_get_all_orphan_check_off(self):
         # Orphan one of the fields we are about to embed in the concepts we
@@ -171,6 +193,47 @@ class ConceptResourceTestCase(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(json.loads(response.content)), 2)
 
+    def _count_queries(self, *args, **kwargs):
+        connection.use_debug_cursor = True
+        reset_queries()
+
+        try:
+            response = self.client.get(*args, **kwargs)
+        finally:
+            connection.use_debug_cursor = None
+
+        return response, len(connection.queries)
+
+    def test_get_all_embed(self):
+        response = self.client.get('/api/concepts/', {'embed': True},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        for concept in json.loads(response.content):
+            fields = self.client.get(
+                '/api/concepts/{0}/fields/'.format(concept['id']),
+                HTTP_ACCEPT='application/json')
+            self.assertEqual(concept['fields'], json.loads(fields.content))
+
+    @override_settings(SERRANO_METADATA_CACHE_ENABLED=False)
+    def test_get_all_embed_queries(self):
+        # Warm up any process-wide caches
+        self.client.get('/api/concepts/', {'embed': True},
+                        HTTP_ACCEPT='application/json')
+
+        response, before = self._count_queries(
+            '/api/concepts/', {'embed': True}, HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+        # Publishing another concept with fields does not add queries
+        DataConcept.objects.filter(name='Salary').update(published=True)
+
+        response, after = self._count_queries(
+            '/api/concepts/', {'embed': True}, HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), 3)
+
+        self.assertEqual(before, after)
+
     def test_get_one(self):
         response = self.client.get('/api/concepts/999/',
                                    HTTP_ACCEPT='application/json')
@@ -269,3 +332,38 @@ class ConceptFieldResourceTestCase(BaseTestCase):
         response = self.client.get('/api/concepts/1/fields/',
                                    HTTP_ACCEPT='application/json')
         self.assertEqual(response.status_code, 200)
+
+
+class OrphanIndexTestCase(BaseTestCase):
+    def setUp(self):
+        super(OrphanIndexTestCase, self).setUp()
+
+        self.salary_field = DataField.objects.get_by_natural_key(
+            'tests', 'title', 'salary')
+
+        self.concept = DataConcept(name='Salary', published=True)
+        self.concept.save()
+        DataConceptField(concept=self.concept, field=self.salary_field).save()
+
+    def test_index(self):
+        self.assertEqual(orphan_index.fields, set())
+        self.assertEqual(orphan_index.concepts, set())
+
+        # Saving the field invalidates the index
+        self.salary_field.field_name = 'XXX'
+        self.salary_field.save()
+
+        self.assertEqual(orphan_index.fields, set([self.salary_field.pk]))
+        self.assertEqual(orphan_index.concepts, set([self.concept.pk]))
+
+        self.salary_field.field_name = 'salary'
+        self.salary_field.save()
+
+        self.assertEqual(orphan_index.fields, set())
+
+    def test_no_queries(self):
+        # Build the index
+        orphan_index.fields
+
+        with self.assertNumQueries(0):
+            self.assertFalse(has_orphaned_field(self.concept))
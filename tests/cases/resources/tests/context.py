@@ -1,6 +1,9 @@
 import json
+from django.core.cache import cache
+from django.test.utils import override_settings
 from restlib2.http import codes
 from avocado.models import DataContext
+from tests.models import Employee
 from .base import AuthenticatedBaseTestCase
 
 
@@ -125,6 +128,90 @@ class ContextResourceTestCase(AuthenticatedBaseTestCase):
         self.assertEqual(len(json.loads(response.content)), 2)
 
 
+class DeferredQueue(object):
+    "Queue that holds jobs until they are run explicitly."
+    jobs = []
+
+    def enqueue(self, func, *args, **kwargs):
+        self.jobs.append((func, args, kwargs))
+
+    @classmethod
+    def run(cls):
+        while cls.jobs:
+            func, args, kwargs = cls.jobs.pop(0)
+            func(*args, **kwargs)
+
+
+@override_settings(SERRANO_COUNT_DEFERRED=True)
+class DeferredCountTestCase(AuthenticatedBaseTestCase):
+    def setUp(self):
+        super(DeferredCountTestCase, self).setUp()
+        cache.clear()
+        DeferredQueue.jobs = []
+
+        self.json = {'field': 'tests.title.salary', 'operator': 'gt',
+                     'value': '1000'}
+        self.count = Employee.objects.filter(title__salary__gt=1000).count()
+
+    @override_settings(SERRANO_JOB_QUEUE='tests.cases.resources.tests.'
+                                         'context.DeferredQueue')
+    def test_pending(self):
+        response = self.client.post('/api/contexts/',
+            data=json.dumps({'json': self.json}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, codes.created)
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], None)
+        self.assertTrue(data['count_pending'])
+
+        url = '/api/contexts/{0}/'.format(data['id'])
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertTrue(json.loads(response.content)['count_pending'])
+
+        response = self.client.get('/api/contexts/',
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual([c['count_pending']
+                          for c in json.loads(response.content)], [True])
+
+        DeferredQueue.run()
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], self.count)
+        self.assertFalse(data['count_pending'])
+
+    @override_settings(SERRANO_JOB_QUEUE='tests.cases.resources.tests.'
+                                         'context.DeferredQueue')
+    def test_changed(self):
+        ctx = DataContext(user=self.user)
+        ctx.save()
+        url = '/api/contexts/{0}/'.format(ctx.pk)
+
+        self.client.put(url, data=json.dumps({'json': self.json}),
+                        content_type='application/json')
+        self.client.put(url, data=json.dumps({'json': {}}),
+                        content_type='application/json')
+
+        # The job for the previous filters does not store its count
+        DeferredQueue.run()
+        self.assertEqual(DataContext.objects.get(pk=ctx.pk).count,
+                         Employee.objects.count())
+
+    @override_settings(SERRANO_JOB_QUEUE='serrano.jobs.ImmediateQueue')
+    def test_cached(self):
+        self.client.post('/api/contexts/',
+            data=json.dumps({'json': self.json}),
+            content_type='application/json')
+
+        # The count of the same filters is cached and returned immediately
+        response = self.client.post('/api/contexts/',
+            data=json.dumps({'json': self.json}),
+            content_type='application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], self.count)
+        self.assertFalse(data['count_pending'])
+
+
 class ContextStatsResourceTestCase(AuthenticatedBaseTestCase):
     def test_pk(self):
         cxt = DataContext(session=True, user=self.user)
@@ -145,6 +232,37 @@ class ContextStatsResourceTestCase(AuthenticatedBaseTestCase):
         self.assertEqual(json.loads(response.content)['count'], 6)
 
 
+    def test_stored(self):
+        cache.clear()
+        cxt = DataContext(session=True, user=self.user, count=5)
+        cxt.save()
+        url = '/api/contexts/{0}/stats/'.format(cxt.pk)
+
+        # The stored count is served but may be stale
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(data['count_type'], 'stored')
+        self.assertTrue(data['stale'])
+
+        # The count is not written without a refresh
+        self.assertEqual(DataContext.objects.get(pk=cxt.pk).count, 5)
+
+        response = self.client.get(url + '?refresh=1',
+            HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 6)
+        self.assertEqual(data['count_type'], 'exact')
+        self.assertFalse(data['stale'])
+        self.assertEqual(DataContext.objects.get(pk=cxt.pk).count, 6)
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 6)
+        self.assertEqual(data['count_type'], 'cached')
+        self.assertFalse(data['stale'])
+
+
 class ContextsRevisionsResourceTestCase(AuthenticatedBaseTestCase):
     def test_get(self):
         ctx = DataContext(user=self.user)
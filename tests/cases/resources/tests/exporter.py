@@ -1,8 +1,17 @@
 import json
+import tempfile
 from django.test import TestCase
+from django.test.utils import override_settings
 from restlib2.http import codes
 from avocado.conf import OPTIONAL_DEPS
+from avocado.export import registry as exporters
+from avocado.models import DataConcept, DataConceptField, DataContext, \
+    DataField, DataView
+from avocado.query import pipeline
+from serrano.export import StreamBuffer, stream_export, iter_rows, \
+    rows_are_distinct, create_export_job, delete_export_job
 from serrano.resources import API_VERSION
+from .base import BaseTestCase
 
 
 class ExporterResourceTestCase(TestCase):
@@ -88,3 +97,163 @@ class ExporterResourceTestCase(TestCase):
     def test_export_bad_page_range(self):
         response = self.client.get('/api/data/export/csv/3...1/')
         self.assertEqual(response.status_code, codes.not_found)
+
+    def test_export_streaming(self):
+        response = self.client.get('/api/data/export/csv/?stream=1')
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response.get('Content-Disposition').startswith(
+            'attachment; filename="all'))
+        self.assertEqual(response.get('Content-Type'), 'text/csv')
+        self.assertEqual(''.join(response.streaming_content), '')
+
+    @override_settings(SERRANO_EXPORT_STREAMING=True)
+    def test_export_streaming_setting(self):
+        response = self.client.get('/api/data/export/csv/1/')
+        self.assertTrue(response.streaming)
+
+        response = self.client.get('/api/data/export/csv/1/?stream=0')
+        self.assertFalse(response.streaming)
+
+
+class StreamingExportTestCase(BaseTestCase):
+    def setUp(self):
+        super(StreamingExportTestCase, self).setUp()
+
+        field = DataField.objects.get_by_natural_key(
+            'tests', 'employee', 'first_name')
+        concept = DataConcept(name='First Name')
+        concept.save()
+        DataConceptField(concept=concept, field=field).save()
+
+        self.view = DataView(json=[{'concept': concept.pk}])
+
+    def test_output(self):
+        response = self.client.get('/api/data/export/json/')
+        expected = response.content
+        self.assertTrue(expected)
+
+        response = self.client.get('/api/data/export/json/?stream=1')
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(''.join(response.streaming_content), expected)
+
+    def test_distinct(self):
+        QueryProcessor = pipeline.query_processors.default
+        context = DataContext(json={
+            'field': 'tests.title.salary',
+            'operator': 'gt',
+            'value': 1000,
+        })
+
+        # Rows are only distinct if a context is applied
+        processor = QueryProcessor(view=self.view, include_pk=False)
+        exporter = processor.get_exporter(exporters['csv'])
+        self.assertFalse(rows_are_distinct(processor.get_queryset(),
+                                           exporter))
+
+        processor = QueryProcessor(context=context, view=self.view,
+                                   include_pk=False)
+        exporter = processor.get_exporter(exporters['csv'])
+        queryset = processor.get_queryset()
+        self.assertTrue(rows_are_distinct(queryset, exporter))
+
+        expected = exporter.write(processor.get_iterable()).getvalue()
+        chunks = stream_export(exporter, iter_rows(queryset),
+                               force_distinct=False)
+        self.assertEqual(''.join(chunks), expected)
+
+    def test_chunks(self):
+        QueryProcessor = pipeline.query_processors.default
+        processor = QueryProcessor(view=self.view, include_pk=False)
+        exporter = processor.get_exporter(exporters['csv'])
+        expected = exporter.write(processor.get_iterable()).getvalue()
+
+        buff = StreamBuffer(chunk_size=16)
+        chunks = list(stream_export(exporter, processor.get_iterable(), buff))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), expected)
+
+
+@override_settings(SERRANO_JOB_QUEUE='serrano.jobs.ImmediateQueue',
+                   SERRANO_EXPORT_JOB_ROOT=tempfile.gettempdir())
+class ExportJobTestCase(BaseTestCase):
+    def test_job(self):
+        response = self.client.post('/api/data/export/csv/?async=1',
+                                    data='{}', content_type='application/json',
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, codes.accepted)
+
+        job = json.loads(response.content)
+        self.assertEqual(job['status'], 'complete')
+        self.assertEqual(job['type'], 'csv')
+        self.assertTrue(job['rows'] > 0)
+        self.assertEqual(response['Location'], job['_links']['self']['href'])
+
+        response = self.client.get(job['_links']['self']['href'],
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertEqual(json.loads(response.content)['id'], job['id'])
+
+        response = self.client.get(job['_links']['download']['href'])
+        self.assertEqual(response.status_code, codes.ok)
+        self.assertTrue(response.get('Content-Disposition').startswith(
+            'attachment; filename="all'))
+        self.assertEqual(response.get('Content-Type'), 'text/csv')
+        self.assertTrue('export-type-csv' in response.cookies)
+
+        content = ''.join(response.streaming_content)
+        expected = self.client.get('/api/data/export/csv/').content
+        self.assertEqual(content, expected)
+
+        response = self.client.delete(job['_links']['self']['href'])
+        self.assertEqual(response.status_code, codes.no_content)
+
+        response = self.client.get(job['_links']['self']['href'],
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, codes.not_found)
+
+    def test_rows(self):
+        field = DataField.objects.get_by_natural_key(
+            'tests', 'employee', 'first_name')
+        concept = DataConcept(name='First Name')
+        concept.save()
+        DataConceptField(concept=concept, field=field).save()
+
+        view = DataView(json=[{'concept': concept.pk}])
+
+        # Duplicate rows and the rows before the offset are not written
+        job = create_export_job('csv', view, None, None, 'all.csv', offset=1)
+
+        with open(job['path']) as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual(job['status'], 'complete')
+        self.assertEqual(job['rows'], len(lines) - 1)
+
+        delete_export_job(job)
+
+    def test_sync_post(self):
+        response = self.client.post('/api/data/export/csv/', data='{}',
+                                    content_type='application/json')
+        self.assertTrue(response.get('Content-Disposition').startswith(
+            'attachment; filename="all'))
+
+    def test_owner(self):
+        self.client.login(username='root', password='password')
+
+        response = self.client.post('/api/data/export/csv/?async=1',
+                                    data='{}', content_type='application/json',
+                                    HTTP_ACCEPT='application/json')
+        job = json.loads(response.content)
+
+        self.client.logout()
+        response = self.client.get(job['_links']['self']['href'],
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, codes.not_found)
+
+    def test_unknown_job(self):
+        response = self.client.get(
+            '/api/data/export/jobs/{0}/'.format('a' * 32),
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, codes.not_found)
@@ -1,6 +1,18 @@
 import json
+import random
+from StringIO import StringIO
+from django.core import management
+from django.core.cache import cache
+from django.db import connection, reset_queries
+from django.test import TestCase
 from django.test.utils import override_settings
-from avocado.models import DataField
+from django.utils.unittest import skipUnless
+from avocado.models import DataField, DataContext
+from avocado.stats import kmeans
+from serrano.conf import dep_supported, OPTIONAL_DEPS
+from serrano.orphans import orphan_index
+from serrano.sampling import sample_values
+from serrano.stats import get_stats
 from avocado.events.models import Log
 from .base import BaseTestCase
 from tests.models import Project, Title
@@ -13,6 +25,56 @@ class FieldResourceTestCase(BaseTestCase):
         self.assertEqual(len(json.loads(response.content)), 5)
 
     @override_settings(SERRANO_CHECK_ORPHANED_FIELDS=True)
+    def test_get_all_etag(self):
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json')
+        etag = response['ETag']
+
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Parameters change the representation
+        response = self.client.get('/api/fields/', {'sort': 'name'},
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        field = DataField.objects.get_by_natural_key('tests', 'title', 'name')
+        field.description = 'The title'
+        field.save()
+
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_all_etag_update(self):
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json')
+        etag = response['ETag']
+
+        # The publish actions of the admin use an update which does not
+        # send signals.
+        DataField.objects.filter(
+            pk=DataField.objects.filter(published=True)[0].pk)\
+            .update(published=False)
+
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # Orphaned fields are removed from the representation
+        orphan_index.invalidate()
+
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
     def test_get_all_orphan(self):
         # Orphan one of the fields we are about to retrieve
         DataField.objects.filter(pk=2).update(field_name="XXX")
@@ -99,6 +161,39 @@ class FieldResourceTestCase(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(json.loads(response.content)), 3)
 
+    def test_values_random_sample(self):
+        field = DataField.objects.get_by_natural_key('tests', 'title', 'name')
+        names = set(Title.objects.values_list('name', flat=True))
+
+        values = sample_values(field, 5)
+        self.assertEqual(len(values), 5)
+        self.assertEqual(len(set(values)), 5)
+        self.assertTrue(set(v for v, l in values) <= names)
+
+        # Fewer distinct values than requested
+        self.assertEqual(set(v for v, l in sample_values(field, 20)), names)
+
+    def test_values_random_cache(self):
+        cache.clear()
+
+        response = self.client.get('/api/fields/2/values/?random=3',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), 3)
+
+        connection.use_debug_cursor = True
+        reset_queries()
+
+        try:
+            response = self.client.get('/api/fields/2/values/?random=3',
+                HTTP_ACCEPT='application/json')
+        finally:
+            connection.use_debug_cursor = None
+
+        # Values are drawn from the cached sample
+        self.assertEqual(len(json.loads(response.content)), 3)
+        self.assertFalse([q for q in connection.queries
+                          if 'tests_title' in q['sql']])
+
     def test_values_query(self):
         # Query values
         response = self.client.get('/api/fields/2/values/?query=a',
@@ -114,6 +209,71 @@ class FieldResourceTestCase(BaseTestCase):
         message = Log.objects.get(event='values', object_id=2)
         self.assertEqual(message.data['query'], 'a')
 
+    def test_values_page(self):
+        # title.name, values are read from the database per page
+        response = self.client.get('/api/fields/2/values/?limit=2&page=2',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 7)
+        self.assertFalse(data['count_capped'])
+        self.assertEqual(data['page_num'], 2)
+        self.assertEqual(data['values'], [
+            {'label': 'Guard', 'value': 'Guard'},
+            {'label': 'IT', 'value': 'IT'},
+        ])
+        self.assertTrue('prev' in data['_links'])
+        self.assertTrue('next' in data['_links'])
+
+    def test_values_cache(self):
+        cache.clear()
+        field = DataField.objects.get_by_natural_key('tests', 'title', 'name')
+        url = '/api/fields/{0}/values/?limit=2&query=a'.format(field.pk)
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+
+        connection.use_debug_cursor = True
+        reset_queries()
+
+        try:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        finally:
+            connection.use_debug_cursor = None
+
+        # The page and count are served from the cache
+        self.assertEqual(json.loads(response.content), data)
+        self.assertFalse([q for q in connection.queries
+                          if 'tests_title' in q['sql']])
+
+        Title(name='Architect').save()
+        management.call_command('avocado', 'data', 'tests',
+                                incr_version=True)
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 6)
+        self.assertEqual(data['values'][0]['value'], 'Analyst')
+        self.assertEqual(data['values'][1]['value'], 'Architect')
+
+    @override_settings(SERRANO_VALUES_COUNT_LIMIT=3)
+    def test_values_count_capped(self):
+        response = self.client.get('/api/fields/2/values/?limit=2&page=2',
+            HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+        self.assertTrue(data['count_capped'])
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(len(data['values']), 2)
+        self.assertTrue('next' in data['_links'])
+
+    def test_values_query_prefix(self):
+        response = self.client.get('/api/fields/2/values/?query=a&prefix=1',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['values'], [
+            {'label': 'Analyst', 'value': 'Analyst'},
+        ])
+
     def test_values_validate(self):
         # Valid, single dict
         response = self.client.post('/api/fields/2/values/',
@@ -205,6 +365,54 @@ class FieldResourceTestCase(BaseTestCase):
             {'value': 'Programmer', 'label': 'Programmer', 'valid': True},
         ])
 
+    @override_settings(SERRANO_VALUES_VALIDATE_CHUNK_SIZE=2)
+    def test_values_validate_chunked(self):
+        response = self.client.post('/api/fields/2/values/',
+            data=json.dumps([
+                {'value': 'IT'},
+                {'value': 'Bartender'},
+                {'value': 'Programmer'},
+                {'value': 'QA'},
+                {'label': 'Guard'},
+                {'label': 'Chef'},
+                {'label': 'Analyst'},
+            ]),
+            content_type='application/json',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d['valid'] for d in json.loads(response.content)],
+                         [True, False, True, True, True, False, True])
+
+    def test_values_validate_unhashable(self):
+        response = self.client.post('/api/fields/2/values/',
+            data=json.dumps([
+                {'value': 'IT'},
+                {'value': ['IT']},
+                {'label': {'name': 'IT'}},
+            ]),
+            content_type='application/json',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d['valid'] for d in json.loads(response.content)],
+                         [True, False, False])
+
+    def test_values_validate_upload(self):
+        field = DataField.objects.get_by_natural_key('tests', 'title',
+                                                     'salary')
+        upload = StringIO('15000\n\n12345\nabc\n100000\n')
+        upload.name = 'salaries.txt'
+
+        response = self.client.post(
+            '/api/fields/{0}/values/'.format(field.pk), {'file': upload},
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), [
+            {'value': 15000, 'label': 15000, 'valid': True},
+            {'value': 12345, 'label': '12345', 'valid': False},
+            {'value': 'abc', 'label': 'abc', 'valid': False},
+            {'value': 100000, 'label': 100000, 'valid': True},
+        ])
+
     def test_stats(self):
         # title.name
         response = self.client.get('/api/fields/2/stats/',
@@ -241,6 +449,92 @@ class FieldResourceTestCase(BaseTestCase):
         self.assertTrue(json.loads(response.content))
         self.assertTrue(Log.objects.filter(event='stats', object_id=2).exists())
 
+    def test_stats_cache(self):
+        cache.clear()
+
+        response = self.client.get('/api/fields/3/stats/',
+            HTTP_ACCEPT='application/json')
+        stats = json.loads(response.content)
+        self.assertEqual(stats['max'], 200000)
+        self.assertTrue(stats['computed'])
+
+        # Served from the cache until the data version changes
+        Title.objects.filter(salary=200000).update(salary=300000)
+
+        response = self.client.get('/api/fields/3/stats/',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), stats)
+
+        field = DataField.objects.get(pk=3)
+        field.data_version += 1
+        field.save()
+
+        response = self.client.get('/api/fields/3/stats/',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)['max'], 300000)
+
+    def test_stats_incr_version(self):
+        cache.clear()
+        field = DataField.objects.get(pk=3)
+
+        self.assertEqual(get_stats(field)['max'], 200000)
+
+        # The data version is incremented with an update, so the version
+        # of the instance is out of date.
+        Title.objects.filter(salary=200000).update(salary=300000)
+        management.call_command('avocado', 'data', 'tests',
+                                incr_version=True)
+
+        self.assertEqual(get_stats(field)['max'], 300000)
+
+        response = self.client.get('/api/fields/3/stats/',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)['max'], 300000)
+
+    def test_stats_aware(self):
+        cache.clear()
+
+        context = DataContext(user=self.user, session=True, json={
+            'field': 'tests.title.boss',
+            'operator': 'exact',
+            'value': True,
+        })
+        context.save()
+        self.client.login(username='root', password='password')
+
+        response = self.client.get('/api/fields/3/stats/',
+            HTTP_ACCEPT='application/json')
+        stats = json.loads(response.content)
+        self.assertEqual(stats['count'], Title.objects.count())
+
+        response = self.client.get('/api/fields/3/stats/', {'aware': True},
+            HTTP_ACCEPT='application/json')
+        aware = json.loads(response.content)
+
+        self.assertEqual(aware['count'], 1)
+        self.assertEqual(aware['min'], 200000)
+        self.assertEqual(aware['max'], 200000)
+        self.assertEqual(aware['avg'], 200000)
+
+        # Cached per context
+        Title.objects.filter(boss=True).update(salary=300000)
+
+        response = self.client.get('/api/fields/3/stats/', {'aware': True},
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), aware)
+
+    def test_warm_stats(self):
+        cache.clear()
+
+        management.call_command('warm_stats', workers=1, verbosity=0)
+
+        # Computed ahead of time
+        Title.objects.filter(salary=200000).update(salary=300000)
+
+        response = self.client.get('/api/fields/3/stats/',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)['max'], 200000)
+
     def test_dist(self):
         # title.salary
         response = self.client.get('/api/fields/3/dist/',
@@ -265,3 +559,115 @@ class FieldResourceTestCase(BaseTestCase):
             }],
         })
         self.assertTrue(Log.objects.filter(event='dist', object_id=3).exists())
+
+    @skipUnless(dep_supported('numpy'), 'NumPy is not installed')
+    @override_settings(SERRANO_DISTRIBUTION_CACHE_ENABLED=False)
+    def test_dist_numpy(self):
+        url = '/api/fields/3/dist/'
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        np_content = response.content
+
+        numpy = OPTIONAL_DEPS['numpy']
+        OPTIONAL_DEPS['numpy'] = None
+
+        try:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        finally:
+            OPTIONAL_DEPS['numpy'] = numpy
+
+        # Compared as text so integers and floats are distinguished
+        self.assertEqual(np_content, response.content)
+        for point in json.loads(np_content)['data']:
+            self.assertTrue(isinstance(point['values'][0], int))
+
+    def test_dist_cache(self):
+        cache.clear()
+
+        response = self.client.get('/api/fields/3/dist/',
+            HTTP_ACCEPT='application/json')
+        dist = json.loads(response.content)
+        self.assertEqual(dist['size'], 4)
+
+        # Served from the cache until the data version changes
+        Title.objects.filter(salary=200000).update(salary=300000)
+
+        response = self.client.get('/api/fields/3/dist/',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), dist)
+
+        # Different parameters are cached separately
+        response = self.client.get('/api/fields/3/dist/', {'nulls': True},
+            HTTP_ACCEPT='application/json')
+        self.assertNotEqual(json.loads(response.content), dist)
+
+        field = DataField.objects.get(pk=3)
+        field.data_version += 1
+        field.save()
+
+        response = self.client.get('/api/fields/3/dist/',
+            HTTP_ACCEPT='application/json')
+        self.assertNotEqual(json.loads(response.content), dist)
+
+    def test_dist_histogram(self):
+        # title.salary
+        response = self.client.get('/api/fields/3/dist/', {'bins': 2},
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {
+            u'size': 6,
+            u'bins': 2,
+            u'clustered': False,
+            u'outliers': [],
+            u'data': [{
+                u'count': 5,
+                u'min': 10000,
+                u'max': 105000,
+            }, {
+                u'count': 1,
+                u'min': 105000,
+                u'max': 200000,
+            }],
+        })
+
+        # Only a single numeric dimension is supported
+        response = self.client.get('/api/fields/2/dist/', {'bins': 2},
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 422)
+
+
+@skipUnless(dep_supported('numpy'), 'NumPy is not installed')
+class NumpyKmeansTestCase(TestCase):
+    def setUp(self):
+        random.seed(0)
+
+        self.points = [[random.gauss(0, 1) * 100, random.gauss(0, 1)]
+                       for _ in range(1000)]
+        self.points.append([10000, 100])
+        self.counts = [random.randint(1, 10) for _ in self.points]
+
+    def test_find_outliers(self):
+        import numpy as np
+        from serrano import kmeans as np_kmeans
+
+        self.assertEqual(
+            np_kmeans.find_outliers(np.array(self.points),
+                                    normalized=False).tolist(),
+            kmeans.find_outliers(self.points, normalized=False))
+
+    def test_weighted_counts(self):
+        import numpy as np
+        from serrano import kmeans as np_kmeans
+
+        points, outliers = kmeans.weighted_counts(self.points, self.counts,
+                                                  None)
+        np_points, np_outliers = np_kmeans.weighted_counts(
+            np.array(self.points), np.array(self.counts, dtype=float), None)
+
+        self.assertEqual(np_outliers, outliers)
+        self.assertEqual([p['count'] for p in np_points],
+                         [p['count'] for p in points])
+
+        for np_point, point in zip(np_points, points):
+            for np_value, value in zip(np_point['values'], point['values']):
+                self.assertAlmostEqual(np_value, value)
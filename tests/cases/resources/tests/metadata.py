@@ -0,0 +1,149 @@
+import json
+from django.core import management
+from django.db import connection, reset_queries
+from django.test.utils import override_settings
+from avocado.models import DataConcept, DataConceptField, DataField, \
+    DataCategory
+from serrano.metadata import metadata_cache, METADATA_MODELS
+from tests.models import Title
+from .base import BaseTestCase
+
+
+class MetadataCacheTestCase(BaseTestCase):
+    def setUp(self):
+        super(MetadataCacheTestCase, self).setUp()
+
+        self.salary_field = DataField.objects.get_by_natural_key(
+            'tests', 'title', 'salary')
+
+        self.category = DataCategory(name='Category', published=True)
+        self.category.save()
+
+        self.concept = DataConcept(name='Salary', published=True,
+                                   category=self.category)
+        self.concept.save()
+        DataConceptField(concept=self.concept, field=self.salary_field).save()
+
+    def _get_metadata_queries(self, *args, **kwargs):
+        connection.use_debug_cursor = True
+        reset_queries()
+
+        try:
+            response = self.client.get(*args, **kwargs)
+        finally:
+            connection.use_debug_cursor = None
+
+        self.assertEqual(response.status_code, 200)
+
+        return [q['sql'] for q in connection.queries
+                if 'avocado_data' in q['sql']]
+
+    def test_steady_state(self):
+        for url, params in [('/api/fields/', {}),
+                            ('/api/fields/{0}/'.format(self.salary_field.pk),
+                             {}),
+                            ('/api/concepts/', {'embed': True}),
+                            ('/api/concepts/{0}/'.format(self.concept.pk),
+                             {'embed': True}),
+                            ('/api/categories/', {})]:
+            self.assertTrue(self._get_metadata_queries(
+                url, params, HTTP_ACCEPT='application/json'))
+
+            # Served from memory, only the state of the metadata is read
+            queries = self._get_metadata_queries(
+                url, params, HTTP_ACCEPT='application/json')
+            self.assertTrue(queries)
+            self.assertTrue(all('COUNT(' in q for q in queries))
+
+    def test_invalidate_on_save(self):
+        url = '/api/concepts/{0}/'.format(self.concept.pk)
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)['name'], 'Salary')
+
+        self.concept.name = 'Pay'
+        self.concept.save()
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)['name'], 'Pay')
+
+        # Unpublished concepts are no longer found
+        self.concept.published = False
+        self.concept.save()
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalidate_on_delete(self):
+        response = self.client.get('/api/categories/',
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), 1)
+
+        self.category.delete()
+
+        response = self.client.get('/api/categories/',
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), 0)
+
+    def test_get(self):
+        queryset = DataField.objects.all()
+
+        self.assertEqual(metadata_cache.get(queryset, pk=self.salary_field.pk),
+                         self.salary_field)
+
+        # Only the state of the metadata is read
+        with self.assertNumQueries(len(METADATA_MODELS)):
+            metadata_cache.get(queryset, pk=self.salary_field.pk)
+
+        self.assertRaises(DataField.DoesNotExist, metadata_cache.get,
+                          queryset, pk=0)
+        self.assertRaises(DataField.MultipleObjectsReturned,
+                          metadata_cache.get, queryset)
+
+        self.assertEqual(metadata_cache.evaluate(queryset.none()), [])
+
+    def test_invalidate_on_update(self):
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json')
+        count = len(json.loads(response.content))
+        self.assertTrue(count > 1)
+
+        # The publish actions of the admin use an update which does not
+        # send signals.
+        DataField.objects.filter(pk=self.salary_field.pk)\
+            .update(published=False)
+
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), count - 1)
+
+        DataField.objects.filter(pk=self.salary_field.pk)\
+            .update(published=True)
+
+        response = self.client.get('/api/fields/',
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), count)
+
+    @override_settings(SERRANO_METADATA_CACHE_MAX_SIZE=2)
+    def test_max_size(self):
+        queryset = DataField.objects.all()
+
+        for pk in DataField.objects.values_list('pk', flat=True)[:3]:
+            metadata_cache.get(queryset, pk=pk)
+
+        self.assertEqual(len(metadata_cache._results), 2)
+
+    def test_data_version(self):
+        url = '/api/fields/{0}/stats/'.format(self.salary_field.pk)
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)['max'], 200000)
+
+        # The data version is incremented with an update which does not
+        # invalidate the metadata cache.
+        Title.objects.filter(salary=200000).update(salary=300000)
+        management.call_command('avocado', 'data', 'tests',
+                                incr_version=True)
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content)['max'], 300000)
@@ -1,9 +1,20 @@
 import json
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import override_settings
+from avocado.models import DataConcept, DataConceptField, DataField, \
+    DataView
+from serrano.cache import VERSION_CACHE_KEY
+from serrano.resources.preview import acquire_prefetch_slot
+from .base import BaseTestCase
 
 
 class PreviewResourceTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_get(self):
         response = self.client.get('/api/data/preview/',
             HTTP_ACCEPT='application/json')
@@ -21,6 +32,7 @@ class PreviewResourceTestCase(TestCase):
             'keys': [],
             'count': 0,
             'object_count': 0,
+            'count_type': 'exact',
             'object_name': 'employee',
             'object_name_plural': 'employees',
             'objects': [],
@@ -29,6 +41,16 @@ class PreviewResourceTestCase(TestCase):
             'limit': 20,
         })
 
+    def test_get_unlimited(self):
+        response = self.client.get('/api/data/preview/?limit=0',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        content = json.loads(response.content)
+        self.assertEqual(content['objects'], [])
+        self.assertEqual(content['limit'], 0)
+        self.assertEqual(content['num_pages'], 1)
+
     def test_get_with_user(self):
         self.user = User.objects.create_user(username='test', password='test')
         self.client.login(username='test', password='test')
@@ -49,6 +71,7 @@ class PreviewResourceTestCase(TestCase):
             'keys': [],
             'count': 0,
             'object_count': 0,
+            'count_type': 'exact',
             'object_name': 'employee',
             'object_name_plural': 'employees',
             'objects': [],
@@ -56,3 +79,283 @@ class PreviewResourceTestCase(TestCase):
             'num_pages': 1,
             'limit': 20,
         })
+
+
+class PreviewCursorTestCase(BaseTestCase):
+    def setUp(self):
+        super(PreviewCursorTestCase, self).setUp()
+
+        field = DataField.objects.get_by_natural_key('tests', 'title',
+                                                     'salary')
+        self.concept = DataConcept(name='Salary')
+        self.concept.save()
+        DataConceptField(concept=self.concept, field=field).save()
+
+    def _read_pages(self, path, data=None):
+        pks = []
+        pages = 0
+
+        while path:
+            if data is None:
+                response = self.client.get(path,
+                    HTTP_ACCEPT='application/json')
+            else:
+                response = self.client.post(path, json.dumps(data),
+                    content_type='application/json',
+                    HTTP_ACCEPT='application/json')
+
+            self.assertEqual(response.status_code, 200)
+            content = json.loads(response.content)
+
+            self.assertNotIn('count', content)
+            self.assertLessEqual(len(content['objects']), 2)
+
+            pks.extend([o['pk'] for o in content['objects']])
+            pages += 1
+
+            path = content['_links'].get('next', {}).get('href')
+
+        return pks, pages
+
+    def test_get(self):
+        pks, pages = self._read_pages('/api/data/preview/?cursor=&limit=2')
+
+        self.assertEqual(pks, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(pages, 3)
+
+    def test_ordered(self):
+        view = [{'concept': self.concept.pk, 'sort': 'desc'}]
+        pks, pages = self._read_pages('/api/data/preview/?cursor=&limit=2',
+                                      data={'view': view})
+
+        # Ties on salary are ordered by the primary key
+        self.assertEqual(pks, [4, 2, 1, 3, 5, 6])
+
+    def test_links(self):
+        response = self.client.get('/api/data/preview/?cursor=&limit=4',
+            HTTP_ACCEPT='application/json')
+        content = json.loads(response.content)
+
+        self.assertEqual(content['limit'], 4)
+        self.assertEqual(content['cursor'], '')
+        self.assertEqual(content['_links']['self']['href'],
+                         'http://testserver/api/data/preview/?cursor=&limit=4')
+        self.assertTrue('next' in content['_links'])
+
+        response = self.client.get(content['_links']['next']['href'],
+            HTTP_ACCEPT='application/json')
+        content = json.loads(response.content)
+
+        self.assertEqual(len(content['objects']), 2)
+        self.assertFalse('next' in content['_links'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/data/preview/?cursor=foo',
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class PreviewCountTestCase(BaseTestCase):
+    def setUp(self):
+        super(PreviewCountTestCase, self).setUp()
+        cache.clear()
+
+        # Counts are cached per user or session
+        self.client.login(username='root', password='password')
+
+    def _get(self, path='/api/data/preview/', data=None):
+        if data is None:
+            response = self.client.get(path, HTTP_ACCEPT='application/json')
+        else:
+            response = self.client.post(path, json.dumps(data),
+                content_type='application/json',
+                HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_cached(self):
+        content = self._get()
+        self.assertEqual(content['object_count'], 6)
+        self.assertEqual(content['count_type'], 'exact')
+
+        content = self._get('/api/data/preview/?page=2&limit=2')
+        self.assertEqual(content['object_count'], 6)
+        self.assertEqual(content['num_pages'], 3)
+        self.assertEqual(content['count_type'], 'cached')
+
+    def test_owner(self):
+        self._get()
+        self.assertEqual(self._get()['count_type'], 'cached')
+
+        User.objects.create_user(username='other', password='password')
+        self.client.logout()
+        self.client.login(username='other', password='password')
+
+        # The queryset of the query processor may depend on the user
+        self.assertEqual(self._get()['count_type'], 'exact')
+
+    def test_no_owner(self):
+        self.client.logout()
+
+        self._get()
+        self.assertEqual(self._get()['count_type'], 'exact')
+
+    def test_context_changed(self):
+        self._get()
+
+        field = DataField.objects.get_by_natural_key('tests', 'title',
+                                                     'salary')
+        context = {'field': field.pk, 'operator': 'gt', 'value': 15000}
+
+        content = self._get(data={'context': context})
+        self.assertEqual(content['object_count'], 2)
+        self.assertEqual(content['count_type'], 'exact')
+
+        content = self._get(data={'context': context})
+        self.assertEqual(content['count_type'], 'cached')
+
+    def test_data_version(self):
+        self._get()
+
+        DataField.objects.update(data_version=F('data_version') + 1)
+
+        content = self._get()
+        self.assertEqual(content['count_type'], 'exact')
+
+    def test_unlimited(self):
+        content = self._get('/api/data/preview/?limit=0')
+        self.assertEqual(len(content['objects']), 6)
+        self.assertEqual(content['object_count'], 6)
+        self.assertEqual(content['limit'], 0)
+        self.assertEqual(content['num_pages'], 1)
+        self.assertEqual(content['count_type'], 'exact')
+
+        content = self._get('/api/data/preview/?limit=0')
+        self.assertEqual(len(content['objects']), 6)
+        self.assertEqual(content['count_type'], 'cached')
+
+    def test_estimate(self):
+        # Estimates are not supported by SQLite so an exact count is used
+        content = self._get('/api/data/preview/?estimate=true')
+        self.assertEqual(content['object_count'], 6)
+        self.assertEqual(content['count_type'], 'exact')
+
+
+class PreviewCacheTestCase(BaseTestCase):
+    def setUp(self):
+        super(PreviewCacheTestCase, self).setUp()
+        cache.clear()
+
+        self.client.login(username='root', password='password')
+
+        DataView(user=self.user, session=True).save()
+
+    def _get(self, path='/api/data/preview/'):
+        response = self.client.get(path, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit(self):
+        response = self._get()
+        self.assertEqual(response['X-Serrano-Cache'], 'MISS')
+
+        cached = self._get()
+        self.assertEqual(cached['X-Serrano-Cache'], 'HIT')
+        self.assertEqual(json.loads(cached.content)['objects'],
+                         json.loads(response.content)['objects'])
+
+        response = self._get('/api/data/preview/?page=2&limit=2')
+        self.assertEqual(response['X-Serrano-Cache'], 'MISS')
+        self.assertEqual([o['pk'] for o in
+                          json.loads(response.content)['objects']], [3, 4])
+
+    def test_unlimited(self):
+        response = self._get('/api/data/preview/?limit=0')
+        self.assertFalse(response.has_header('X-Serrano-Cache'))
+
+    def test_invalidate(self):
+        self._get()
+
+        response = self.client.put('/api/views/session/',
+            data=u'{"name":"Session"}', content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self._get()
+        self.assertEqual(response['X-Serrano-Cache'], 'MISS')
+
+    def test_owner(self):
+        other = User.objects.create_user(username='other',
+                                         password='password')
+        DataView(user=other, session=True).save()
+
+        # The versions of the cached pages of both users are the same
+        for user in (self.user, other):
+            cache.set(VERSION_CACHE_KEY.format(
+                'preview:{0}'.format('user:{0}'.format(user.pk))), 1)
+
+        self.assertEqual(self._get()['X-Serrano-Cache'], 'MISS')
+
+        self.client.logout()
+        self.client.login(username='other', password='password')
+
+        self.assertEqual(self._get()['X-Serrano-Cache'], 'MISS')
+        self.assertEqual(self._get()['X-Serrano-Cache'], 'HIT')
+
+    def test_no_owner(self):
+        self.client.logout()
+
+        # Requests without a user or session are not cached
+        response = self._get()
+        self.assertFalse(response.has_header('X-Serrano-Cache'))
+
+    @override_settings(SERRANO_PREVIEW_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self._get()
+        response = self._get()
+        self.assertFalse(response.has_header('X-Serrano-Cache'))
+
+
+@override_settings(SERRANO_JOB_QUEUE='serrano.jobs.ImmediateQueue')
+class PreviewPrefetchTestCase(BaseTestCase):
+    def setUp(self):
+        super(PreviewPrefetchTestCase, self).setUp()
+        cache.clear()
+
+        self.client.login(username='root', password='password')
+
+        DataView(user=self.user, session=True).save()
+
+    def _get(self, path):
+        response = self.client.get(path, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_prefetch(self):
+        response = self._get('/api/data/preview/?limit=2&prefetch=true')
+        self.assertEqual(response['X-Serrano-Cache'], 'MISS')
+
+        # The second page was cached by the prefetch
+        response = self._get('/api/data/preview/?limit=2&page=2')
+        self.assertEqual(response['X-Serrano-Cache'], 'HIT')
+        self.assertEqual([o['pk'] for o in
+                          json.loads(response.content)['objects']], [3, 4])
+
+        response = self._get('/api/data/preview/?limit=2&page=3')
+        self.assertEqual(response['X-Serrano-Cache'], 'MISS')
+
+    def test_not_prefetched(self):
+        self._get('/api/data/preview/?limit=2')
+
+        response = self._get('/api/data/preview/?limit=2&page=2')
+        self.assertEqual(response['X-Serrano-Cache'], 'MISS')
+
+    def test_limit(self):
+        # Simulate a prefetch that is still running
+        self.assertTrue(acquire_prefetch_slot('user:{0}'.format(
+            self.user.pk)))
+
+        self._get('/api/data/preview/?limit=2&prefetch=true')
+
+        response = self._get('/api/data/preview/?limit=2&page=2')
+        self.assertEqual(response['X-Serrano-Cache'], 'MISS')
@@ -2,6 +2,7 @@ import json, time
 from datetime import datetime
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.cache import cache
 from django.test.utils import override_settings
 from restlib2.http import codes
 from avocado.models import DataQuery
@@ -462,6 +463,37 @@ class QueryStatsResourceTestCase(AuthenticatedBaseTestCase):
         self.assertEqual(data['record_count'], 6)
 
 
+    def test_stored(self):
+        cache.clear()
+        query = DataQuery(session=True, user=self.user, distinct_count=5,
+                          record_count=5)
+        query.save()
+        url = '/api/queries/{0}/stats/'.format(query.pk)
+
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+        # The distinct count is of the context alone and is not stored
+        self.assertEqual(data['distinct_count'], 6)
+        self.assertEqual(data['record_count'], 5)
+        self.assertTrue(data['stale'])
+
+        # The counts are not written without a refresh
+        query = DataQuery.objects.get(pk=query.pk)
+        self.assertEqual(query.distinct_count, 5)
+        self.assertEqual(query.record_count, 5)
+
+        response = self.client.get(url + '?refresh=1',
+            HTTP_ACCEPT='application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['distinct_count'], 6)
+        self.assertEqual(data['record_count'], 6)
+        self.assertFalse(data['stale'])
+
+        query = DataQuery.objects.get(pk=query.pk)
+        self.assertEqual(query.distinct_count, 5)
+        self.assertEqual(query.record_count, 6)
+
+
 class EmailTestCase(BaseTestCase):
     subject = 'Email_Subject'
     message = str([i for i in range(5000)])
@@ -0,0 +1,98 @@
+import functools
+from preserialize.serialize import serialize as _serialize
+from avocado.history.models import Revision
+from avocado.models import DataCategory, DataConcept, DataConceptField, \
+    DataContext, DataField, DataQuery, DataView
+from serrano.resources import templates
+from serrano.resources.serializers import serialize
+from .base import BaseTestCase
+
+
+def posthook(instance, data, request=None):
+    data['_links'] = {'self': instance.pk}
+    return data
+
+
+class CompiledTemplateTestCase(BaseTestCase):
+    def setUp(self):
+        super(CompiledTemplateTestCase, self).setUp()
+
+        category = DataCategory(name='Category', published=True)
+        category.save()
+
+        DataCategory(name='Subcategory', parent=category).save()
+
+        for i, field in enumerate(DataField.objects.all()):
+            concept = DataConcept(name='Concept {0}'.format(i),
+                                  category=category, published=True)
+            concept.save()
+            DataConceptField(concept=concept, field=field,
+                             name='Alt {0}'.format(i)).save()
+
+        DataContext(user=self.user, name='Context', json={}).save()
+        DataView(user=self.user, name='View', json=[]).save()
+
+        query = DataQuery(user=self.user, name='Query')
+        query.save()
+        query.shared_users.add(self.user)
+
+        DataQuery(user=self.user, name='Fork', parent=query).save()
+
+    def assertEquivalent(self, objects, template):
+        self.assertTrue(objects)
+
+        self.assertEqual(serialize(objects, **template),
+                         _serialize(objects, **template))
+
+        # Single instances
+        for obj in objects:
+            self.assertEqual(serialize(obj, **template),
+                             _serialize(obj, **template))
+
+        # With a posthook
+        hook = functools.partial(posthook, request=None)
+        self.assertEqual(serialize(objects, posthook=hook, **template),
+                         _serialize(objects, posthook=hook, **template))
+
+    def test_category(self):
+        self.assertEquivalent(DataCategory.objects.all(), templates.Category)
+
+    def test_field(self):
+        fields = DataField.objects.all()
+        self.assertEquivalent(fields, templates.Field)
+        self.assertEquivalent(fields, templates.BriefField)
+
+    def test_concept(self):
+        concepts = DataConcept.objects.all()
+        self.assertEquivalent(concepts, templates.Concept)
+        self.assertEquivalent(concepts, templates.BriefConcept)
+
+    def test_concept_field(self):
+        self.assertEquivalent(DataConceptField.objects.all(),
+                              templates.ConceptField)
+
+    def test_context(self):
+        self.assertEquivalent(DataContext.objects.all(), templates.Context)
+
+    def test_view(self):
+        self.assertEquivalent(DataView.objects.all(), templates.View)
+
+    def test_query(self):
+        queries = DataQuery.objects.all()
+        self.assertEquivalent(queries, templates.Query)
+        self.assertEquivalent(queries, templates.BriefQuery)
+        self.assertEquivalent(queries, templates.ForkedQuery)
+
+    def test_revision(self):
+        self.assertEquivalent(Revision.objects.all(), templates.Revision)
+
+    def test_list(self):
+        fields = list(DataField.objects.all())
+        self.assertEqual(serialize(fields, **templates.Field),
+                         _serialize(fields, **templates.Field))
+
+    def test_prehook(self):
+        template = dict(templates.BriefField, prehook={'published': True})
+        fields = DataField.objects.all()
+        self.assertEqual(serialize(fields, **template),
+                         _serialize(fields, **template))
@@ -0,0 +1,97 @@
+import json
+from django.db import connection, reset_queries
+from django.test.utils import override_settings
+from avocado.models import DataField
+from serrano.value_index import value_indexes
+from tests.models import Title
+from .base import BaseTestCase
+
+
+@override_settings(SERRANO_VALUE_INDEX_ENABLED=True)
+class ValueIndexTestCase(BaseTestCase):
+    def setUp(self):
+        super(ValueIndexTestCase, self).setUp()
+        value_indexes.reset()
+
+        self.field = DataField.objects.get_by_natural_key(
+            'tests', 'title', 'name')
+        self.url = '/api/fields/{0}/values/'.format(self.field.pk)
+
+    def tearDown(self):
+        value_indexes.reset()
+
+    def _get_values(self, **params):
+        connection.use_debug_cursor = True
+        reset_queries()
+
+        try:
+            response = self.client.get(self.url, params,
+                                       HTTP_ACCEPT='application/json')
+        finally:
+            connection.use_debug_cursor = None
+
+        self.assertEqual(response.status_code, 200)
+
+        queries = [q['sql'] for q in connection.queries
+                   if 'tests_title' in q['sql']]
+
+        return json.loads(response.content)['values'], queries
+
+    def test_search(self):
+        index = value_indexes.get(self.field)
+
+        self.assertEqual(index.prefix('a'), [('Analyst', 'Analyst')])
+        self.assertEqual(index.contains('a'), [
+            ('Analyst', 'Analyst'),
+            ('Guard', 'Guard'),
+            ('Lawyer', 'Lawyer'),
+            ('Programmer', 'Programmer'),
+            ('QA', 'QA'),
+        ])
+        self.assertEqual(index.prefix('z'), [])
+
+    def test_values(self):
+        values, queries = self._get_values(query='a')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([v['value'] for v in values],
+                         ['Analyst', 'Guard', 'Lawyer', 'Programmer', 'QA'])
+
+        # Served from the index
+        values, queries = self._get_values(query='g')
+        self.assertEqual(queries, [])
+        self.assertEqual([v['value'] for v in values],
+                         ['Guard', 'Programmer'])
+
+        values, queries = self._get_values(limit=2, page=2)
+        self.assertEqual(queries, [])
+        self.assertEqual([v['value'] for v in values], ['Guard', 'IT'])
+
+    def test_data_version(self):
+        self.assertEqual(value_indexes.get(self.field).prefix('d'), [])
+
+        Title(name='Designer').save()
+        DataField.objects.filter(pk=self.field.pk).update(
+            data_version=self.field.data_version + 1)
+
+        self.assertEqual(value_indexes.get(self.field).prefix('d'),
+                         [('Designer', 'Designer')])
+
+    @override_settings(SERRANO_VALUE_INDEX_MAX_SIZE=3)
+    def test_max_size(self):
+        self.assertEqual(value_indexes.get(self.field), None)
+
+        values, queries = self._get_values(query='a')
+        self.assertEqual(len(values), 5)
+
+    def test_memory_limit(self):
+        other = DataField(app_name='tests', model_name='title',
+                           field_name='name', search_field_name='name')
+        other.pk = self.field.pk + 1000
+
+        first = value_indexes.get(self.field)
+
+        with self.settings(SERRANO_VALUE_INDEX_MEMORY_LIMIT=first.size):
+            value_indexes.get(other)
+
+        self.assertEqual(value_indexes.size, first.size)
+        self.assertTrue(self.field.pk not in value_indexes._indexes)